@@ -0,0 +1,129 @@
+# division_names.py
+"""
+Checks division_name / division_names (lookup table, project.utils) against the former
+startswith chain, then times division_names over a listing of projects.
+
+Run from the repository root: python -m benchmarks.division_names [--projects 2000]
+"""
+
+import argparse
+import random
+import timeit
+
+from project.project import levels
+from project.utils import division_name, division_names
+
+
+def reference_division_name(canonical_division, arg=""):
+    """Former implementation of division_name (before the lookup table)."""
+    division = canonical_division
+    space = " " if "S" in arg else ""
+
+    if division.startswith("0"):
+        if "F" in arg:
+            return "Terminale" + (" " + division[-1].upper()) * (len(division) > 1)
+        else:
+            return (
+                "Terminale"
+                if len(division) == 1
+                else "Te" + (space + division[-1].upper()) * (len(division) > 1)
+            )
+    elif division.startswith("1"):
+        if "F" in arg:
+            return "1re" + (space + division[-1].upper()) * (len(division) > 1)
+        else:
+            return (
+                "1re"
+                if len(division) == 1
+                else "1e" + (space + division[-1].upper()) * (len(division) > 1)
+            )
+    elif division.startswith("2"):
+        if "F" in arg:
+            return "2de" + (space + division[-1].upper()) * (len(division) > 1)
+        else:
+            return (
+                "2de"
+                if len(division) == 1
+                else "2e" + (space + division[-1].upper()) * (len(division) > 1)
+            )
+    elif division.startswith(("3", "4", "5", "6")):
+        return division[0] + "e" + (space + division[-1].upper()) * (len(division) > 1)
+    elif division.startswith(("cm", "ce")):
+        if "F" in arg:
+            return division[:3].upper() + (space + division[-1].upper()) * (len(division) > 3)
+        else:
+            return division[:3] + (space + division[-1].upper()) * (len(division) > 3)
+    elif division.startswith("mgs"):
+        if "F" in arg:
+            return "MS/GS" + (space + division[-1].upper()) * (len(division) > 3)
+        else:
+            return "ms/gs" + (space + division[-1].upper()) * (len(division) > 3)
+    elif division.startswith("pms"):
+        if "F" in arg:
+            return "PS/MS" + (space + division[-1].upper()) * (len(division) > 3)
+        else:
+            return "ps/ms" + (space + division[-1].upper()) * (len(division) > 3)
+    elif division.startswith(("cp", "gs", "ms", "ps")):
+        if "F" in arg:
+            return division[:2].upper() + (space + division[-1].upper()) * (len(division) > 2)
+        else:
+            return division[:2] + (space + division[-1].upper()) * (len(division) > 2)
+    else:
+        return ""
+
+
+def reference_division_names(divisions, arg=""):
+    """Former implementation of division_names."""
+    separator = ", " if "s" in arg else ","
+    arg = arg.replace("s", "")
+    return separator.join([reference_division_name(div, arg) for div in divisions])
+
+
+# known levels with usual and unusual letters, and codes of no level
+CODES = [level + letter for level in levels["LFS"] for letter in ("", "a", "b", "d", "e", "z", "A")]
+CODES += ["", "x", "7", "cm", "mg", "pmsq"]
+ARGS = ["", "F", "S", "FS", "SF", "Fs", "s", "FSs", "X"]
+
+
+def check_equivalence(rnd):
+    for code in CODES:
+        for arg in ARGS:
+            expected = reference_division_name(code, arg)
+            assert division_name(code, arg) == expected, (code, arg)
+
+    for _ in range(5000):
+        divisions = rnd.sample(CODES, rnd.randint(0, 6))
+        arg = rnd.choice(ARGS)
+        assert division_names(divisions, arg) == reference_division_names(divisions, arg), (
+            divisions,
+            arg,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--projects", type=int, default=2000, help="projects of the listing")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    check_equivalence(rnd)
+    print("division_name / division_names: same output as the former implementation")
+
+    # divisions of a listing, as in the projects tables (division_names(..., "Fs"))
+    common = [level + letter for level in levels["LFS"] for letter in ("", "a", "b")]
+    projects = [rnd.sample(common, rnd.randint(1, 4)) for _ in range(args.projects)]
+
+    for name, function in [("former", reference_division_names), ("current", division_names)]:
+        seconds = min(
+            timeit.repeat(
+                lambda function=function: [function(divisions, "Fs") for divisions in projects],
+                number=20,
+                repeat=5,
+            )
+        )
+        print(f"{name:>8}: {seconds / 20 * 1000:.2f} ms for {args.projects} projects")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# division_stats.py
+"""
+Checks calculate_distribution (project.data) against its former implementation (one
+filter per category value) on synthetic projects: same tables, keys and values. Then
+times both.
+
+Runs on a temporary SQLite database (school year with the default divisions).
+Run from the repository root: python -m benchmarks.division_stats [--projects 5000 50000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+# temporary development database, set before the app is imported
+DATABASE_URI = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+os.environ.update(
+    FLASK_ENV="development",
+    SECRET_KEY="benchmark",
+    USE_GMAIL_SERVICE="false",
+    APP_EMAIL="benchmark@example.com",
+    DOMAIN="example.com",
+    DEV_DATABASE_URI=DATABASE_URI,
+)
+# required by the production config class, not used
+os.environ.setdefault("PROD_DATABASE_URI", DATABASE_URI)
+
+import pandas as pd  # noqa: E402
+
+from project import create_app  # noqa: E402
+from project.data import calculate_distribution  # noqa: E402
+from project.project import choices  # noqa: E402
+from project.utils import auto_school_year, division_name, get_divisions  # noqa: E402
+
+
+def reference_calculate_distribution(df, sy, choices):
+    """Former calculate_distribution (one filter per category, iterrows), unchanged."""
+    N = len(df)
+    data = {}
+
+    # Projet d'établissement
+    data["pe"] = []
+    data["pe_chart"] = []  # charts for PE
+    for axis, priorities in choices["pe"].items():
+        dff = df[df.axis == axis]
+        n = len(dff)
+        data["pe"].append(
+            {
+                "axis": axis,
+                "count": n if n else "-",
+                "percentage": f"{n / N * 100:.0f}%" if n and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+        for priority in priorities:
+            dff = df[df.priority == priority]
+            p = len(dff)
+            data["pe"].append(
+                {
+                    "priority": priority,
+                    "count": p if p else "-",
+                    "percentage": f"{p / n * 100:.0f}%" if p and n else "",
+                    "projects": [
+                        {"id": index, "title": row["title"]} for index, row in dff.iterrows()
+                    ],
+                }
+            )
+            data["pe_chart"].append(
+                {
+                    "axis": axis,
+                    "priority": priority,
+                    "count": p,
+                }
+            )
+    data["pe"].append({"total": N})
+
+    # Departments
+    data["departments"] = []
+    exploded_df = df.explode("departments")
+
+    for department in choices["departments"]:
+        dff = exploded_df[exploded_df["departments"] == department]
+        d = len(dff)
+
+        data["departments"].append(
+            {
+                "category": department,
+                "count": d if d else "-",
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+
+    data["departments"].append({"total": N})
+
+    # teachers
+    # --- 1. Map Every Department to 4 Sections ---
+    sections = ["Secondaire", "Élémentaire", "Maternelle", "Administration"]
+    dept_to_section = {}
+
+    # Section Secondaire
+    for dept in choices["Secondaire"]:
+        dept_to_section[dept] = "Secondaire"
+    dept_to_section["Vie Scolaire"] = "Secondaire"
+
+    # Sections Élémentaire and Maternelle
+    dept_to_section["Élémentaire"] = "Élémentaire"
+    dept_to_section["Maternelle"] = "Maternelle"
+    dept_to_section["ASEM"] = "Maternelle"
+
+    # Section Administration
+    dept_to_section["Administration"] = "Administration"
+
+    # --- 2. Calculate Global Project Totals per Table ---
+    # Maps the project's list of departments to its primary display section
+    def determine_project_section(dept_list):
+        if isinstance(dept_list, list) and len(dept_list) > 0:
+            # Check the first department listed on the project to categorize it
+            return dept_to_section.get(dept_list[0], "Administration")
+        return "Administration"
+
+    df["project_section"] = df["departments"].apply(determine_project_section)
+    section_totals = df["project_section"].value_counts().to_dict()
+
+    # --- 3. Parallel Explode ---
+    # Unpack BOTH lists simultaneously to maintain index alignment
+    df_exploded = df.explode(["members", "departments"]).dropna(subset=["members"])
+
+    # Map the unpacked department string directly to the target table
+    df_exploded["teacher_section"] = (
+        df_exploded["departments"].map(dept_to_section).fillna("Administration")
+    )
+
+    # Pre-format project payload info
+    df_exploded["project_info"] = df_exploded.apply(
+        lambda r: {"id": r["id"], "title": r["title"]}, axis=1
+    )
+
+    # --- 4. Vectorized Aggregation ---
+    # Group directly by the names already present in 'members'
+    grouped = (
+        df_exploded.groupby(["members", "teacher_section"])
+        .agg(count=("id", "count"), projects=("project_info", list))
+        .reset_index()
+    )
+
+    # --- 5. Construct Final Output ---
+    for section in sections:
+        data[section] = []
+
+    for _, row in grouped.iterrows():
+        sect = row["teacher_section"]
+        total_projects = section_totals.get(sect, 1)  # Safeguard against division by zero
+
+        data[sect].append(
+            {
+                "category": row["members"],
+                "count": row["count"],
+                "percentage": f"{(row['count'] / total_projects) * 100:.0f}%",
+                "projects": row["projects"],
+            }
+        )
+
+    # Append structural total rows to the bottom of each of the 4 tables
+    for section in sections:
+        data[section].append({"total": section_totals.get(section, 0)})
+
+    # Paths
+    data["paths"] = []
+    exploded_paths = df.explode("paths")
+
+    for path in choices["paths"]:
+        dff = exploded_paths[exploded_paths["paths"] == path]
+        d = len(dff)
+
+        data["paths"].append(
+            {
+                "category": path,
+                "count": d if d else "-",
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+
+    data["paths"].append({"total": N})
+
+    # Skills
+    data["skills"] = []
+    exploded_skills = df.explode("skills")
+
+    for skill in choices["skills"]:
+        dff = exploded_skills[exploded_skills["skills"] == skill]
+        d = len(dff)
+
+        data["skills"].append(
+            {
+                "category": skill,
+                "count": d if d else "-",
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+
+    data["skills"].append({"total": N})
+
+    # Divisions
+    divisions = get_divisions(sy, sections=["Lycée", "Collège", "Élémentaire", "Maternelle"])
+
+    for section, divs in divisions.items():
+        data[f"divisions-{section}"] = []
+        # efficiently checks for overlaps between the split lists from the divisions column
+        # and the division list from the section divs
+        dff = df[~df.divisions.map(set(divs).isdisjoint)]
+        n = len(dff)
+
+        for division in divs:
+            dff_div = df[[division in x for x in df.divisions]]
+
+            d = len(dff_div)
+            data[f"divisions-{section}"].append(
+                {
+                    "category": division_name(division),
+                    "count": d if d else "-",
+                    "percentage": f"{d / n * 100:.0f}%" if d and n else "",
+                    "projects": [
+                        {"id": index, "title": row["title"]} for index, row in dff_div.iterrows()
+                    ],
+                }
+            )
+        data[f"divisions-{section}"].append({"total": n})
+
+    data["divisions-section"] = []
+    df = df[~df.divisions.map(set(get_divisions(sy)).isdisjoint)]
+    n = len(df)
+    dff = df[~df.divisions.map(set(get_divisions(sy, "Secondaire")).isdisjoint)]
+    n_s = len(dff)
+    data["divisions-section"].append(
+        {
+            "category": "Secondaire",
+            "count": n_s,
+            "percentage": f"{n and n_s / n * 100 or 0:.0f}%",
+            "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+        }
+    )
+    dff = df[~df.divisions.map(set(get_divisions(sy, "Primaire")).isdisjoint)]
+    n_p = len(dff)
+    data["divisions-section"].append(
+        {
+            "category": "Primaire",
+            "count": n_p,
+            "percentage": f"{n and n_p / n * 100 or 0:.0f}%",
+            "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+        }
+    )
+    data["divisions-section"].append({"total": n})
+
+    # Mode
+    data["mode"] = []
+    for m in choices["mode"]:
+        dff = df[df["mode"] == m]
+        d = len(dff)
+        data["mode"].append(
+            {
+                "category": m,
+                "count": d,
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+    data["mode"].append({"total": N})
+
+    # Requirement
+    data["requirement"] = []
+    for r, label in choices["requirement"].items():
+        dff = df[df.requirement == r]
+        d = len(dff)
+        data["requirement"].append(
+            {
+                "category": label,
+                "count": d,
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+    data["requirement"].append({"total": N})
+
+    # Location
+    data["location"] = []
+    for loc, label in choices["location"].items():
+        dff = df[df.location == loc]
+        d = len(dff)
+        data["location"].append(
+            {
+                "category": label,
+                "count": d,
+                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
+                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+            }
+        )
+    data["location"].append({"total": N})
+
+    return data
+
+
+def synthetic_projects(n, sy, divisions, seed):
+    """DataFrame of n projects, with the columns used by calculate_distribution."""
+    rnd = random.Random(seed)
+    names = [f"Nom{i} Prénom{i}" for i in range(200)]
+    rows = []
+    for i in range(n):
+        axis = rnd.choice(list(choices["pe"]))
+        members = rnd.sample(names, rnd.randint(0, 3))
+        rows.append(
+            {
+                "id": i + 1,
+                "title": f"Projet {i}",
+                "school_year": sy,
+                "axis": axis,
+                "priority": rnd.choice(choices["pe"][axis]),
+                "departments": [rnd.choice(choices["departments"]) for _ in members],
+                "members": members,
+                "paths": rnd.sample(choices["paths"], rnd.randint(0, 2)),
+                "skills": rnd.sample(choices["skills"], rnd.randint(0, 3)),
+                # repeated and unknown divisions included
+                "divisions": rnd.choices(divisions, k=rnd.randint(0, 3))
+                + (["zz"] if rnd.random() < 0.05 else []),
+                "mode": rnd.choice(choices["mode"]),
+                "requirement": rnd.choice(list(choices["requirement"])),
+                "location": rnd.choice(list(choices["location"])),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def first_difference(expected, data):
+    """Key (and row) of the first difference between two outputs, or None."""
+    if expected.keys() != data.keys():
+        return f"keys {sorted(expected.keys() ^ data.keys())}"
+    for key, table in expected.items():
+        if data[key] != table:
+            if len(data[key]) != len(table):
+                return f"{key}: {len(data[key])} rows instead of {len(table)}"
+            row = next(i for i, (a, b) in enumerate(zip(table, data[key])) if a != b)
+            return f"{key}, row {row}: {data[key][row]} instead of {table[row]}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--projects", type=int, nargs="+", default=[5000, 50000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        # new database: current school year created with the default divisions
+        sy = auto_school_year().sy
+        divisions = get_divisions(sy)
+
+        for n in args.projects:
+            df = synthetic_projects(n, sy, divisions, args.seed)
+
+            start = time.perf_counter()
+            expected = reference_calculate_distribution(df.copy(), sy, choices)
+            former = time.perf_counter() - start
+
+            start = time.perf_counter()
+            data = calculate_distribution(df.copy(), sy, choices)
+            current = time.perf_counter() - start
+
+            difference = first_difference(expected, data)
+            assert difference is None, difference
+            print(
+                f"{n} projects: same {len(data)} tables, "
+                f"former {former:.2f} s, current {current:.2f} s ({former / current:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
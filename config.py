@@ -25,6 +25,17 @@ class Config:
     APP_PATH = BASE_DIR / os.getenv("APPLICATION_PACKAGE", "")
     DATA_PATH = APP_PATH / os.getenv("DATA_DIR", "data")
 
+    # External URL of the app (links in the notifications sent by the worker)
+    APP_URL = os.getenv("APP_URL")
+
+    # Seconds during which new comment notifications are grouped (users with comment_digest)
+    COMMENT_DIGEST_WINDOW = int(os.getenv("COMMENT_DIGEST_WINDOW", "900"))
+
+    # Outbound mail limits (Gmail sending quotas): messages per second, burst and daily quota
+    MAIL_RATE = float(os.getenv("MAIL_RATE", "1"))
+    MAIL_BURST = int(os.getenv("MAIL_BURST", "20"))
+    MAIL_DAILY_QUOTA = int(os.getenv("MAIL_DAILY_QUOTA", "1500"))
+
     # Flask Folders
     STATIC_FOLDER = "static"
     TEMPLATES_FOLDER = "templates"
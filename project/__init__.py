@@ -21,9 +21,8 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 
 from ._version import __version__, __version_date__
 from .babel import configure, get_locale
-from .google_api_service import create_service
 from .models import User, db
-from .profiler import setup_query_profiler
+from .profiler import setup_import_report, setup_query_profiler
 from .template_filters import register_template_filters
 
 # absolute path of the app
@@ -37,29 +36,12 @@ load_dotenv(dotenv_path=env_path)
 login_manager = LoginManager()
 babel = Babel()
 
-
-# Initialize GMail Service (kept global so other modules can import it)
-gmail_enabled = os.getenv("USE_GMAIL_SERVICE", "True").lower() in ("true", "1")
-
 # Global CSRF protection
 csrf = CSRFProtect()
 
 # Determine base directory of the project
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-if gmail_enabled:
-    CLIENT_SECRET_FILE = CURRENT_DIR.parent / os.getenv("CLIENT_SECRET_FILE", "credentials.json")
-    TOKEN_FILE = CURRENT_DIR.parent / os.getenv("TOKEN_FILE", "token.json")
-    SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
-    if CLIENT_SECRET_FILE:
-        gmail_service_api = create_service(CLIENT_SECRET_FILE, TOKEN_FILE, "gmail", "v1", SCOPES)
-    else:
-        print("Attention: CLIENT_SECRET_FILE not found in environment.")
-        gmail_service_api = None
-else:
-    print("Warning: GMail service not started.")
-    gmail_service_api = None
-
 
 def setup_logger(is_production):
     """Configures and returns the application logger."""
@@ -167,8 +149,31 @@ def create_app():
         with app.app_context():
             db.create_all()
 
-    # 10. Activate the Query Profiler
+    # 10. Check the columns added to existing tables (flask upgrade-db to add them)
+    from .schema import init_schema
+
+    init_schema(app)
+
+    # 11. Create the search index of the projects if needed (flask search-index to rebuild it)
+    from .search import init_search_index
+
+    init_search_index(app)
+
+    # 12. Register the to-do counters command (flask recount-counters)
+    from .counters import init_counters
+
+    init_counters(app)
+
+    # 13. Activate the Query Profiler
     if not is_production:
         setup_query_profiler(app)
 
+    # 14. Register the import timings report command (flask import-report)
+    setup_import_report(app)
+
+    # 15. Register the notifications worker command (flask notifications-worker)
+    from .worker import register_worker_commands
+
+    register_worker_commands(app)
+
     return app
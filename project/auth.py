@@ -18,8 +18,9 @@ from flask_login import current_user, login_required, login_user, logout_user
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from .decorators import require_unlocked_db
-from .models import Dashboard, Personnel, User, db
+from .models import Personnel, User, db
 from .registration import LoginForm, SignupForm
+from .utils import get_lock_state, invalidate_personnel_cache
 
 logger = logging.getLogger(__name__)
 
@@ -82,8 +83,7 @@ def authorize():
     user = db.session.query(User).join(Personnel).filter(Personnel.email == user_info.email).first()
 
     if not user:
-        dash = Dashboard.query.first()
-        if dash and dash.lock >= 2:
+        if get_lock_state().lock >= 2:
             flash(
                 "La création de nouveaux comptes est temporairement suspendue pour maintenance. Veuillez ré-essayer plus tard.",
                 "warning",
@@ -100,6 +100,7 @@ def authorize():
 
         db.session.add(new_user)
         db.session.commit()
+        invalidate_personnel_cache()
 
         user = (
             db.session.query(User)
@@ -176,6 +177,7 @@ def signup():
 
         db.session.add(new_user)
         db.session.commit()
+        invalidate_personnel_cache()
 
         logger.info(f"New user registered ({email})")
         return redirect(url_for("auth.login"))
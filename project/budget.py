@@ -0,0 +1,141 @@
+# budget.py
+import threading
+
+from sqlalchemy import case, literal, or_, select, union_all
+
+from .cache import PROJECTS_VERSION, VersionedCache
+from .models import Project, db
+from .project import choices
+from .utils import creator_department, query_projects
+
+# budget types of the projects: budget_<type>_1 (first year), budget_<type>_2 (second year)
+BUDGET_TYPES = ["hse", "exp", "trip", "int"]
+
+# project columns of the budget tables
+BUDGET_COLUMNS = [
+    "id",
+    "title",
+    "school_year",
+    "start_date",
+    "end_date",
+    "department",
+    "nb_students",
+    "budget_id",
+    "modified_at",
+    "status",
+    "validated_at",
+    "is_recurring",
+    "has_budget",
+]
+
+# budget tables of the current version of the projects data: {key: DataFrame}
+_budget_tables = VersionedCache(PROJECTS_VERSION, dict)
+_budget_tables_lock = threading.Lock()
+
+
+def _cached(key, build):
+    # shared by the threads of the worker: built outside of the lock, returned as a copy
+    # so that the callers cannot change the cached tables
+    tables = _budget_tables.get()
+    with _budget_tables_lock:
+        table = tables.get(key)
+    if table is None:
+        table = build()
+        with _budget_tables_lock:
+            table = tables.setdefault(key, table)
+    return table.copy()
+
+
+def _budget(n, budget):
+    # budget of year n (1 or 2): HSE are not included in the total
+    if budget == "total":
+        return sum(getattr(Project, f"budget_{b}_{n}") for b in ["exp", "trip", "int"])
+    return getattr(Project, f"budget_{budget}_{n}")
+
+
+def _budget_column(name):
+    # budget_<type>: both years, budget_<type>_<n>: year n
+    _, budget, *n = name.split("_")
+    if n:
+        return _budget(n[0], budget).label(name)
+    return (_budget(1, budget) + _budget(2, budget)).label(name)
+
+
+def _project_columns():
+    return [
+        getattr(Project, col)
+        for col in BUDGET_COLUMNS
+        if col not in ["department", "is_recurring", "has_budget"]
+    ] + [
+        creator_department(),
+        case((Project.is_recurring, "Oui"), else_="Non").label("is_recurring"),
+        case((_has_budget(), "Oui"), else_="Non").label("has_budget"),
+    ]
+
+
+def _has_budget():
+    # same as Project.has_budget in Python (any budget not 0)
+    return or_(*[_budget(n, b) != 0 for n in (1, 2) for b in BUDGET_TYPES])
+
+
+def _budget_query():
+    # approved projects requesting funds or not (see query_projects), newest first
+    return query_projects(data="budget")
+
+
+def _to_df(result, columns):
+    # pandas is loaded on first use only (budget page)
+    import pandas as pd
+
+    return pd.DataFrame(result.all(), columns=list(result.keys()))[columns]
+
+
+def get_budget_school_years():
+    """School years of the projects of the budget page, newest first."""
+
+    def build():
+        query = _budget_query().with_entities(Project.school_year).order_by(None).distinct()
+        return sorted((sy for (sy,) in query), reverse=True)
+
+    return _cached("school_years", build)
+
+
+def get_school_year_budget(sy, recurring=False):
+    """
+    Projects of the school year sy (recurring projects only with recurring) with their
+    budgets: both years (budget_<type>), first and second year (budget_<type>_1, _2).
+    """
+
+    def build():
+        budgets = [_budget_column(name) for name in choices["budgets"]]
+        query = _budget_query().filter(Project.school_year == sy)
+        if recurring:
+            query = query.filter(Project.is_recurring)
+        result = db.session.execute(query.with_entities(*_project_columns(), *budgets).statement)
+        return _to_df(result, BUDGET_COLUMNS + choices["budgets"])
+
+    return _cached(("school_year", sy, recurring), build)
+
+
+def get_fiscal_year_budget(fy):
+    """
+    Budgets of the fiscal year fy (calendar year): first year budgets of the school years
+    starting in fy, then second year budgets of the school years ending in fy.
+    """
+
+    def build():
+        halves = []
+        for n, school_years in [(1, f"{fy} - %"), (2, f"% - {fy}")]:
+            budgets = [_budget(n, b.split("_")[1]).label(b) for b in choices["budget"]]
+            halves.append(
+                _budget_query()
+                .filter(Project.school_year.like(school_years))
+                .with_entities(literal(n).label("half"), *_project_columns(), *budgets)
+                .order_by(None)
+                .statement
+            )
+        rows = union_all(*halves).subquery()
+        result = db.session.execute(select(rows).order_by(rows.c.half, rows.c.id.desc()))
+        return _to_df(result, BUDGET_COLUMNS + [*choices["budget"]])
+
+    return _cached(("fiscal_year", fy), build)
@@ -0,0 +1,313 @@
+# cache.py
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import Any
+
+from flask import g, has_app_context
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import CacheVersion, Personnel, Project, ProjectHistory, ProjectMember, db
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_versions():
+    """
+    Returns the {cache name: version} counters stored in the database.
+    Counters are read once per application context (g).
+    """
+    if has_app_context() and "cache_versions" in g:
+        return g.cache_versions
+
+    versions = dict(db.session.execute(select(CacheVersion.name, CacheVersion.version)).all())
+
+    if has_app_context():
+        g.cache_versions = versions
+    return versions
+
+
+def bump_cache_version(name):
+    """
+    Increments the version counter of a cache and commits it,
+    so that every worker process reloads its copy on the next request.
+    """
+    for _ in range(2):
+        result = db.session.execute(
+            update(CacheVersion)
+            .where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+        )
+        if not result.rowcount:
+            db.session.add(CacheVersion(name=name, version=1))
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            # another worker created the counter first: retry the update
+            db.session.rollback()
+
+    if has_app_context():
+        g.pop("cache_versions", None)
+
+
+# --- Changes of the session ---
+
+# {name: (collect, apply)} of the subscribers to the changes of the session
+_change_subscribers = {}
+
+
+def on_session_changes(name, collect, apply):
+    """
+    Subscribes to the changes committed by the sessions.
+    After every flush, collect(session, changes, new, dirty, deleted) records in the dict
+    changes what the flushed objects change. Before the commit, after a last flush,
+    apply(session, changes) updates the database in the same transaction (if changes is
+    not empty). Changes are discarded on rollback. Subscribers are called in order.
+    """
+    _change_subscribers[name] = (collect, apply)
+
+
+def discard_session_changes(session, name):
+    """Drops the changes collected for a subscriber (already applied)."""
+    session.info.get("session_changes", {}).pop(name, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_session_changes(session, flush_context):
+    new, dirty, deleted = session.new, session.dirty, session.deleted
+    collected = session.info.setdefault("session_changes", {})
+    for name, (collect, _) in _change_subscribers.items():
+        changes = collected.setdefault(name, {})
+        collect(session, changes, new, dirty, deleted)
+        if not changes:
+            del collected[name]
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_session_changes(session):
+    # flush pending changes first, so that they are collected too
+    session.flush()
+    collected = session.info.pop("session_changes", None)
+    if not collected:
+        return
+
+    for name, (_, apply) in _change_subscribers.items():
+        if name in collected:
+            apply(session, collected[name])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_session_changes(session):
+    session.info.pop("session_changes", None)
+
+
+# --- Data version of the projects ---
+
+# version counter of the projects data (watermark of the exports and of the cached data),
+# with one counter per school year ("projects:2025 - 2026")
+PROJECTS_VERSION = "projects"
+
+# changes of these models change the exported projects data
+PROJECTS_DATA_MODELS = (Project, ProjectMember, ProjectHistory, Personnel)
+
+
+def get_projects_version(sy=None):
+    """
+    Version of the projects data (of the school year sy if given), incremented by every
+    commit changing it.
+    """
+    name = PROJECTS_VERSION if sy is None else f"{PROJECTS_VERSION}:{sy}"
+    return get_cache_versions().get(name, 0)
+
+
+def _collect_projects_changes(session, changes, new, dirty, deleted):
+    for obj in (*new, *dirty, *deleted):
+        if not isinstance(obj, PROJECTS_DATA_MODELS):
+            continue
+        changes["projects"] = True
+        if isinstance(obj, Project):
+            # school years of the project, before and after the change
+            school_years = inspect(obj).attrs["school_year"].history.deleted
+            changes.setdefault("school_years", set()).update({obj.school_year, *school_years})
+        elif isinstance(obj, ProjectMember):
+            changes.setdefault("project_ids", set()).add(obj.project_id)
+
+
+def _increment_version(session, name):
+    for _ in range(2):
+        result = session.execute(
+            update(CacheVersion)
+            .where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return
+        try:
+            # savepoint: only the counter is rolled back if another transaction created it
+            with session.begin_nested():
+                session.add(CacheVersion(name=name, version=1))
+            return
+        except IntegrityError:
+            continue
+
+
+def _bump_projects_version(session, changes):
+    # same transaction as the changes (bump_cache_version commits)
+    school_years = changes.get("school_years", set())
+    if changes.get("project_ids"):
+        # school years of the projects whose members changed
+        school_years |= set(
+            session.scalars(
+                select(Project.school_year).where(Project.id.in_(changes["project_ids"])).distinct()
+            )
+        )
+
+    _increment_version(session, PROJECTS_VERSION)
+    for sy in sorted(school_years - {None}):
+        _increment_version(session, f"{PROJECTS_VERSION}:{sy}")
+    if has_app_context():
+        g.pop("cache_versions", None)
+
+
+on_session_changes(PROJECTS_VERSION, _collect_projects_changes, _bump_projects_version)
+
+
+class VersionedCache:
+    """
+    Process-wide cache of a value computed by loader().
+    The value is shared by all requests (and threads) of the worker and is reloaded
+    only when the version counter of the cache changes in the database.
+    With a ttl (seconds), the counter itself is checked at most once per ttl period,
+    so reads within that period never reach the database.
+    """
+
+    def __init__(self, name, loader, ttl=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+
+        if self.ttl is not None:
+            with self._lock:
+                if self._version is not None and now - self._checked_at < self.ttl:
+                    return self._value
+
+        version = get_cache_versions().get(self.name, 0)
+        with self._lock:
+            if self._version != version:
+                self._value = self.loader()
+                self._version = version
+                logger.debug(f"Cache '{self.name}' loaded (version {version})")
+            self._checked_at = now
+            return self._value
+
+    def invalidate(self):
+        """Drops the local copy and invalidates all the other workers."""
+        with self._lock:
+            self._version = None
+            self._value = None
+        bump_cache_version(self.name)
+
+
+# --- Personnel snapshots ---
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    id: int
+    date_registered: datetime
+    preferences: Mapping[str, Any] = field(compare=False)
+
+
+@dataclass(frozen=True, slots=True)
+class PersonnelSnapshot:
+    """Read-only copy of a Personnel record (and its User account), safe to share across threads."""
+
+    id: int
+    email: str
+    name: str
+    firstname: str
+    department: str
+    role: str
+    user: UserSnapshot | None = field(compare=False)
+
+    @classmethod
+    def from_model(cls, personnel):
+        user = personnel.user
+        return cls(
+            id=personnel.id,
+            email=personnel.email,
+            name=personnel.name,
+            firstname=personnel.firstname,
+            department=personnel.department,
+            role=personnel.role,
+            user=UserSnapshot(
+                id=user.id,
+                date_registered=user.date_registered,
+                preferences=MappingProxyType(
+                    dict(user.preferences) if isinstance(user.preferences, dict) else {}
+                ),
+            )
+            if user
+            else None,
+        )
+
+
+# --- Dashboard snapshot ---
+
+
+@dataclass(frozen=True, slots=True)
+class DashboardSnapshot:
+    """Read-only copy of the Dashboard record (database lock state and messages)."""
+
+    lock: int
+    lock_message: str | None
+    welcome_message: str | None
+
+    @classmethod
+    def from_model(cls, dash):
+        return cls(
+            lock=dash.lock,
+            lock_message=dash.lock_message,
+            welcome_message=dash.welcome_message,
+        )
+
+
+# --- SchoolYear snapshot ---
+
+
+@dataclass(frozen=True, slots=True)
+class SchoolYearSnapshot:
+    """Read-only copy of a SchoolYear record."""
+
+    id: int
+    sy: str
+    sy_start: date
+    sy_end: date
+    divisions: tuple[str, ...]
+    pe: Mapping[str, Any] = field(compare=False)
+
+    @classmethod
+    def from_model(cls, school_year):
+        return cls(
+            id=school_year.id,
+            sy=school_year.sy,
+            sy_start=school_year.sy_start,
+            sy_end=school_year.sy_end,
+            divisions=tuple(school_year.divisions or ()),
+            pe=MappingProxyType(dict(school_year.pe or {})),
+        )
@@ -0,0 +1,117 @@
+# counters.py
+import click
+from sqlalchemy import event, exists, func, inspect, or_, select, update
+
+from .cache import on_session_changes
+from .models import Dashboard, Project, ProjectMember, User, db
+
+# statuses of the projects waiting for approval or validation
+PENDING_STATUSES = ("ready-1", "ready")
+
+
+def _pending_count():
+    return (
+        select(func.count(Project.id)).where(Project.status.in_(PENDING_STATUSES)).scalar_subquery()
+    )
+
+
+def _user_pending_count():
+    # projects created by the user or with the user among the members (correlated on users)
+    return (
+        select(func.count(Project.id))
+        .where(
+            Project.status.in_(PENDING_STATUSES),
+            or_(
+                Project.uid == User.id,
+                # correlated with both projects and users
+                exists()
+                .where(ProjectMember.project_id == Project.id, ProjectMember.pid == User.pid)
+                .correlate_except(ProjectMember),
+            ),
+        )
+        .scalar_subquery()
+    )
+
+
+def update_pending_validations(session, uids=None, pids=None):
+    """
+    Recounts the pending validations of the dashboard (gestion/direction) and of the users
+    given by id (uids) or personnel id (pids), all users if both are None.
+    """
+    session.execute(
+        update(Dashboard)
+        .values(pending_validations=_pending_count())
+        .execution_options(synchronize_session=False)
+    )
+
+    stmt = update(User).values(pending_validations=_user_pending_count())
+    if uids is not None or pids is not None:
+        stmt = stmt.where(or_(User.id.in_(uids or []), User.pid.in_(pids or [])))
+    session.execute(stmt.execution_options(synchronize_session=False))
+
+
+def get_pending_validations(user):
+    """Number of projects to validate: all of them for gestion/direction, else the user's."""
+    if user.p.role in ["gestion", "direction"]:
+        return db.session.scalar(select(Dashboard.pending_validations).limit(1)) or 0
+    return user.pending_validations
+
+
+# --- Counters maintenance on project and member changes ---
+
+
+@event.listens_for(Dashboard, "before_insert")
+def _count_dashboard_validations(mapper, connection, dashboard):
+    # dashboard record created after the projects (auto_dashboard)
+    dashboard.pending_validations = connection.scalar(select(_pending_count()))
+
+
+def _history(obj, name):
+    return inspect(obj).attrs[name].history
+
+
+def _collect_counter_changes(session, changes, new, dirty, deleted):
+    for obj in (*new, *deleted):
+        if isinstance(obj, Project):
+            changes.setdefault("projects", set()).add(obj.id)
+            changes.setdefault("uids", set()).add(obj.uid)
+        elif isinstance(obj, ProjectMember):
+            changes.setdefault("pids", set()).add(obj.pid)
+
+    for obj in dirty:
+        if isinstance(obj, Project):
+            status, uid = _history(obj, "status"), _history(obj, "uid")
+            # projects whose status or creator changed (both creators are recounted)
+            if status.has_changes() or uid.has_changes():
+                changes.setdefault("projects", set()).add(obj.id)
+                changes.setdefault("uids", set()).update({obj.uid, *uid.deleted})
+        elif isinstance(obj, ProjectMember):
+            changes.setdefault("pids", set()).update({obj.pid, *_history(obj, "pid").deleted})
+
+
+def _update_counters(session, changes):
+    # members of the changed projects, with the members removed (collected above)
+    pids = changes.get("pids", set())
+    if changes.get("projects"):
+        pids |= set(
+            session.scalars(
+                select(ProjectMember.pid).where(ProjectMember.project_id.in_(changes["projects"]))
+            )
+        )
+
+    uids = changes.get("uids", set())
+    update_pending_validations(session, uids=uids - {None}, pids=pids - {None})
+
+
+on_session_changes("counters", _collect_counter_changes, _update_counters)
+
+
+def init_counters(app):
+    """Registers the "flask recount-counters" command (new columns, changes made outside of the app)."""
+
+    @app.cli.command("recount-counters")
+    def recount_counters():
+        """Recounts the to-do counters of all the users and of the dashboard."""
+        update_pending_validations(db.session)
+        db.session.commit()
+        click.echo("Compteurs de projets à valider recalculés.")
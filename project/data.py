@@ -1,9 +1,13 @@
+import logging
 import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime
 
 import pandas as pd
 from babel.dates import format_date
-from flask import render_template
+from flask import current_app, render_template
 
 try:
     from .graphs import pe_bar_chart, sunburst_chart, timeline_chart
@@ -12,17 +16,21 @@ try:
 except ImportError:
     graph_module = False
 
+from .cache import get_cache_versions, get_projects_version
 from .models import Personnel
 from .project import choices
 from .utils import (
     division_name,
     division_names,
+    get_datetime,
     get_divisions,
     get_project_dates,
     get_projects_df,
     get_school_years,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def get_personnel_choices():
     """Prepare personnel list"""
@@ -35,36 +43,64 @@ def get_personnel_choices():
     )
 
 
+def group_projects(df, column, explode=False):
+    """
+    Groups the projects of df by the values of column, in a single groupby pass.
+    List columns are exploded once (explode=True).
+    Returns {value: [{"id": index, "title": title}, ...]}, projects in DataFrame order.
+    """
+    if explode:
+        df = df[["title", column]].explode(column)
+    ids = df.index.tolist()
+    titles = df["title"].tolist()
+    values = df[column]
+    return {
+        value: [{"id": ids[i], "title": titles[i]} for i in positions]
+        for value, positions in values.groupby(values.to_numpy(), sort=False).indices.items()
+    }
+
+
+def distribution_row(category, projects, total, empty="-"):
+    """Returns the distribution table row of a category."""
+    d = len(projects)
+    return {
+        "category": category,
+        "count": d if d else empty,
+        "percentage": f"{d / total * 100:.0f}%" if d and total else "",
+        "projects": projects,
+    }
+
+
 def calculate_distribution(df, sy, choices):
     """Calculate distribution for axes, priorities, departments, etc."""
     N = len(df)
     data = {}
 
     # Projet d'établissement
+    axes = group_projects(df, "axis")
+    priorities_projects = group_projects(df, "priority")
     data["pe"] = []
     data["pe_chart"] = []  # charts for PE
     for axis, priorities in choices["pe"].items():
-        dff = df[df.axis == axis]
-        n = len(dff)
+        projects = axes.get(axis, [])
+        n = len(projects)
         data["pe"].append(
             {
                 "axis": axis,
                 "count": n if n else "-",
                 "percentage": f"{n / N * 100:.0f}%" if n and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+                "projects": projects,
             }
         )
         for priority in priorities:
-            dff = df[df.priority == priority]
-            p = len(dff)
+            projects = priorities_projects.get(priority, [])
+            p = len(projects)
             data["pe"].append(
                 {
                     "priority": priority,
                     "count": p if p else "-",
                     "percentage": f"{p / n * 100:.0f}%" if p and n else "",
-                    "projects": [
-                        {"id": index, "title": row["title"]} for index, row in dff.iterrows()
-                    ],
+                    "projects": projects,
                 }
             )
             data["pe_chart"].append(
@@ -77,22 +113,11 @@ def calculate_distribution(df, sy, choices):
     data["pe"].append({"total": N})
 
     # Departments
-    data["departments"] = []
-    exploded_df = df.explode("departments")
-
-    for department in choices["departments"]:
-        dff = exploded_df[exploded_df["departments"] == department]
-        d = len(dff)
-
-        data["departments"].append(
-            {
-                "category": department,
-                "count": d if d else "-",
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-            }
-        )
-
+    departments = group_projects(df, "departments", explode=True)
+    data["departments"] = [
+        distribution_row(department, departments.get(department, []), N)
+        for department in choices["departments"]
+    ]
     data["departments"].append({"total": N})
 
     # teachers
@@ -134,9 +159,10 @@ def calculate_distribution(df, sy, choices):
     )
 
     # Pre-format project payload info
-    df_exploded["project_info"] = df_exploded.apply(
-        lambda r: {"id": r["id"], "title": r["title"]}, axis=1
-    )
+    df_exploded["project_info"] = [
+        {"id": id, "title": title}
+        for id, title in zip(df_exploded["id"].tolist(), df_exploded["title"].tolist())
+    ]
 
     # --- 4. Vectorized Aggregation ---
     # Group directly by the names already present in 'members'
@@ -168,137 +194,80 @@ def calculate_distribution(df, sy, choices):
         data[section].append({"total": section_totals.get(section, 0)})
 
     # Paths
-    data["paths"] = []
-    exploded_paths = df.explode("paths")
-
-    for path in choices["paths"]:
-        dff = exploded_paths[exploded_paths["paths"] == path]
-        d = len(dff)
-
-        data["paths"].append(
-            {
-                "category": path,
-                "count": d if d else "-",
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-            }
-        )
-
+    paths = group_projects(df, "paths", explode=True)
+    data["paths"] = [distribution_row(path, paths.get(path, []), N) for path in choices["paths"]]
     data["paths"].append({"total": N})
 
     # Skills
-    data["skills"] = []
-    exploded_skills = df.explode("skills")
-
-    for skill in choices["skills"]:
-        dff = exploded_skills[exploded_skills["skills"] == skill]
-        d = len(dff)
-
-        data["skills"].append(
-            {
-                "category": skill,
-                "count": d if d else "-",
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-            }
-        )
-
+    skills = group_projects(df, "skills", explode=True)
+    data["skills"] = [
+        distribution_row(skill, skills.get(skill, []), N) for skill in choices["skills"]
+    ]
     data["skills"].append({"total": N})
 
     # Divisions
-    divisions = get_divisions(sy, sections=["Lycée", "Collège", "Élémentaire", "Maternelle"])
+    # explode the divisions once, a project is counted once per division
+    exploded_divisions = df[["title", "divisions"]].explode("divisions")
+    exploded_divisions = exploded_divisions[
+        ~pd.MultiIndex.from_arrays(
+            [exploded_divisions.index, exploded_divisions["divisions"]]
+        ).duplicated()
+    ]
+    divisions_projects = group_projects(exploded_divisions, "divisions")
 
-    for section, divs in divisions.items():
-        data[f"divisions-{section}"] = []
-        # efficiently checks for overlaps between the split lists from the divisions column
-        # and the division list from the section divs
-        dff = df[~df.divisions.map(set(divs).isdisjoint)]
-        n = len(dff)
+    def projects_in(divs, index):
+        """Returns the mask (on index) of the projects with at least one division in divs."""
+        is_in = exploded_divisions["divisions"].isin(divs)
+        return is_in.groupby(level=0).any().reindex(index, fill_value=False)
 
-        for division in divs:
-            dff_div = df[[division in x for x in df.divisions]]
+    divisions = get_divisions(sy, sections=["Lycée", "Collège", "Élémentaire", "Maternelle"])
 
-            d = len(dff_div)
-            data[f"divisions-{section}"].append(
-                {
-                    "category": division_name(division),
-                    "count": d if d else "-",
-                    "percentage": f"{d / n * 100:.0f}%" if d and n else "",
-                    "projects": [
-                        {"id": index, "title": row["title"]} for index, row in dff_div.iterrows()
-                    ],
-                }
-            )
+    for section, divs in divisions.items():
+        n = int(projects_in(divs, df.index).sum())
+        data[f"divisions-{section}"] = [
+            distribution_row(division_name(division), divisions_projects.get(division, []), n)
+            for division in divs
+        ]
         data[f"divisions-{section}"].append({"total": n})
 
     data["divisions-section"] = []
-    df = df[~df.divisions.map(set(get_divisions(sy)).isdisjoint)]
+    df = df[projects_in(get_divisions(sy), df.index)]
     n = len(df)
-    dff = df[~df.divisions.map(set(get_divisions(sy, "Secondaire")).isdisjoint)]
-    n_s = len(dff)
-    data["divisions-section"].append(
-        {
-            "category": "Secondaire",
-            "count": n_s,
-            "percentage": f"{n and n_s / n * 100 or 0:.0f}%",
-            "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-        }
-    )
-    dff = df[~df.divisions.map(set(get_divisions(sy, "Primaire")).isdisjoint)]
-    n_p = len(dff)
-    data["divisions-section"].append(
-        {
-            "category": "Primaire",
-            "count": n_p,
-            "percentage": f"{n and n_p / n * 100 or 0:.0f}%",
-            "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-        }
-    )
-    data["divisions-section"].append({"total": n})
-
-    # Mode
-    data["mode"] = []
-    for m in choices["mode"]:
-        dff = df[df["mode"] == m]
-        d = len(dff)
-        data["mode"].append(
+    for section in ["Secondaire", "Primaire"]:
+        dff = df[projects_in(get_divisions(sy, section), df.index)]
+        n_s = len(dff)
+        data["divisions-section"].append(
             {
-                "category": m,
-                "count": d,
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
+                "category": section,
+                "count": n_s,
+                "percentage": f"{n and n_s / n * 100 or 0:.0f}%",
+                "projects": [
+                    {"id": id, "title": title}
+                    for id, title in zip(dff.index.tolist(), dff["title"].tolist())
+                ],
             }
         )
+    data["divisions-section"].append({"total": n})
+
+    # Mode
+    modes = group_projects(df, "mode")
+    data["mode"] = [distribution_row(m, modes.get(m, []), N, empty=0) for m in choices["mode"]]
     data["mode"].append({"total": N})
 
     # Requirement
-    data["requirement"] = []
-    for r, label in choices["requirement"].items():
-        dff = df[df.requirement == r]
-        d = len(dff)
-        data["requirement"].append(
-            {
-                "category": label,
-                "count": d,
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-            }
-        )
+    requirements = group_projects(df, "requirement")
+    data["requirement"] = [
+        distribution_row(label, requirements.get(r, []), N, empty=0)
+        for r, label in choices["requirement"].items()
+    ]
     data["requirement"].append({"total": N})
 
     # Location
-    data["location"] = []
-    for loc, label in choices["location"].items():
-        dff = df[df.location == loc]
-        d = len(dff)
-        data["location"].append(
-            {
-                "category": label,
-                "count": d,
-                "percentage": f"{d / N * 100:.0f}%" if d and N else "",
-                "projects": [{"id": index, "title": row["title"]} for index, row in dff.iterrows()],
-            }
-        )
+    locations = group_projects(df, "location")
+    data["location"] = [
+        distribution_row(label, locations.get(loc, []), N, empty=0)
+        for loc, label in choices["location"].items()
+    ]
     data["location"].append({"total": N})
 
     return data
@@ -384,7 +353,45 @@ def generate_project_timeline(df, years_str):
     return dft
 
 
-def data_analysis(sy):
+@dataclass(frozen=True, slots=True)
+class AnalyticsSnapshot:
+    """Materialized analysis of the data page for a school year (or a range of school years)."""
+
+    sy: str | None
+    watermark: str
+    computed_at: datetime
+    data: dict = field(compare=False)
+    df: pd.DataFrame = field(compare=False)
+    graphs: tuple = field(compare=False)
+
+
+# {sy: AnalyticsSnapshot}, shared by all requests of the worker, least recently used first
+ANALYTICS_CACHE_SIZE = 16
+_analytics = OrderedDict()
+_analytics_refreshing = set()
+_analytics_lock = threading.Lock()
+
+
+def get_analytics_watermark(sy):
+    """
+    Returns the versions of the data used by the analysis of sy: projects of sy (incremented
+    by every commit changing them), personnel and school years. No query when already read
+    by the request.
+    """
+    versions = get_cache_versions()
+    return f"{get_projects_version(sy)}-{versions.get('personnel', 0)}-{versions.get('school_years', 0)}"
+
+
+def _store_analytics(sy, snapshot):
+    with _analytics_lock:
+        _analytics[sy] = snapshot
+        _analytics.move_to_end(sy)
+        if len(_analytics) > ANALYTICS_CACHE_SIZE:
+            _analytics.popitem(last=False)
+
+
+def compute_analytics(sy, watermark):
+    """Runs the projects analysis of sy: distribution tables and charts."""
     # get projects DataFrame
     df = get_projects_df(years=sy, data="data")
 
@@ -419,12 +426,79 @@ def data_analysis(sy):
             "Ressources serveur insuffisantes." for i in range(3)
         ]
 
-    return render_template(
-        "_data.html",
+    return AnalyticsSnapshot(
+        sy=sy,
+        watermark=watermark,
+        computed_at=get_datetime(),
         data=data,
         df=df,
+        graphs=(graph_html, graph_html2, graph_html3),
+    )
+
+
+def _refresh_analytics(app, sy, watermark):
+    try:
+        with app.app_context():
+            snapshot = compute_analytics(sy, watermark)
+        _store_analytics(sy, snapshot)
+    except Exception:
+        logger.exception(f"Error refreshing the data analysis of {sy or 'all school years'}")
+    finally:
+        with _analytics_lock:
+            _analytics_refreshing.discard(sy)
+
+
+def refresh_analytics_in_background(sy, watermark):
+    """Recomputes the analysis of sy in a background thread (once at a time per sy)."""
+    with _analytics_lock:
+        if sy in _analytics_refreshing:
+            return
+        _analytics_refreshing.add(sy)
+
+    threading.Thread(
+        target=_refresh_analytics,
+        args=(current_app._get_current_object(), sy, watermark),
+        daemon=True,
+    ).start()
+
+
+def get_analytics(sy):
+    """
+    Returns the (snapshot, stale) analysis of sy.
+    The analysis is computed on the first request only: when projects change,
+    the previous snapshot is returned as stale while a new one is computed in the background.
+    """
+    watermark = get_analytics_watermark(sy)
+
+    with _analytics_lock:
+        snapshot = _analytics.get(sy)
+        if snapshot is not None:
+            _analytics.move_to_end(sy)
+
+    if snapshot is None:
+        snapshot = compute_analytics(sy, watermark)
+        _store_analytics(sy, snapshot)
+        return snapshot, False
+
+    if snapshot.watermark != watermark:
+        refresh_analytics_in_background(sy, watermark)
+        return snapshot, True
+
+    return snapshot, False
+
+
+def data_analysis(sy):
+    snapshot, stale = get_analytics(sy)
+    graph_html, graph_html2, graph_html3 = snapshot.graphs
+
+    return render_template(
+        "_data.html",
+        data=snapshot.data,
+        df=snapshot.df,
         choices=choices,
         graph_html=graph_html,
         graph_html2=graph_html2,
         graph_html3=graph_html3,
+        computed_at=snapshot.computed_at,
+        stale=stale,
     )
@@ -4,7 +4,7 @@ from functools import wraps
 
 from flask import flash, redirect, request, url_for
 
-from .models import Dashboard
+from .utils import get_lock_state
 
 logger = logging.getLogger(__name__)
 
@@ -18,8 +18,7 @@ def require_unlocked_db(level=1):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            dash = Dashboard.query.first()
-            if dash and dash.lock >= level:
+            if get_lock_state().lock >= level:
                 flash(
                     "La base est momentanément fermée. <br>Les modifications sont impossibles.",
                     "danger",
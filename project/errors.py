@@ -6,13 +6,10 @@ from flask_login import current_user
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 
-from . import gmail_service_api
 from .models import Project, ProjectComment, ProjectMember, User, db
+from .notifications import queue_notification
 from .utils import get_datetime
 
-if gmail_service_api:
-    from .notifications import send_notification
-
 logger = logging.getLogger(__name__)
 
 
@@ -97,12 +94,27 @@ def register_error_handlers(app):
 
     @app.errorhandler(500)
     def internal_error(error):
+        user_email = current_user.p.email if current_user.is_authenticated else None
         logger.error(
-            f"Server error: {error}\nRoute: {request.url}\nUser: {current_user.p.email if current_user.is_authenticated else 'anonymous'}"
+            f"Server error: {error}\nRoute: {request.url}\nUser: {user_email or 'anonymous'}"
         )
         db.session.rollback()
-        if gmail_service_api:
-            send_notification("admin", project=None, text=f"{get_datetime()} - {str(error)}")
+        # notification sent by the worker (no request user): user and URL given as parameters
+        try:
+            queue_notification(
+                user_id=None,
+                action_type="send_notification",
+                parameters={
+                    "notification_type": "admin",
+                    "text": f"{get_datetime()} - {error}",
+                    "user": user_email,
+                    "url": request.url,
+                },
+            )
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Server error notification not queued: {e}")
         return render_template("500.html"), 500
 
     # Global SQLAlchemy error handler
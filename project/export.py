@@ -0,0 +1,509 @@
+# export.py
+import csv
+import hashlib
+import io
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from importlib.util import find_spec
+from operator import attrgetter
+
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import joinedload, selectinload
+
+from .cache import get_projects_version
+from .models import ExportJob, Project, ProjectHistory, ProjectMember, QueuedAction, User, db
+from .project import choices
+from .utils import (
+    division_name,
+    get_datetime,
+    get_name,
+    iter_keyset,
+    query_projects,
+    students_to_csv,
+)
+
+logger = logging.getLogger(__name__)
+
+# projects loaded at a time by the exports
+EXPORT_CHUNK_SIZE = 200
+
+# exported files are kept in DATA_PATH/exports, at most EXPORT_MAX_FILES for EXPORT_RETENTION
+EXPORT_DIR = "exports"
+EXPORT_MAX_FILES = 20
+EXPORT_RETENTION = timedelta(days=7)
+
+EXPORT_SHEET = "Projets pédagogiques LFS"
+
+# seconds the worker lease of an export action is renewed for, at each progress update
+# (every EXPORT_CHUNK_SIZE rows), instead of the LEASE_DURATION of the other actions
+EXPORT_LEASE_DURATION = 300
+
+# time an export action may stay unclaimed once due (or with an expired lease): beyond,
+# no worker is running and the job is failed, so that it is not returned again
+EXPORT_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+# Project columns not exported (internal)
+EXCLUDED_COLUMNS = ["uid", "search_text"]
+
+
+def export_columns():
+    """Columns of the export, in the order of the former Excel file (id first)."""
+    columns = [c.name for c in Project.__table__.columns if c.name not in ["id"] + EXCLUDED_COLUMNS]
+    columns += ["department", "has_budget", "user", "members", "departments"]
+    for col, pos in [("user", 1), ("department", 2), ("status", 5), ("has_budget", 6)]:
+        columns.remove(col)
+        columns.insert(pos, col)
+
+    return ["id"] + columns
+
+
+def _name(user):
+    return get_name(user.p) if user and user.p else ""
+
+
+def _join(values):
+    return "\n".join(values) if isinstance(values, list) else values
+
+
+# formatting of the exported values (other columns: project attribute)
+FORMATTERS = {
+    "user": lambda p: _name(p.user),
+    "department": lambda p: p.user.p.department if p.user and p.user.p else None,
+    "members": lambda p: "\n".join(get_name(m.p) for m in p.members),
+    "departments": lambda p: "\n".join(m.department for m in p.members),
+    "modified_by": lambda p: _name(p.modifier),
+    "validated_by": lambda p: _name(p.validator),
+    "has_budget": lambda p: "Oui" if p.has_budget else "Non",
+    "is_recurring": lambda p: "Oui" if p.is_recurring else "Non",
+    "skills": lambda p: _join(p.skills),
+    "paths": lambda p: _join(p.paths),
+    "divisions": lambda p: (
+        "\n".join(division_name(d, "FS") for d in p.divisions)
+        if isinstance(p.divisions, list)
+        else p.divisions
+    ),
+    "requirement": lambda p: choices["requirement"].get(p.requirement, p.requirement),
+    "location": lambda p: choices["location"].get(p.location, p.location),
+    "students": lambda p: students_to_csv(p.students) if p.students else "",
+}
+
+
+def export_row(project, columns):
+    """Values of the exported columns for a project."""
+    return [
+        FORMATTERS[col](project) if col in FORMATTERS else getattr(project, col) for col in columns
+    ]
+
+
+def _export_query(user, years):
+    return query_projects(user=user, years=years).options(
+        joinedload(Project.user).joinedload(User.p),
+        joinedload(Project.modifier).joinedload(User.p),
+        joinedload(Project.validator).joinedload(User.p),
+        selectinload(Project.members).joinedload(ProjectMember.p),
+    )
+
+
+def iter_export_rows(user, years=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the header then a row per project, oldest first.
+    The projects are loaded chunk_size at a time, so that memory does not grow with the database.
+    """
+    query = _export_query(user, years)
+
+    columns = export_columns()
+    yield columns
+    for project in iter_keyset(query, chunk_size=chunk_size, order="asc"):
+        yield export_row(project, columns)
+
+
+def write_xlsx(rows, file):
+    """Writes the rows in a write-only workbook (rows written to disk as they come)."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(EXPORT_SHEET)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+
+def iter_csv(rows, delimiter=";"):
+    """Yields the rows as CSV text, one line at a time (with a BOM for Excel)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+
+    yield "\ufeff"
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# --- Columnar export (Parquet, Arrow IPC) for the analytics tools ---
+
+# formats written with pyarrow (optional dependency)
+ARROW_FORMATS = ["parquet", "arrow"]
+
+
+def arrow_available():
+    return find_spec("pyarrow") is not None
+
+
+def export_format_choices():
+    """Formats of the download form: Excel and CSV, and Parquet and Arrow if pyarrow is installed."""
+    formats = [("xlsx", "Excel"), ("csv", "CSV")]
+    if arrow_available():
+        formats += [("parquet", "Parquet"), ("arrow", "Arrow")]
+    return formats
+
+
+def _arrow_type(pa, column):
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    elif python_type is int:
+        return pa.int64()
+    elif python_type is datetime:
+        return pa.timestamp("us")
+    elif python_type is date:
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema():
+    """
+    Schema of the columnar export: the Project columns with their SQL types, the lists
+    (paths, skills, divisions, students) as Arrow lists, and the names of the creator,
+    members and history updaters.
+    """
+    import pyarrow as pa
+
+    json_types = {
+        "paths": pa.list_(pa.string()),
+        "skills": pa.list_(pa.string()),
+        "divisions": pa.list_(pa.string()),
+        "students": pa.list_(
+            pa.struct(
+                [("division", pa.string()), ("name", pa.string()), ("firstname", pa.string())]
+            )
+        ),
+    }
+    fields = [
+        (c.name, json_types[c.name] if c.name in json_types else _arrow_type(pa, c))
+        for c in Project.__table__.columns
+        if c.name != "search_text"
+    ]
+    fields += [
+        ("user", pa.string()),
+        ("department", pa.string()),
+        ("has_budget", pa.bool_()),
+        ("members", pa.list_(pa.string())),
+        ("departments", pa.list_(pa.string())),
+        (
+            "history",
+            pa.list_(
+                pa.struct(
+                    [
+                        ("status", pa.string()),
+                        ("updated_at", pa.timestamp("us")),
+                        ("updated_by", pa.string()),
+                    ]
+                )
+            ),
+        ),
+    ]
+
+    return pa.schema(fields)
+
+
+def _naive(value):
+    # datetimes are stored without time zone (pa.timestamp("us"))
+    return value.replace(tzinfo=None) if isinstance(value, datetime) else value
+
+
+def arrow_record(project, schema):
+    """Typed values of a project for the columnar export."""
+    record = {
+        name: _naive(getattr(project, name))
+        for name in schema.names
+        if name in Project.__table__.columns
+    }
+    record["students"] = [
+        {key: s.get(key) for key in ("division", "name", "firstname")}
+        for s in project.students or []
+    ]
+    record.update(
+        user=_name(project.user) or None,
+        department=project.user.p.department if project.user and project.user.p else None,
+        has_budget=project.has_budget,
+        members=[get_name(m.p) for m in project.members],
+        departments=[m.department for m in project.members],
+        history=[
+            {"status": h.status, "updated_at": _naive(h.updated_at), "updated_by": _name(h.updater)}
+            for h in sorted(project.history, key=attrgetter("updated_at"))
+        ],
+    )
+
+    return record
+
+
+def iter_arrow_batches(user, years=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the projects as Arrow record batches of chunk_size projects, oldest first."""
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    query = _export_query(user, years).options(
+        selectinload(Project.history).joinedload(ProjectHistory.updater).joinedload(User.p)
+    )
+
+    records = []
+    for project in iter_keyset(query, chunk_size=chunk_size, order="asc"):
+        records.append(arrow_record(project, schema))
+        if len(records) == chunk_size:
+            yield pa.RecordBatch.from_pylist(records, schema=schema)
+            records = []
+    if records:
+        yield pa.RecordBatch.from_pylist(records, schema=schema)
+
+
+def write_arrow(batches, file, file_format):
+    """
+    Writes the record batches as they come, as a Parquet file or an Arrow IPC file
+    (memory-mappable with pyarrow.memory_map).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(file, schema)
+    else:
+        writer = pa.ipc.new_file(file, schema)
+
+    with writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+# --- Export jobs (executed by the notifications worker) ---
+
+
+def export_key(user, years, file_format):
+    """
+    Key of an export: same user (drafts are exported for the members only), parameters
+    and version of the projects data give the same file.
+    """
+    key = repr((user.id, years, file_format, get_projects_version()))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def export_filepath(job):
+    return current_app.config["DATA_PATH"] / EXPORT_DIR / f"{job.key}.{job.file_format}"
+
+
+def request_export(user, years, file_format):
+    """
+    Returns the export job of the projects of years: the last job with the same key
+    (pending, running or done), else a new job queued for the worker.
+    """
+    key = export_key(user, years, file_format)
+    job = db.session.scalar(
+        select(ExportJob)
+        .where(ExportJob.key == key, ExportJob.status.in_(["pending", "running", "done"]))
+        .order_by(ExportJob.id.desc())
+        .limit(1)
+    )
+    if job and job.status != "done" and fail_stalled_job(job):
+        job = None
+    if job and (job.status != "done" or export_filepath(job).exists()):
+        return job
+
+    now = get_datetime()
+    job = ExportJob(
+        uid=user.id,
+        created_at=now,
+        years=years,
+        file_format=file_format,
+        key=key,
+        status="pending",
+        filename=f"Projets_LFS-{now.strftime('%Y-%m-%d-%Hh%M%S')}.{file_format}",
+    )
+    db.session.add(job)
+    db.session.flush()
+
+    # no user: not a notification of the user (see async_action)
+    action = QueuedAction(
+        uid=None,
+        timestamp=now,
+        status="pending",
+        action_type="export_projects",
+        parameters={"job_id": job.id},
+    )
+    db.session.add(action)
+    db.session.flush()
+    job.action_id = action.id
+
+    return job
+
+
+def _set_progress(job_id, **values):
+    db.session.execute(
+        update(ExportJob)
+        .where(ExportJob.id == job_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    # the export is still running: renew the worker lease of its action,
+    # so that a long export is not taken over (and run again) by another worker
+    action_id = select(ExportJob.action_id).where(ExportJob.id == job_id).scalar_subquery()
+    db.session.execute(
+        update(QueuedAction)
+        .where(QueuedAction.id == action_id, QueuedAction.status == "processing")
+        .values(available_at=get_datetime() + timedelta(seconds=EXPORT_LEASE_DURATION))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _track_progress(job_id, rows):
+    # header first, then the progress is saved every EXPORT_CHUNK_SIZE rows
+    yield next(rows)
+    n = 0
+    for n, row in enumerate(rows, start=1):
+        yield row
+        if n % EXPORT_CHUNK_SIZE == 0:
+            _set_progress(job_id, rows=n)
+    _set_progress(job_id, rows=n)
+
+
+def _track_batches(job_id, batches):
+    n = 0
+    for batch in batches:
+        yield batch
+        n += batch.num_rows
+        _set_progress(job_id, rows=n)
+    _set_progress(job_id, rows=n)
+
+
+def run_export_job(action):
+    """Writes the file of an export job. Returns an error string, or None if done."""
+    job = db.session.get(ExportJob, action.parameters["job_id"])
+    if not job:
+        return "Export job not found."
+    user = db.session.get(User, job.uid)
+    if not user:
+        return "User not found."
+
+    job_id = job.id
+    filepath = export_filepath(job)
+    file_format = job.file_format
+    total = query_projects(user=user, years=job.years).order_by(None).count()
+    _set_progress(job_id, status="running", rows=0, total=total)
+
+    tmp_filepath = filepath.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if file_format in ARROW_FORMATS:
+            batches = _track_batches(job_id, iter_arrow_batches(user, years=job.years))
+            write_arrow(batches, tmp_filepath, file_format)
+        elif file_format == "csv":
+            rows = _track_progress(job_id, iter_export_rows(user, years=job.years))
+            with open(tmp_filepath, "w", encoding="utf-8", newline="") as f:
+                f.writelines(iter_csv(rows))
+        else:
+            rows = _track_progress(job_id, iter_export_rows(user, years=job.years))
+            write_xlsx(rows, tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    except Exception as e:
+        db.session.rollback()
+        tmp_filepath.unlink(missing_ok=True)
+        logger.exception(f"Export job id={job_id} failed")
+        _set_progress(job_id, status="failed", last_error=f"{type(e).__name__}: {e}")
+        return f"Export failed: {e}"
+
+    _set_progress(job_id, status="done", finished_at=get_datetime())
+    logger.info(f"Export job id={job_id} done ({total} projects).")
+    prune_exports()
+
+    return None
+
+
+def fail_stalled_job(job):
+    """
+    Marks a pending or running export job failed if the worker will not finish it: action
+    dead or missing, or not claimed EXPORT_CLAIM_TIMEOUT after it was due (no worker running).
+    Its action is removed. Returns True if the job was failed.
+    """
+    if job.action_id is not None:
+        # conditional delete: an action claimed (or renewed) in the meantime is kept
+        db.session.execute(
+            delete(QueuedAction)
+            .where(
+                QueuedAction.id == job.action_id,
+                QueuedAction.status.in_(["pending", "processing"]),
+                func.coalesce(QueuedAction.available_at, QueuedAction.timestamp)
+                < get_datetime() - EXPORT_CLAIM_TIMEOUT,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        action = db.session.get(QueuedAction, job.action_id, populate_existing=True)
+        if action and action.status != "dead":
+            return False
+
+    job.status = "failed"
+    job.last_error = "Export non traité par le worker (flask notifications-worker)."
+    logger.warning(f"Export job id={job.id} failed: not processed by the worker.")
+    return True
+
+
+def export_job_status(job):
+    """Progress of an export job (polled by the dashboard), failed if abandoned by the worker."""
+    if job.status in ["pending", "running"]:
+        fail_stalled_job(job)
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "rows": job.rows,
+        "total": job.total,
+        "progress": round(100 * job.rows / job.total) if job.total else 0,
+        "filename": job.filename,
+    }
+
+
+def prune_exports():
+    """
+    Deletes the export jobs older than EXPORT_RETENTION and the done jobs beyond the
+    EXPORT_MAX_FILES most recent ones, with their files. Returns the number of jobs deleted.
+    """
+    limit = get_datetime() - EXPORT_RETENTION
+    done_ids = db.session.scalars(
+        select(ExportJob.id)
+        .where(ExportJob.status == "done")
+        .order_by(ExportJob.id.desc())
+        .offset(EXPORT_MAX_FILES)
+    ).all()
+    jobs = db.session.scalars(
+        select(ExportJob).where((ExportJob.created_at < limit) | ExportJob.id.in_(done_ids))
+    ).all()
+
+    for job in jobs:
+        # the file of a failed job may be the one of a later job with the same key
+        if job.status == "done":
+            export_filepath(job).unlink(missing_ok=True)
+        db.session.delete(job)
+    db.session.commit()
+
+    # files of the former downloads (written in DATA_PATH on every request)
+    for filepath in current_app.config["DATA_PATH"].glob("Projets_LFS-*.xlsx"):
+        if time.time() - filepath.stat().st_mtime > EXPORT_RETENTION.total_seconds():
+            filepath.unlink(missing_ok=True)
+
+    if jobs:
+        logger.info(f"{len(jobs)} export job(s) pruned.")
+    return len(jobs)
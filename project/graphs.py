@@ -1,7 +1,82 @@
+import hashlib
+import logging
+import os
 import re
+from functools import wraps
 
 import pandas as pd
+import plotly
 import plotly.express as px
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# rendered charts are cached in DATA_PATH/charts, up to CHART_CACHE_MAX_SIZE bytes
+CHART_CACHE_DIR = "charts"
+CHART_CACHE_MAX_SIZE = 50 * 1024 * 1024
+
+# plotly.js is served from the app static files
+PLOTLY_JS = "static/js/plotly.min.js"
+
+
+def chart_fingerprint(name, df, *args):
+    """Returns a stable hash of the chart name, the input DataFrame and the chart parameters."""
+    h = hashlib.sha256()
+    h.update(repr((name, plotly.__version__, list(df.columns), args)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def evict_charts(cache_dir):
+    """Removes the least recently used charts when the cache exceeds CHART_CACHE_MAX_SIZE."""
+    files = sorted(
+        (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+        for entry in os.scandir(cache_dir)
+        if entry.is_file() and entry.name.endswith(".html")
+    )
+    size = sum(file_size for _, file_size, _ in files)
+    for _, file_size, path in files:
+        if size <= CHART_CACHE_MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= file_size
+
+
+def cached_chart(chart):
+    """
+    Caches the HTML of a chart on disk, keyed by the fingerprint of its input DataFrame
+    and parameters, so that unchanged charts are not rebuilt.
+    """
+
+    @wraps(chart)
+    def wrapper(df, *args):
+        cache_dir = current_app.config["DATA_PATH"] / CHART_CACHE_DIR
+        filepath = cache_dir / f"{chart_fingerprint(chart.__name__, df, *args)}.html"
+
+        try:
+            graph_html = filepath.read_text(encoding="utf-8")
+            os.utime(filepath)  # mark as recently used
+            return graph_html
+        except FileNotFoundError:
+            pass
+
+        graph_html = chart(df, *args)
+
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_filepath = filepath.with_suffix(f".{os.getpid()}.tmp")
+            tmp_filepath.write_text(graph_html, encoding="utf-8")
+            os.replace(tmp_filepath, filepath)
+            evict_charts(cache_dir)
+        except OSError as e:
+            logger.warning(f"Error caching chart {chart.__name__}: {e}")
+
+        return graph_html
+
+    return wrapper
 
 
 def rgb_tint(str_rgb, tint):
@@ -11,6 +86,7 @@ def rgb_tint(str_rgb, tint):
     return f"rgb({rgbt[0]}, {rgbt[1]}, {rgbt[2]})"
 
 
+@cached_chart
 def sunburst_chart(dfa):
     """Draw plotly sunburst chart"""
     color_palette = px.colors.qualitative.Pastel
@@ -54,12 +130,13 @@ def sunburst_chart(dfa):
     )
 
     graph_html = fig.to_html(
-        full_html=False, include_plotlyjs="directory", config={"displaylogo": False}
-    ).replace("plotly.min.js", "static/js/plotly.min.js")
+        full_html=False, include_plotlyjs=PLOTLY_JS, config={"displaylogo": False}
+    )
 
     return graph_html
 
 
+@cached_chart
 def pe_bar_chart(dfa, axes):
     """Draw stacked bar chart with tinted colors for each stacked bar
     for Projet d'établissement"""
@@ -126,12 +203,13 @@ def pe_bar_chart(dfa, axes):
     )
 
     graph_html = fig.to_html(
-        full_html=False, include_plotlyjs="directory", config={"displaylogo": False}
-    ).replace("plotly.min.js", "static/js/plotly.min.js")
+        full_html=False, include_plotlyjs=PLOTLY_JS, config={"displaylogo": False}
+    )
 
     return graph_html
 
 
+@cached_chart
 def timeline_chart(dft):
     color_palette = px.colors.qualitative.Pastel
 
@@ -161,7 +239,7 @@ def timeline_chart(dft):
         fig.data[i].hovertemplate = fig.data[i].name
 
     graph_html = fig.to_html(
-        full_html=False, include_plotlyjs="directory", config={"displaylogo": False}
-    ).replace("plotly.min.js", "static/js/plotly.min.js")
+        full_html=False, include_plotlyjs=PLOTLY_JS, config={"displaylogo": False}
+    )
 
     return graph_html
@@ -0,0 +1,108 @@
+# mail_quota.py
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import MailQuota, db
+from .utils import get_datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    # naive local time, as read back from the database
+    return get_datetime().replace(tzinfo=None)
+
+
+def _limits():
+    config = current_app.config
+    return config["MAIL_RATE"], config["MAIL_BURST"], config["MAIL_DAILY_QUOTA"]
+
+
+def reserve_sends(n):
+    """
+    Reserves n outbound messages in the rate limiter (token bucket) and the daily quota,
+    both stored in the database so that they are shared by all the workers.
+    Returns 0 if the messages can be sent now, else the number of seconds to wait.
+    """
+    rate, burst, quota = _limits()
+
+    for _ in range(5):
+        now = _now()
+        today = now.date()
+
+        row = db.session.execute(
+            select(MailQuota)
+            .where(MailQuota.day == today)
+            .execution_options(populate_existing=True)
+        ).scalar_one_or_none()
+
+        if row is None:
+            if n > quota:
+                return _seconds_to_tomorrow(now)
+            # the bucket is full at the start of the day (a batch larger than the burst is
+            # let through, and the debt in tokens slows down the next ones)
+            db.session.add(MailQuota(day=today, sent=n, tokens=burst - n, refilled_at=now))
+            try:
+                db.session.commit()
+                return 0
+            except IntegrityError:
+                # another worker created the row first: retry with it
+                db.session.rollback()
+                continue
+
+        if row.sent + n > quota:
+            logger.warning(f"Daily mail quota reached ({row.sent}/{quota}).")
+            return _seconds_to_tomorrow(now)
+
+        elapsed = max((now - row.refilled_at).total_seconds(), 0)
+        tokens = min(burst, row.tokens + elapsed * rate)
+        if tokens < min(n, burst):
+            return max(round((min(n, burst) - tokens) / rate), 1)
+
+        # conditional update: fails if another worker used the bucket in the meantime
+        result = db.session.execute(
+            update(MailQuota)
+            .where(
+                MailQuota.day == today,
+                MailQuota.sent == row.sent,
+                MailQuota.refilled_at == row.refilled_at,
+            )
+            .values(sent=row.sent + n, tokens=tokens - n, refilled_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount:
+            return 0
+
+    # too much contention: let the caller retry shortly
+    return 1
+
+
+def _seconds_to_tomorrow(now):
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return round((tomorrow - now).total_seconds()) + 1
+
+
+def get_mail_usage():
+    """Today's outbound mail usage, for the admin dashboard."""
+    rate, burst, quota = _limits()
+    now = _now()
+    row = db.session.get(MailQuota, now.date())
+
+    if row is None:
+        sent, tokens = 0, burst
+    else:
+        elapsed = max((now - row.refilled_at).total_seconds(), 0)
+        sent, tokens = row.sent, min(burst, row.tokens + elapsed * rate)
+
+    return {
+        "sent": sent,
+        "quota": quota,
+        "tokens": max(int(tokens), 0),
+        "burst": burst,
+        "rate": rate,
+    }
@@ -0,0 +1,338 @@
+# mail_transports.py
+import base64
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from email.message import EmailMessage
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# package root directory (credentials and token files)
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+class MailTransport(ABC):
+    """Sends email messages. Subclasses implement send()."""
+
+    name = "none"
+
+    @abstractmethod
+    def send(self, message: EmailMessage):
+        """Sends message, returns a dict with the message id or None on failure."""
+
+    def send_many(self, messages):
+        """Sends a batch of messages, returns the list of send() results."""
+        return [self.send(message) for message in messages]
+
+
+class GmailTransport(MailTransport):
+    """
+    Sends messages with the Gmail API.
+    The Gmail API client (httplib2) is not thread-safe: each thread of the worker creates
+    its own client on first send, so that the threads send (and back off) concurrently.
+    """
+
+    name = "gmail"
+    scopes = ("https://www.googleapis.com/auth/gmail.send",)
+    max_retries = 3
+
+    def __init__(self, client_secret_file, token_file):
+        self.client_secret_file = client_secret_file
+        self.token_file = token_file
+        self._local = threading.local()
+        # the token file is read (and rewritten when refreshed) by one thread at a time
+        self._lock = threading.Lock()
+
+    def _get_service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            import httplib2
+            from google.auth.exceptions import GoogleAuthError
+            from googleapiclient.errors import Error as GoogleApiError
+
+            from .google_api_service import create_service
+
+            try:
+                with self._lock:
+                    service = create_service(
+                        self.client_secret_file, self.token_file, "gmail", "v1", list(self.scopes)
+                    )
+            except (
+                GoogleAuthError,
+                GoogleApiError,
+                httplib2.HttpLib2Error,
+                OSError,
+                ValueError,
+            ) as error:
+                logger.error(f"Gmail service could not be created: {error}")
+            self._local.service = service
+        return service
+
+    @staticmethod
+    def _is_rate_limited(error):
+        """Gmail answers 429, or 403 with a rate limit reason, when the sending quotas are exceeded."""
+        status = int(getattr(error.resp, "status", 0) or 0)
+        return status == 429 or (status == 403 and "ratelimitexceeded" in str(error).lower())
+
+    @staticmethod
+    def _backoff(attempt):
+        # exponential backoff with jitter: 1-2 s, 2-4 s, 4-8 s...
+        return random.uniform(2**attempt, 2 ** (attempt + 1))
+
+    @staticmethod
+    def _body(message):
+        return {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
+
+    def send(self, message):
+        from googleapiclient.errors import HttpError
+
+        body = self._body(message)
+
+        service = self._get_service()
+        if not service:
+            logger.warning(
+                f"Email '{message['Subject']}' not sent: Gmail service is not initialized."
+            )
+            return None
+
+        for attempt in range(self.max_retries):
+            try:
+                send_message = service.users().messages().send(userId="me", body=body).execute()
+                logger.info(f"Email sent successfully. Message ID: {send_message.get('id')}")
+                return send_message
+
+            # Catch Google-specific errors (e.g., 400 Bad Request, invalid address)
+            except HttpError as error:
+                if self._is_rate_limited(error) and attempt < self.max_retries - 1:
+                    logger.warning(
+                        f"Gmail rate limit (attempt {attempt + 1}/{self.max_retries}): {error}"
+                    )
+                    time.sleep(self._backoff(attempt))
+                    continue
+                logger.error(f"Google API rejected the email '{message['Subject']}': {error}")
+                # Do NOT retry. This is a hard error that will never succeed.
+                break
+
+            # Catch network errors (like the EOF protocol error or timeouts)
+            except (ConnectionError, TimeoutError, OSError) as error:
+                logger.warning(
+                    f"Connection dropped (attempt {attempt + 1}/{self.max_retries}): {error}"
+                )
+
+                if attempt < self.max_retries - 1:
+                    time.sleep(2)  # The next loop will force a brand new, fresh socket!
+                else:
+                    logger.error(
+                        f"Email failed after {self.max_retries} attempts. Final error: {error}"
+                    )
+
+        return None
+
+    def send_many(self, messages):
+        """Sends the messages in a single batch HTTP request."""
+        if len(messages) < 2:
+            return [self.send(message) for message in messages]
+
+        from googleapiclient.errors import HttpError
+
+        results = [None] * len(messages)
+        rejected = set()
+        rate_limited = set()
+
+        def callback(request_id, response, exception):
+            i = int(request_id)
+            if exception and isinstance(exception, HttpError) and self._is_rate_limited(exception):
+                # retried with the next batch
+                rate_limited.add(i)
+                logger.warning(f"Gmail rate limit for the email '{messages[i]['Subject']}'.")
+            elif exception:
+                rejected.add(i)
+                logger.error(
+                    f"Google API rejected the email '{messages[i]['Subject']}': {exception}"
+                )
+            else:
+                results[i] = response
+                logger.info(f"Email sent successfully. Message ID: {response.get('id')}")
+
+        service = self._get_service()
+        if not service:
+            logger.warning(f"{len(messages)} emails not sent: Gmail service is not initialized.")
+            return results
+
+        for attempt in range(self.max_retries):
+            rate_limited.clear()
+            batch = service.new_batch_http_request(callback=callback)
+            for i, message in enumerate(messages):
+                if results[i] is None and i not in rejected:
+                    batch.add(
+                        service.users().messages().send(userId="me", body=self._body(message)),
+                        request_id=str(i),
+                    )
+            try:
+                batch.execute()
+                if not rate_limited:
+                    break
+                if attempt < self.max_retries - 1:
+                    time.sleep(self._backoff(attempt))
+
+            except HttpError as error:
+                logger.error(f"Google API rejected the batch of {len(messages)} emails: {error}")
+                break
+
+            except (ConnectionError, TimeoutError, OSError) as error:
+                logger.warning(
+                    f"Connection dropped (attempt {attempt + 1}/{self.max_retries}): {error}"
+                )
+
+                if attempt < self.max_retries - 1:
+                    time.sleep(2)
+                else:
+                    logger.error(
+                        f"Emails failed after {self.max_retries} attempts. Final error: {error}"
+                    )
+
+        return results
+
+
+class SMTPTransport(MailTransport):
+    """Sends messages with an SMTP server (one connection per message)."""
+
+    name = "smtp"
+
+    def __init__(self, host, port=587, username=None, password=None, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def send(self, message):
+        return self.send_many([message])[0]
+
+    def send_many(self, messages):
+        """Sends the messages through a single SMTP connection."""
+        results = [None] * len(messages)
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.username:
+                    smtp.login(self.username, self.password)
+                for i, message in enumerate(messages):
+                    try:
+                        smtp.send_message(message)
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as error:
+                        logger.error(
+                            f"SMTP server rejected the email '{message['Subject']}': {error}"
+                        )
+                        continue
+                    logger.info(
+                        f"Email sent successfully (SMTP). Message ID: {message['Message-ID']}"
+                    )
+                    results[i] = {"id": message["Message-ID"]}
+        except (smtplib.SMTPException, OSError) as error:
+            logger.error(f"SMTP connection failed: {error}")
+
+        return results
+
+
+class FileTransport(MailTransport):
+    """Writes messages as .eml files in a directory (offline runs)."""
+
+    name = "file"
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self._count += 1
+            count = self._count
+        self.directory.mkdir(parents=True, exist_ok=True)
+        filepath = self.directory / f"{time.time_ns()}-{os.getpid()}-{count}.eml"
+        filepath.write_bytes(message.as_bytes())
+        logger.info(f"Email '{message['Subject']}' written to {filepath}")
+        return {"id": filepath.name}
+
+
+class MemoryTransport(MailTransport):
+    """Keeps messages in memory (tests)."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self.outbox.append(message)
+            return {"id": str(len(self.outbox))}
+
+
+def create_mail_transport():
+    """
+    Creates the mail transport selected by the MAIL_TRANSPORT environment variable:
+    "gmail", "smtp", "file", "memory" or "none".
+    Defaults to "gmail", or "none" if USE_GMAIL_SERVICE is false.
+    """
+    gmail_enabled = os.getenv("USE_GMAIL_SERVICE", "True").lower() in ("true", "1")
+    transport = os.getenv("MAIL_TRANSPORT", "gmail" if gmail_enabled else "none").lower()
+
+    if transport == "gmail":
+        return GmailTransport(
+            BASE_DIR / os.getenv("CLIENT_SECRET_FILE", "credentials.json"),
+            BASE_DIR / os.getenv("TOKEN_FILE", "token.json"),
+        )
+    elif transport == "smtp":
+        return SMTPTransport(
+            os.getenv("SMTP_HOST", "localhost"),
+            int(os.getenv("SMTP_PORT", "587")),
+            os.getenv("SMTP_USERNAME"),
+            os.getenv("SMTP_PASSWORD"),
+            os.getenv("SMTP_STARTTLS", "True").lower() in ("true", "1"),
+        )
+    elif transport == "file":
+        return FileTransport(BASE_DIR / os.getenv("MAIL_FILE_DIR", "mails"))
+    elif transport == "memory":
+        return MemoryTransport()
+
+    logger.warning("Mail transport not configured: emails will not be sent.")
+    return None
+
+
+_transport = None
+_transport_created = False
+_transport_lock = threading.Lock()
+
+
+def get_mail_transport():
+    """Returns the mail transport of the worker (created on first use), None if disabled."""
+    global _transport, _transport_created
+
+    if not _transport_created:
+        with _transport_lock:
+            if not _transport_created:
+                _transport = create_mail_transport()
+                _transport_created = True
+    return _transport
+
+
+def set_mail_transport(transport):
+    """Replaces the mail transport of the worker (tests, offline runs)."""
+    global _transport, _transport_created
+
+    with _transport_lock:
+        _transport = transport
+        _transport_created = True
+
+
+def mail_enabled():
+    return get_mail_transport() is not None
@@ -20,6 +20,10 @@ class Personnel(db.Model, UserMixin):
     department: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
     role: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
 
+    # lowercase names without accents, for search (see search.py)
+    search_name: Mapped[str | None] = mapped_column(String(100), index=True)
+    search_firstname: Mapped[str | None] = mapped_column(String(100), index=True)
+
     user: Mapped["User | None"] = relationship("User", back_populates="p", uselist=False)
     projects: Mapped[list["ProjectMember"]] = relationship(
         "ProjectMember", back_populates="p", lazy=True
@@ -45,6 +49,9 @@ class User(db.Model, UserMixin):
     preferences: Mapped[dict[str, Any]] = mapped_column(db.JSON, default=dict, nullable=False)
     new_messages: Mapped[list[Any]] = mapped_column(db.JSON, default=list, nullable=False)
 
+    # projects of the user waiting for approval or validation (to-do, see counters.py)
+    pending_validations: Mapped[int] = mapped_column(default=0, nullable=False)
+
     pid: Mapped[int | None] = mapped_column(ForeignKey("personnels.id"), unique=True)
 
     p: Mapped["Personnel | None"] = relationship("Personnel", back_populates="user")
@@ -64,7 +71,10 @@ class Project(db.Model):
     uid: Mapped[int | None] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
 
-    school_year: Mapped[str] = mapped_column(String(20), nullable=False, index=True)
+    # active_history: former school year known on change (data version of both years)
+    school_year: Mapped[str] = mapped_column(
+        String(20), nullable=False, index=True, active_history=True
+    )
     title: Mapped[str] = mapped_column(String(100), nullable=False)
 
     start_date: Mapped[datetime] = mapped_column(nullable=False)
@@ -138,6 +148,10 @@ class Project(db.Model):
 
     status: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
 
+    # lowercase text without accents of the project, its members, creator and validator
+    # (see search.py), indexed by the search index
+    search_text: Mapped[str | None] = mapped_column(Text)
+
     # Explicit relationships
     user: Mapped["User | None"] = relationship(
         "User", foreign_keys=[uid], back_populates="projects"
@@ -302,6 +316,9 @@ class Dashboard(db.Model):
     lock_message: Mapped[str | None] = mapped_column(Text)
     welcome_message: Mapped[str | None] = mapped_column(Text)
 
+    # projects waiting for approval or validation (gestion/direction to-do, see counters.py)
+    pending_validations: Mapped[int] = mapped_column(default=0, nullable=False)
+
 
 class SchoolYear(db.Model):
     __tablename__ = "school_years"
@@ -333,3 +350,50 @@ class QueuedAction(db.Model):
     # Restored db.JSON explicitly:
     parameters: Mapped[dict[str, Any] | None] = mapped_column(db.JSON, default=dict)
     options: Mapped[dict[str, Any] | None] = mapped_column(db.JSON, default=dict)
+
+    # background worker: number of attempts, lease or retry date, last error
+    attempts: Mapped[int] = mapped_column(default=0, nullable=False)
+    available_at: Mapped[datetime | None] = mapped_column(index=True)
+    last_error: Mapped[str | None] = mapped_column(Text)
+
+    # key of a pending action that must not be queued twice (comment digests), cleared when claimed
+    dedup_key: Mapped[str | None] = mapped_column(String(100), unique=True, index=True)
+
+
+class CacheVersion(db.Model):
+    __tablename__ = "cache_versions"
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(default=0, nullable=False)
+
+
+class MailQuota(db.Model):
+    __tablename__ = "mail_quota"
+
+    # one row per day: number of messages sent, and token bucket of the outbound rate limiter
+    day: Mapped[date] = mapped_column(primary_key=True)
+    sent: Mapped[int] = mapped_column(default=0, nullable=False)
+    tokens: Mapped[float] = mapped_column(nullable=False)
+    refilled_at: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class ExportJob(db.Model):
+    __tablename__ = "export_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    uid: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
+
+    # export parameters, and key of the exported data (parameters and data version)
+    years: Mapped[str | None] = mapped_column(String(20))
+    file_format: Mapped[str] = mapped_column(String(10), nullable=False)
+    key: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+
+    # "pending", "running", "done" or "failed", exported rows out of total
+    status: Mapped[str] = mapped_column(String(30), nullable=False)
+    rows: Mapped[int] = mapped_column(default=0, nullable=False)
+    total: Mapped[int | None] = mapped_column()
+    action_id: Mapped[int | None] = mapped_column()
+    filename: Mapped[str | None] = mapped_column(String(100))
+    finished_at: Mapped[datetime | None] = mapped_column()
+    last_error: Mapped[str | None] = mapped_column(Text)
@@ -1,25 +1,49 @@
+import logging
 import os
+from datetime import timedelta
 from email.utils import formataddr
 
-from flask import render_template, url_for
+from flask import current_app, render_template, url_for
 from flask_login import current_user
 from jinja2 import TemplateNotFound
-
-from . import gmail_service_api
-from .gmail_api_client import gmail_send_message
-from .models import ProjectComment, QueuedAction, db
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .export import run_export_job
+from .gmail_api_client import build_message, send_messages
+from .mail_quota import reserve_sends
+from .mail_transports import mail_enabled
+from .models import Project, ProjectComment, QueuedAction, User, db
 from .utils import (
     division_names,
     get_cached_personnel,
+    get_date_fr,
     get_datetime,
+    get_notification_recipients,
+    get_personnel_by_email,
     get_project_dates,
     get_project_division_bit,
 )
 
+logger = logging.getLogger(__name__)
+
 # environment/config
 APP_DASHBOARD = os.getenv("APP_DASHBOARD")
 
 
+class SendError(str):
+    """Error message of a notification that could not be sent (temporary error, can be retried)."""
+
+
+class DeferredSend(SendError):
+    """Notification not sent because of the outbound mail limits, to be sent after retry_after seconds."""
+
+    def __new__(cls, message, retry_after):
+        error = super().__new__(cls, message)
+        error.retry_after = retry_after
+        return error
+
+
 def format_addr(emails):
     """
     Accepts list of email strings. Returns comma-joined "Name <email>" addresses.
@@ -27,14 +51,12 @@ def format_addr(emails):
     if not emails:
         return ""
 
-    personnels = get_cached_personnel()
-    personnel_list = [p for p in personnels if p.email in emails and p.role != "inactive"]
-    p_map = {p.email: p for p in personnel_list}
+    personnels = get_personnel_by_email()
 
     f_email = []
     for email in emails:
-        p = p_map.get(email)
-        name = f"{p.firstname} {p.name}".replace("é", "e") if p else email
+        p = personnels.get(email)
+        name = f"{p.firstname} {p.name}".replace("é", "e") if p and p.role != "inactive" else email
         f_email.append(formataddr((name, email)))
     return ",".join(f_email)
 
@@ -49,7 +71,7 @@ def format_addr(emails):
 # }
 
 
-def create_admin_notification(text):
+def create_admin_notification(text, user_email=None, url=None):
     personnels = get_cached_personnel()
     admin = next((p for p in personnels if p.role == "admin"), None)
     recipients = [admin.email] if admin else []
@@ -58,8 +80,9 @@ def create_admin_notification(text):
         return None
 
     message = "Bonjour,\n"
-    user_email = current_user.p.email if current_user.is_authenticated else "Anonymous"
-    message += f"An Internal Server Error occured at {text}. User : {user_email}.\n"
+    message += f"An Internal Server Error occured at {text}. User : {user_email or 'Anonymous'}.\n"
+    if url:
+        message += f"Route : {url}\n"
     message += f"Access to log files:\n{APP_DASHBOARD}"
 
     subject = "Projets LFS : Internal Server Error"
@@ -73,7 +96,7 @@ def create_admin_notification(text):
     }
 
 
-def create_comment_notification(project, recipients, text):
+def create_comment_notification(project, recipients, text, author=None):
     personnels = get_cached_personnel()
     personnel_list = [p for p in personnels if p.id in recipients and p.role != "inactive"]
     resolved = [p.email for p in personnel_list]
@@ -81,7 +104,6 @@ def create_comment_notification(project, recipients, text):
     if not resolved:
         return None
 
-    author = getattr(current_user, "p", None)
     author_name = f"{author.firstname} {author.name}" if author else ""
     author_email = author.email if author else ""
 
@@ -121,7 +143,60 @@ def create_comment_notification(project, recipients, text):
     }
 
 
-def create_rejected_comment_notification(project, recipients, text):
+def create_comment_digest_notification(project, recipients, comments):
+    """Groups several new comments of a project in one notification."""
+    personnels = get_cached_personnel()
+    personnel_list = [p for p in personnels if p.id in recipients and p.role != "inactive"]
+    resolved = [p.email for p in personnel_list]
+
+    if not resolved:
+        return None
+
+    # one markdown block per comment: author, date and message
+    blocks = []
+    for comment in comments:
+        author = comment.user.p if comment.user else None
+        author_name = f"{author.firstname} {author.name}" if author else ""
+        posted_at = get_date_fr(comment.posted_at, withtime=True)
+        blocks.append(f"**{author_name}**, {posted_at} :\n\n{comment.message}")
+
+    msg = "Bonjour,\n\n"
+    msg += f'{len(comments)} nouveaux commentaires sur le projet "{project.title}" ont été ajoutés :\n\n'
+    msg += "\n\n".join(blocks) + "\n\n"
+
+    message = f"{len(comments)} nouveaux commentaires ont été ajoutés."
+
+    summary = "Accédez au projet pour gérer les prochaines étapes et ajouter un commentaire."
+
+    project_url = url_for("projects.view_project", id=project.id, _external=True)
+
+    msg = msg + summary[:-1] + " :\n" + project_url
+
+    subject = "Projets LFS : nouveaux commentaires"
+
+    return {
+        "recipients": resolved,
+        "subject": subject,
+        "message": msg,
+        "template": "project_notification.html",
+        "template_vars": {
+            "title": "Nouveaux commentaires",
+            "subtitle": None,
+            "message": message,
+            "author_name": None,
+            "author_email": None,
+            "project_title": project.title,
+            "project_date": get_project_dates(project.start_date, project.end_date, br=False),
+            "divisions": division_names(project.divisions, "Fs"),
+            "comment_text": "\n\n".join(blocks),
+            "project_url": project_url,
+            "print_url": None,
+            "summary": summary,
+        },
+    }
+
+
+def create_rejected_comment_notification(project, recipients, text, author=None):
     personnels = get_cached_personnel()
     personnel_list = [p for p in personnels if p.id in recipients and p.role != "inactive"]
     resolved = [p.email for p in personnel_list]
@@ -129,7 +204,6 @@ def create_rejected_comment_notification(project, recipients, text):
     if not resolved:
         return None
 
-    author = getattr(current_user, "p", None)
     author_name = f"{author.firstname} {author.name}" if author else ""
 
     msg = "Bonjour,\n\n"
@@ -168,11 +242,7 @@ def create_rejected_comment_notification(project, recipients, text):
     }
 
 
-def create_validation_request_notification(project):
-    # query personnels with 'gestion' and 'direction' roles
-    personnels = get_cached_personnel()
-    personnels_gd = [p for p in personnels if p.role in ["gestion", "direction"]]
-
+def create_validation_request_notification(project, author=None):
     # Map project status to JSON preference keys
     status_to_key = {"ready-1": "notify_approval_req", "ready": "notify_validation_req"}
     target_key = status_to_key.get(project.status)
@@ -180,20 +250,14 @@ def create_validation_request_notification(project):
     if not target_key:
         return None
 
-    # filter preferences
-    project_bit = get_project_division_bit(project)
-
-    recipients = []
-    for p in personnels_gd:
-        if p.user and isinstance(p.user.preferences, dict):
-            user_pref_bit = p.user.preferences.get(target_key, 0)
-            if (user_pref_bit & project_bit) > 0:
-                recipients.append(p.email)
+    # 'gestion' and 'direction' personnels subscribed for the project section(s)
+    recipients = [
+        p.email for p in get_notification_recipients(target_key, get_project_division_bit(project))
+    ]
 
     if not recipients:
         return None
 
-    author = getattr(current_user, "p", None)
     author_name = f"{author.firstname} {author.name}" if author else ""
     author_email = author.email if author else ""
 
@@ -247,13 +311,12 @@ def create_validation_request_notification(project):
     }
 
 
-def create_validation_result_notification(project):
+def create_validation_result_notification(project, author=None):
     recipients = [m.p.email for m in project.members if m.p.email and m.p.role != "inactive"]
 
     if not recipients:
         return None
 
-    author = getattr(current_user, "p", None)
     author_name = f"{author.firstname} {author.name}" if author else ""
 
     msg = "Bonjour,\n"
@@ -308,27 +371,20 @@ def create_validation_result_notification(project):
     }
 
 
-def create_validation_notification(project):
-    personnels = get_cached_personnel()
-    personnel_query = [p for p in personnels if p.role == "gestion"]
-
+def create_validation_notification(project, author=None):
     status_to_key = {"validated-1": "notify_approved", "validated": "notify_validated"}
     target_key = status_to_key.get(project.status)
 
-    project_bit = get_project_division_bit(project)
-
     recipients = [
         p.email
-        for p in personnel_query
-        if p.user
-        and isinstance(p.user.preferences, dict)
-        and (p.user.preferences.get(target_key, 0) & project_bit) > 0
+        for p in get_notification_recipients(
+            target_key, get_project_division_bit(project), roles=("gestion",)
+        )
     ]
 
     if not recipients:
         return None
 
-    author = getattr(current_user, "p", None)
     author_name = f"{author.firstname} {author.name}" if author else ""
 
     msg = "Bonjour,\n\n"
@@ -406,79 +462,201 @@ def _render_html_from_notification(notification):
 # --- send_notification ---
 
 
-def send_notification(notification_type, project, recipients=None, text=""):
+def send_notification(
+    notification_type,
+    project,
+    recipients=None,
+    text="",
+    author=None,
+    comments=None,
+    user_email=None,
+    url=None,
+):
     """
     notification_type: as before
     project: Project instance (may be None for admin)
     recipients: used by comment notification (list of Personnel ids)
     text: used for admin (error text) and comment content
+    author: Personnel who triggered the notification (defaults to the current user)
+    comments: used by comment digest notification (list of ProjectComment)
+    user_email, url: used for admin (user and URL of the request in error)
+    Returns None when done (nobody to notify, or sent at least in part), a DeferredSend if the
+    mail limits are reached, a SendError if nothing could be sent, or an error string.
     """
+    if author is None:
+        author = getattr(current_user, "p", None)
+
     notifications = []
 
     if notification_type == "admin":
-        notif = create_admin_notification(text)
+        notif = create_admin_notification(text, user_email, url)
         if notif:
             notifications.append(notif)
 
     elif notification_type == "comment":
-        notif = create_comment_notification(project, recipients or [], text)
+        notif = create_comment_notification(project, recipients or [], text, author)
         if notif:
             notifications.append(notif)
 
     elif notification_type == "rejected_comment":
-        notif = create_rejected_comment_notification(project, recipients or [], text)
+        notif = create_rejected_comment_notification(project, recipients or [], text, author)
+        if notif:
+            notifications.append(notif)
+
+    elif notification_type == "comment_digest":
+        notif = create_comment_digest_notification(project, recipients or [], comments or [])
         if notif:
             notifications.append(notif)
 
     elif notification_type in ["ready-1", "ready"]:
-        notif = create_validation_request_notification(project)
+        notif = create_validation_request_notification(project, author)
         if notif:
             notifications.append(notif)
 
     elif notification_type in ["validated-1", "validated", "validated-10", "rejected"]:
-        notif = create_validation_result_notification(project)
+        notif = create_validation_result_notification(project, author)
         if notif:
             notifications.append(notif)
         if notification_type in ["validated-1", "validated"]:
-            notif2 = create_validation_notification(project)
+            notif2 = create_validation_notification(project, author)
             if notif2:
                 notifications.append(notif2)
     else:
         return f"Attention : notification inconnue ({notification_type})."
 
     if not notifications:
-        return "Attention : aucune notification n'a pu être envoyée (aucun destinataire)."
+        # nobody to notify (no validator, inactive recipients...): nothing to send
+        logger.info(f"No recipient for the {notification_type} notification.")
+        return None
+
+    # build all the messages of the event, then send them as one batch
+    reply_to = format_addr([author.email]) if author else ""
 
+    rendered = {}
+    messages = []
     for notification in notifications:
-        # compute reply-to and recipients
-        reply_to = (
-            format_addr([current_user.p.email])
-            if current_user and getattr(current_user, "p", None)
-            else ""
-        )
-        recipients_list = notification.get("recipients", [])
-
-        # render HTML
-        html_body = _render_html_from_notification(notification)
-
-        # call gmail_send_message
-        gmail_send_message(
-            reply_to,
-            format_addr(recipients_list),
-            notification.get("message", ""),
-            notification.get("subject", ""),
-            html=html_body,
+        # render HTML once per distinct template and variables
+        key = (notification.get("template"), repr(notification.get("template_vars")))
+        if key not in rendered:
+            rendered[key] = _render_html_from_notification(notification)
+
+        messages.append(
+            build_message(
+                reply_to,
+                format_addr(notification.get("recipients", [])),
+                notification.get("message", ""),
+                notification.get("subject", ""),
+                html=rendered[key],
+            )
         )
 
+    # outbound mail limits (rate and daily quota): defer the whole event
+    if mail_enabled():
+        wait = reserve_sends(len(messages))
+        if wait:
+            return DeferredSend(f"Limite d'envoi atteinte : envoi reporté de {wait} s.", wait)
+
+    failed = sum(1 for sent in send_messages(messages) if not sent)
+    if failed:
+        error = f"Erreur : {failed}/{len(messages)} notification(s) non envoyée(s)."
+        if failed == len(messages):
+            return SendError(error)
+        # not retried, not to send the other notifications twice
+        logger.warning(f"{notification_type} notification: {error}")
+
     return None
 
 
+def run_queued_action(action):
+    """
+    Executes a queued action (see queue_notification and export.request_export).
+    Returns an error string, or None if the action succeeded.
+    """
+    if action.action_type == "comment_digest":
+        return run_comment_digest(action)
+
+    if action.action_type == "export_projects":
+        return run_export_job(action)
+
+    if action.action_type != "send_notification":
+        return f"Unknown action type ({action.action_type})."
+
+    parameters = action.parameters
+    user = db.session.get(User, action.uid) if action.uid else None
+    author = user.p if user else None
+
+    # server error notification (see errors.internal_error)
+    if parameters["notification_type"] == "admin":
+        return send_notification(
+            "admin",
+            project=None,
+            text=parameters["text"],
+            user_email=parameters.get("user"),
+            url=parameters.get("url"),
+        )
+
+    # new comment notification (Standard or Rejected)
+    if parameters["notification_type"] in ["comment", "rejected_comment"]:
+        project = Project.query.filter(Project.id == int(parameters["project_id"])).first()
+        if not project:
+            return "Project not found."
+        comment = ProjectComment.query.filter(
+            ProjectComment.id == int(parameters["comment_id"])
+        ).first()
+        if not comment:
+            return "Comment not found."
+        recipients = action.options["recipients"]
+        return send_notification(
+            parameters["notification_type"], project, recipients, comment.message, author=author
+        )
+
+    # new status notification
+    elif parameters["notification_type"] in [
+        "ready-1",
+        "validated-1",
+        "ready",
+        "validated",
+        "validated-10",
+        "rejected",
+    ]:
+        project = Project.query.filter(Project.id == int(parameters["project_id"])).first()
+        if not project:
+            return "Project not found."
+        return send_notification(parameters["notification_type"], project, author=author)
+
+    return "Unknown notification."
+
+
+def run_comment_digest(action):
+    """Sends the comments grouped in a comment_digest action (see queue_comment_digest)."""
+    parameters = action.parameters
+    project = Project.query.filter(Project.id == int(parameters["project_id"])).first()
+    if not project:
+        return "Project not found."
+    comments = (
+        ProjectComment.query.filter(ProjectComment.id.in_(parameters["comment_ids"]))
+        .order_by(ProjectComment.posted_at)
+        .all()
+    )
+    if not comments:
+        return "Comment not found."
+    recipients = action.options["recipients"]
+
+    # a single comment: usual notification, with its author
+    if len(comments) == 1:
+        comment = comments[0]
+        author = comment.user.p if comment.user else None
+        return send_notification("comment", project, recipients, comment.message, author=author)
+
+    return send_notification("comment_digest", project, recipients, comments=comments)
+
+
 def queue_notification(user_id, action_type, parameters, options=None):
     """
     Queues a notification action in the database.
-    Returns a warning string if the GMail API is disconnected, else None.
+    Returns a warning string if no mail transport is configured, else None.
     """
-    if not gmail_service_api:
+    if not mail_enabled():
         return "API GMail non connectée : aucune notification envoyée par e-mail."
 
     async_action = QueuedAction(
@@ -502,8 +680,89 @@ def queue_status_notification(project, user_id):
     )
 
 
+def queue_comment_digest(project_id, comment_id, recipient):
+    """
+    Adds a new comment to the pending digest of (recipient, project), or queues a new
+    digest sent after COMMENT_DIGEST_WINDOW seconds.
+    Returns a warning string if no mail transport is configured, else None.
+    """
+    if not mail_enabled():
+        return "API GMail non connectée : aucune notification envoyée par e-mail."
+
+    # at most one pending digest per (project, recipient): unique key, cleared when claimed
+    dedup_key = f"comment_digest:{project_id}:{recipient}"
+
+    for _ in range(5):
+        # locked until commit: concurrent comments are added one after the other
+        digest = db.session.execute(
+            select(QueuedAction)
+            .where(QueuedAction.dedup_key == dedup_key, QueuedAction.status == "pending")
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        ).scalar_one_or_none()
+
+        if digest:
+            # conditional update: the digest may have been claimed by the worker in the meantime
+            result = db.session.execute(
+                update(QueuedAction)
+                .where(QueuedAction.id == digest.id, QueuedAction.status == "pending")
+                .values(
+                    parameters={
+                        **digest.parameters,
+                        "comment_ids": digest.parameters["comment_ids"] + [comment_id],
+                    }
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                return None
+            continue
+
+        now = get_datetime()
+        try:
+            # savepoint: only the digest is rolled back if another request queued it first
+            with db.session.begin_nested():
+                db.session.add(
+                    QueuedAction(
+                        uid=None,
+                        timestamp=now,
+                        status="pending",
+                        action_type="comment_digest",
+                        parameters={"project_id": project_id, "comment_ids": [comment_id]},
+                        options={"recipients": [recipient]},
+                        available_at=now
+                        + timedelta(seconds=current_app.config["COMMENT_DIGEST_WINDOW"]),
+                        dedup_key=dedup_key,
+                    )
+                )
+            return None
+        except IntegrityError:
+            # queued by another request: add the comment to it
+            continue
+
+    return "Attention : le commentaire n'a pas pu être ajouté au résumé des commentaires."
+
+
 def queue_comment_notification(project_id, comment_id, user_id, recipients, is_rejection=False):
-    """Shortcut for queuing new comment notifications"""
+    """
+    Shortcut for queuing new comment notifications.
+    Recipients with the comment_digest preference get their (non rejection) comments grouped.
+    """
+    if not is_rejection:
+        personnels = get_cached_personnel()
+        digest_recipients = [
+            p.id
+            for p in personnels
+            if p.id in recipients and p.user and p.user.preferences.get("comment_digest")
+        ]
+        warning = None
+        for recipient in digest_recipients:
+            warning = queue_comment_digest(project_id, comment_id, recipient)
+
+        recipients = [pid for pid in recipients if pid not in digest_recipients]
+        if not recipients:
+            return warning
+
     if is_rejection:
         parameters = {
             "notification_type": "rejected_comment",
@@ -556,19 +815,17 @@ def process_add_comment(project, user, message, recipients, is_rejection=False):
     # Handle recipients and e-mail notifications
     if recipients and isinstance(recipients, list):
         personnels = get_cached_personnel()
-        recipient_personnels = [
-            p for p in personnels if p.id in recipients and p.role != "inactive"
+        recipient_uids = [
+            p.user.id for p in personnels if p.id in recipients and p.role != "inactive" and p.user
         ]
 
-        for personnel in recipient_personnels:
-            if personnel.user:
-                u = personnel.user
-
-                # Safely update the JSON column by creating a new list
-                # This guarantees SQLAlchemy detects the change and saves it
-                current_messages = u.new_messages or []
-                if project.id not in current_messages:
-                    u.new_messages = current_messages + [project.id]
+        # cached personnels are read-only snapshots: update the User records
+        for u in User.query.filter(User.id.in_(recipient_uids)).all():
+            # Safely update the JSON column by creating a new list
+            # This guarantees SQLAlchemy detects the change and saves it
+            current_messages = u.new_messages or []
+            if project.id not in current_messages:
+                u.new_messages = current_messages + [project.id]
 
         db.session.flush()
 
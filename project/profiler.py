@@ -1,5 +1,9 @@
+import re
+import subprocess
+import sys
 import time
 
+import click
 from flask import g, request
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
@@ -58,3 +62,67 @@ def setup_query_profiler(app):
                     print(f"    - {dur:.4f}s | {stmt}...", flush=True)
             print("=" * 80 + "\n", flush=True)
         return response
+
+
+# worker boot, then first use of the lazily loaded libraries (data, budget, download, PDF)
+IMPORT_REPORT_CODE = """
+import resource, sys, time
+t = time.perf_counter()
+from project import create_app
+create_app()
+boot = time.perf_counter() - t
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+lazy = [m for m in ("pandas", "numpy", "plotly", "matplotlib") if m in sys.modules]
+print(f"boot {boot:.3f} {rss} {','.join(lazy) or '-'}")
+t = time.perf_counter()
+import pandas, plotly.express, matplotlib.pyplot
+print(f"lazy {time.perf_counter() - t:.3f} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}")
+"""
+
+
+def setup_import_report(app):
+    """Registers the "flask import-report" command: import timings of a worker boot."""
+
+    @app.cli.command("import-report")
+    @click.option("--top", default=25, help="Number of modules to list.")
+    def import_report(top):
+        """Reports module import timings and memory of a worker boot."""
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", IMPORT_REPORT_CODE],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+
+        # "import time: self [us] | cumulative | imported package" lines
+        timings = []
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+            if match:
+                self_us, cumulative_us, indent, module = match.groups()
+                timings.append((int(cumulative_us), int(self_us), len(indent) // 2, module))
+
+        if result.returncode:
+            click.echo(result.stderr[-2000:], err=True)
+            raise SystemExit(result.returncode)
+
+        click.echo(f"{'cumulative':>12} {'self':>10}  module")
+        for cumulative_us, self_us, _, module in sorted(timings, reverse=True)[:top]:
+            click.echo(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {module}")
+
+        total_us = sum(cumulative_us for cumulative_us, _, level, _ in timings if level == 0)
+        click.echo(
+            f"\nTotal import time (boot and first use): {total_us / 1000:.1f}ms ({len(timings)} modules)"
+        )
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if fields[0] == "boot":
+                click.echo(
+                    f"Worker boot (create_app): {float(fields[1]):.3f}s,"
+                    f" max RSS {int(fields[2]) / 1024:.0f} MB, heavy modules loaded: {fields[3]}"
+                )
+            elif fields[0] == "lazy":
+                click.echo(
+                    f"First use of pandas/plotly/matplotlib: +{float(fields[1]):.3f}s,"
+                    f" max RSS {int(fields[2]) / 1024:.0f} MB"
+                )
@@ -960,6 +960,13 @@ class DownloadForm(FlaskForm):
     sy = SelectField("Année scolaire", choices=[], validators=[Optional()])
     fy = SelectField("Année fiscale", choices=[], validators=[Optional()])
 
+    file_format = RadioField(
+        "Format",
+        choices=[("xlsx", "Excel"), ("csv", "CSV")],
+        default="xlsx",
+        validators=[InputRequired(message="Sélectionner un format")],
+    )
+
     submit = SubmitField("Télécharger")
 
 
@@ -1011,6 +1018,23 @@ class MarkReadForm(FlaskForm):
     submit = SubmitField("Tout marquer comme lu")
 
 
+class ReplayDeadActionsForm(FlaskForm):
+    class Meta:
+        csrf = True
+        locales = ("fr_FR", "fr")
+
+    submit = SubmitField("Relancer les envois en échec")
+
+
+class CommentDigestForm(FlaskForm):
+    class Meta:
+        csrf = True
+        locales = ("fr_FR", "fr")
+
+    comment_digest = BooleanField("Regrouper les notifications de nouveaux commentaires")
+    submit = SubmitField("Enregistrer")
+
+
 class PersonnelBaseForm(FlaskForm):
     """Base form containing common personnel fields and validations."""
 
@@ -6,31 +6,37 @@ from collections import Counter
 from datetime import datetime, timedelta
 from http import HTTPStatus
 
-import pandas as pd
 from dateutil.relativedelta import relativedelta
 from flask import (
     Blueprint,
     Response,
     abort,
-    current_app,
     flash,
-    g,
-    has_app_context,
+    get_flashed_messages,
     jsonify,
     redirect,
     render_template,
     request,
     send_file,
     session,
+    stream_template,
     url_for,
 )
 from flask_login import current_user, login_required
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload, selectinload
 
+from ..budget import get_budget_school_years, get_fiscal_year_budget, get_school_year_budget
 from ..decorators import require_unlocked_db
+from ..export import (
+    export_filepath,
+    export_format_choices,
+    export_job_status,
+    request_export,
+)
+from ..mail_quota import get_mail_usage
 from ..models import (
-    Dashboard,
+    ExportJob,
     Personnel,
     Project,
     ProjectComment,
@@ -46,6 +52,7 @@ from ..project import (
     DownloadForm,
     LockForm,
     RemovePersonnelForm,
+    ReplayDeadActionsForm,
     SelectYearsForm,
     UpdatePersonnelForm,
     choices,
@@ -53,6 +60,7 @@ from ..project import (
     levels,
 )
 from ..utils import (
+    KeysetPagination,
     auto_dashboard,
     auto_school_year,
     division_name,
@@ -60,12 +68,17 @@ from ..utils import (
     get_datetime,
     get_default_sy_dates,
     get_divisions,
+    get_lock_state,
     get_member_choices,
-    get_projects_df,
+    get_school_years,
     get_years_choices,
+    invalidate_dashboard_cache,
+    invalidate_personnel_cache,
     invalidate_school_years_cache,
+    iter_keyset,
     query_projects,
 )
+from ..worker import MAX_ATTEMPTS, get_dead_actions, get_queue_stats, replay_dead_actions
 
 logger = logging.getLogger(__name__)
 
@@ -74,12 +87,39 @@ PROVISEUR = os.getenv("PROVISEUR")
 DIRECTEUR = os.getenv("DIRECTEUR")
 
 
-def invalidate_personnel_cache():
-    if has_app_context() and "personnel_cache" in g:
-        del g.personnel_cache
+admin_bp = Blueprint("admin", __name__)
+
 
+# status columns of the dashboard table ("validated-10" counted as "validated-1")
+DASHBOARD_STATUSES = ["draft", "ready-1", "validated-1", "ready", "validated", "rejected"]
 
-admin_bp = Blueprint("admin", __name__)
+
+def get_status_counts():
+    """
+    Number of projects by school year (most recent first) and status, with the totals:
+    {"columns": statuses and "Total", "rows": [(school year or "Total", {column: count})]}
+    """
+    results = (
+        db.session.query(Project.school_year, Project.status, func.count(Project.id))
+        .group_by(Project.school_year, Project.status)
+        .all()
+    )
+
+    columns = DASHBOARD_STATUSES + ["Total"]
+    rows = {}
+    totals = dict.fromkeys(columns, 0)
+    for school_year, status, count in results:
+        status = "validated-1" if status == "validated-10" else status
+        row = rows.setdefault(school_year, dict.fromkeys(columns, 0))
+        for counts in (row, totals):
+            if status in counts:
+                counts[status] += count
+            counts["Total"] += count
+
+    return {
+        "columns": columns,
+        "rows": sorted(rows.items(), reverse=True) + [("Total", totals)],
+    }
 
 
 @admin_bp.route("/dashboard", methods=["GET", "POST"])
@@ -118,6 +158,7 @@ def dashboard():
                 dash.lock_message = "<strong>La base des projets est fermée</strong> : la création et la modification des projets n'est plus possible. <br>La consultation des projets, la messagerie et les autres fonctionnalités sont disponibles."
             dash.lock = lock
             db.session.commit()
+            invalidate_dashboard_cache()
             if lock:
                 logger.info(f"Database locked by {current_user.p.email}")
             else:
@@ -131,40 +172,8 @@ def dashboard():
     # database status form data set to the opposite value to serve as a toogle button
     form.lock.data = "Fermé" if not lock else "Ouvert"
 
-    # get Project data grouped by school_year and status
-    results = (
-        db.session.query(Project.school_year, Project.status, func.count(Project.id).label("count"))
-        .group_by(Project.school_year, Project.status)
-        .order_by(Project.school_year.desc())
-        .all()
-    )
-
-    # Transform results for easy template rendering
-    df = pd.DataFrame(results, columns=["school_year", "status", "count"])
-    df["status"] = df["status"].replace({"validated-10": "validated-1"})
-
-    # Pivot the data
-    # index = rows, columns = status headers, values = the counts
-    df = df.pivot_table(
-        index="school_year",
-        columns="status",
-        values="count",
-        fill_value=0,
-        aggfunc="sum",
-        margins=True,  # automatically adds 'All' row and column totals
-        margins_name="Total",
-    )
-    # adjust school years in descending order, keep Total as last row
-    df = pd.concat([df.drop(index=df.index[-1]).sort_index(ascending=False), df.iloc[[-1]]])
-
-    # complete with eventually missing columns
-    statuses = ["draft", "ready-1", "validated-1", "ready", "validated", "rejected"]
-    for status in statuses:
-        if status not in df.columns:
-            df[status] = 0
-
-    # adjust status columns order
-    df = df[statuses + ["Total"]]
+    # number of projects by school year and status
+    status_counts = get_status_counts()
 
     # Personnel statistics
     role_counts = Counter(p.role for p in get_cached_personnel())
@@ -178,6 +187,7 @@ def dashboard():
     # form for downloading the project database
     form2 = DownloadForm()
     form2.sy.choices, form2.fy.choices = get_years_choices(fy=True)
+    form2.file_format.choices = export_format_choices()
     form2.sy.data = school_year.sy
     form2.fy.data = str(datetime.now().year)
 
@@ -198,14 +208,22 @@ def dashboard():
                 division_data[section][division_name(level)] = count
     division_data["Total"] = f"{len(divisions)} divisions"
 
+    # notifications queue (see worker.py)
+    form4 = ReplayDeadActionsForm()
+
     return render_template(
         "dashboard.html",
         form=form,
         form2=form2,
         form3=form3,
+        form4=form4,
+        queue_stats=get_queue_stats(),
+        mail_usage=get_mail_usage(),
+        dead_actions=get_dead_actions(),
+        max_attempts=MAX_ATTEMPTS,
         n_projects=n_projects,
         lock=lock,
-        df=df,
+        status_counts=status_counts,
         sy_start=school_year.sy_start,
         sy_end=school_year.sy_end,
         sy=school_year.sy,
@@ -214,6 +232,22 @@ def dashboard():
     )
 
 
+@admin_bp.route("/dashboard/queue/replay", methods=["POST"])
+@login_required
+def replay_queue():
+    if current_user.p.role not in ["gestion", "direction", "admin"]:
+        return redirect(url_for("core.index"))
+
+    form = ReplayDeadActionsForm()
+
+    if form.validate_on_submit():
+        n = replay_dead_actions()
+        logger.info(f"{n} dead queued action(s) replayed by {current_user.p.email}")
+        flash(f"{n} notification(s) remise(s) en file d'attente.", "info")
+
+    return redirect(url_for("admin.dashboard"))
+
+
 @admin_bp.route("/budget", methods=["GET", "POST"])
 @login_required
 def budget():
@@ -227,12 +261,14 @@ def budget():
     sy_current = school_year.sy
     sy_next = f"{school_year.sy_start.year + 1} - {school_year.sy_end.year + 1}"
 
+    # school years of the budget tables (tables cached until the projects data changes)
+    school_years = get_budget_school_years()
+
     ### school year tab ###
     form = SelectYearsForm()
 
     # set school year choices
-    df = get_projects_df(data="budget")
-    form.years.choices = sorted([(s, s) for s in set(df["school_year"])], reverse=True)
+    form.years.choices = [(s, s) for s in school_years]
     if not form.years.choices:
         form.years.choices = [(sy_current, sy_current)]
 
@@ -250,29 +286,18 @@ def budget():
     # set form default data
     form.years.data = sy
 
-    ## filter DataFrame
-    if sy == "recurring":
-        dfs = df[(df["school_year"] == sy_current) & (df["is_recurring"] == "Oui")]
-    else:
-        dfs = df[df["school_year"] == sy]
-
-    # recurring school year
+    ## school year budget
     if sy == "recurring":
         sy = sy_current
+        dfs = get_school_year_budget(sy, recurring=True)
+    else:
+        dfs = get_school_year_budget(sy)
 
     ### fiscal year tab ###
     form2 = SelectYearsForm()
 
     # set dynamic fiscal years choices
-    form2.years.choices = sorted(
-        [
-            y
-            for y in set(
-                df["school_year"].str.split(" - ", expand=True).drop_duplicates().values.flatten()
-            )
-        ],
-        reverse=True,
-    )
+    form2.years.choices = sorted({y for s in school_years for y in s.split(" - ")}, reverse=True)
     if not form2.years.choices:
         form2.years.choices = [str(school_year.sy_end.year), str(school_year.sy_start.year)]
 
@@ -291,20 +316,8 @@ def budget():
     # set form default data
     form2.years.data = fy
 
-    ## filter DataFrame
-    df1 = (
-        df[df["school_year"].str.startswith(fy)]
-        .drop(columns=[*choices["budget"]] + [b + "_2" for b in choices["budget"]])
-        .rename(columns=lambda x: x.replace("_1", ""))
-    )
-
-    df2 = (
-        df[df["school_year"].str.endswith(fy)]
-        .drop(columns=[*choices["budget"]] + [b + "_1" for b in choices["budget"]])
-        .rename(columns=lambda x: x.replace("_2", ""))
-    )
-
-    dff = pd.concat([df1, df2], axis=0)
+    ## fiscal year budget: first and second year budgets of the school years of fy
+    dff = get_fiscal_year_budget(fy)
 
     return render_template(
         "budget.html",
@@ -334,15 +347,17 @@ def dashboard_personnels():
     # Role ordering map
     role_priority = {"direction": 1, "gestion": 2, "admin": 3, "user": 4, "inactive": 5}
 
-    # Attach flag & sort personnels
-    for p in personnels:
-        p.has_projects = bool(p.user and p.user.id in uids_with_projects)
-
+    # Sort personnels (cached snapshots are read-only: the projects flag is computed in the template)
     personnels = sorted(
         personnels, key=lambda p: (role_priority.get(p.role, 99), (p.name or "").lower())
     )
 
-    return render_template("personnels.html", personnels=personnels, choices=choices)
+    return render_template(
+        "personnels.html",
+        personnels=personnels,
+        uids_with_projects=uids_with_projects,
+        choices=choices,
+    )
 
 
 @admin_bp.route("/personnel/add", methods=["GET", "POST"])
@@ -621,8 +636,8 @@ def manage_school_year():
                     divisions += [level + chr(65 + (i % 26)) for i in range(n)]
 
         # update the database with the divisions
-        if school_year.divisions != divisions:
-            school_year.divisions = divisions
+        if list(school_year.divisions) != divisions:
+            db.session.get(SchoolYear, school_year.id).divisions = divisions
             updated = True
 
         if updated:
@@ -644,7 +659,7 @@ def manage_school_year():
     form.sy_auto.data = sy_auto
 
     sy_previous = f"{sy_start.year - 1} - {sy_end.year - 1}"
-    previous_school_year = SchoolYear.query.filter(SchoolYear.sy == sy_previous).first()
+    previous_school_year = get_school_years().get(sy_previous)
     if previous_school_year:
         form.sy_start.render_kw = {
             "min": previous_school_year.sy_end + timedelta(1),
@@ -675,26 +690,48 @@ def download_data():
 
     form = DownloadForm()
     form.sy.choices, form.fy.choices = get_years_choices(fy=True)
+    form.file_format.choices = export_format_choices()
 
     if form.validate_on_submit():
         years = form.sy.data if form.selection_mode.data == "sy" else form.fy.data
         years = None if years == "Toutes les années" else years
-        df = get_projects_df(current_user, years=years, data="Excel", order="asc")
-        if not df.empty:
-            date = get_datetime().strftime("%Y-%m-%d-%Hh%M%S")
-            filename = f"Projets_LFS-{date}.xlsx"
-            data_path = current_app.config["DATA_PATH"]
-            filepath = data_path / filename
-            df.to_excel(
-                filepath,
-                sheet_name="Projets pédagogiques LFS",
-                columns=df.columns,
-            )
-            return send_file(filepath, as_attachment=True)
+        if query_projects(current_user, years=years).order_by(None).first():
+            # the file is written by the worker, the dashboard polls the job
+            job = request_export(current_user, years, form.file_format.data)
+            db.session.commit()
+            return jsonify(export_job_status(job))
 
     return Response(status=HTTPStatus.NO_CONTENT)
 
 
+def get_export_job_or_404(job_id):
+    if current_user.p.role not in ["gestion", "direction", "admin"]:
+        abort(HTTPStatus.NOT_FOUND)
+    job = db.session.get(ExportJob, job_id)
+    if not job or job.uid != current_user.id:
+        abort(HTTPStatus.NOT_FOUND)
+    return job
+
+
+@admin_bp.route("/download/<int:job_id>", methods=["GET"])
+@login_required
+def download_status(job_id):
+    status = export_job_status(get_export_job_or_404(job_id))
+    # stalled job marked failed
+    db.session.commit()
+    return jsonify(status)
+
+
+@admin_bp.route("/download/<int:job_id>/file", methods=["GET"])
+@login_required
+def download_file(job_id):
+    job = get_export_job_or_404(job_id)
+    filepath = export_filepath(job)
+    if job.status != "done" or not filepath.exists():
+        abort(HTTPStatus.NOT_FOUND)
+    return send_file(filepath, as_attachment=True, download_name=job.filename)
+
+
 @admin_bp.route("/manage_budgets", methods=["GET", "POST"])
 @login_required
 def manage_budgets():
@@ -744,7 +781,6 @@ def manage_budgets():
     )
 
     # --- Pagination ---
-    page = request.args.get("page", 1, type=int)
     per_page_request = request.args.get("per_page")
 
     if per_page_request:
@@ -759,19 +795,18 @@ def manage_budgets():
     per_page = session.get("budget-per_page", 20)
 
     if per_page == "all":
-        base_count = query.count()
-        actual_per_page = max(1, base_count)
+        # rendered while the projects are loaded, 100 at a time
+        pagination = None
+        projects = iter_keyset(query)
     else:
-        actual_per_page = per_page
-
-    pagination = query.paginate(page=page, per_page=actual_per_page, error_out=False)
-
-    if (page > pagination.pages and pagination.pages > 0) or page < 1:
-        flash("La page demandée n'existe pas.", "danger")
-        return redirect(url_for(".manage_budgets", page=1))
-
-    # Extract the items for the current page
-    projects = pagination.items
+        # keyset pagination cursors
+        pagination = KeysetPagination(
+            query,
+            per_page,
+            after=request.args.get("after", type=int),
+            before=request.args.get("before", type=int),
+        )
+        projects = pagination.items
 
     # ------
     # Pull existing distinct budget strings for the auto-complete <datalist>
@@ -783,7 +818,11 @@ def manage_budgets():
     )
     existing_budget_ids = [b[0] for b in distinct_budgets]
 
-    return render_template(
+    # rows are streamed: flashed messages are read before the response starts
+    render = stream_template if pagination is None else render_template
+    get_flashed_messages(with_categories=True)
+
+    return render(
         "manage_budgets.html",
         projects=projects,
         pagination=pagination,
@@ -797,8 +836,7 @@ def manage_budgets():
 @admin_bp.route("/api/project/<int:project_id>/update-budget", methods=["POST"])
 @login_required
 def update_budget_id(project_id):
-    dash = Dashboard.query.first()
-    if dash and dash.lock >= 2:
+    if get_lock_state().lock >= 2:
         return jsonify({"status": "error", "message": "La base est fermée."}), HTTPStatus.FORBIDDEN
 
     if current_user.p.role not in ["gestion", "direction"]:
@@ -14,9 +14,9 @@ from flask_login import login_required, current_user
 from ..models import db, Personnel, User
 from ..decorators import require_unlocked_db
 
-from ..project import MarkReadForm, NotificationPreferencesForm
+from ..project import CommentDigestForm, MarkReadForm, NotificationPreferencesForm
 
-from ..utils import get_cached_personnel, get_new_messages
+from ..utils import get_cached_personnel, get_new_messages, invalidate_personnel_cache
 
 core_bp = Blueprint("core", __name__)
 
@@ -31,6 +31,9 @@ def index():
 def profile():
     form = MarkReadForm()
 
+    digest_form = CommentDigestForm()
+    digest_form.comment_digest.data = (current_user.preferences or {}).get("comment_digest", False)
+
     new_messages = get_new_messages(current_user)
 
     # Fetch team members excluding current_user
@@ -52,6 +55,7 @@ def profile():
     return render_template(
         "profile.html",
         form=form,
+        digest_form=digest_form,
         new_messages=new_messages,
         formt=NotificationPreferencesForm(),  # To pull labels & descriptions
         other_team_members=other_team_members,
@@ -78,6 +82,35 @@ def profile_post():
     return redirect(url_for("core.profile"))
 
 
+@core_bp.route("/profile/digest", methods=["POST"])
+@login_required
+@require_unlocked_db(level=2)
+def comment_digest():
+    form = CommentDigestForm()
+
+    if form.validate_on_submit():
+        # new dict: SQLAlchemy does not track in-place changes of JSON columns
+        current_user.preferences = {
+            **(current_user.preferences or {}),
+            "comment_digest": form.comment_digest.data,
+        }
+        db.session.commit()
+        invalidate_personnel_cache()
+
+        if form.comment_digest.data:
+            flash(
+                "Les notifications de nouveaux commentaires seront <strong>regroupées</strong>.",
+                "info",
+            )
+        else:
+            flash(
+                "Les notifications de nouveaux commentaires seront envoyées <strong>immédiatement</strong>.",
+                "info",
+            )
+
+    return redirect(url_for("core.profile"))
+
+
 @core_bp.route("/profile/notifications", methods=["GET", "POST"])
 @login_required
 def notification_preferences():
@@ -158,8 +191,10 @@ def notification_preferences():
                 return render_template("preferences.html", form=form)
 
         # If it passes the gauntlet, commit to DB
-        current_user.preferences = proposed_prefs
+        # keep the other preferences (comment_digest)
+        current_user.preferences = {**(current_user.preferences or {}), **proposed_prefs}
         db.session.commit()
+        invalidate_personnel_cache()
 
         flash("Vos préférences de notification\n ont été mises à jour avec succès.", "info")
         return redirect(url_for("core.profile"))
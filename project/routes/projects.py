@@ -8,26 +8,25 @@ from flask import (
     Blueprint,
     current_app,
     flash,
+    get_flashed_messages,
     jsonify,
     redirect,
     render_template,
     request,
     send_file,
     session,
+    stream_template,
     url_for,
 )
 from flask_login import current_user, login_required
-from sqlalchemy import or_
-from sqlalchemy.orm import aliased, joinedload, selectinload
+from sqlalchemy.orm import joinedload, selectinload
 
-from ..data import data_analysis
+from ..counters import get_pending_validations
 from ..decorators import require_unlocked_db
 from ..errors import get_project_or_redirect
 from ..models import (
-    Dashboard,
     Personnel,
     Project,
-    ProjectComment,
     ProjectHistory,
     ProjectMember,
     QueuedAction,
@@ -35,7 +34,7 @@ from ..models import (
     User,
     db,
 )
-from ..notifications import process_add_comment, queue_status_notification, send_notification
+from ..notifications import process_add_comment, queue_status_notification
 from ..project import (
     ActionForm,
     CommentForm,
@@ -48,7 +47,8 @@ from ..project import (
     valid_division,
 )
 from ..utils import (
-    auto_dashboard,
+    KeysetPagination,
+    OffsetPagination,
     auto_school_year,
     division_name,
     get_axis,
@@ -57,12 +57,15 @@ from ..utils import (
     get_datetime,
     get_division_sections,
     get_divisions_choices,
+    get_lock_state,
     get_member_choices,
     get_name,
     get_school_year_choices,
     get_school_years,
     get_status_choices,
     get_years_choices,
+    invalidate_school_years_cache,
+    iter_keyset,
     query_projects,
     students_to_csv,
 )
@@ -70,12 +73,14 @@ from ..utils import (
 logger = logging.getLogger(__name__)
 
 
-try:
-    from ..pdf_generator import generate_fieldtrip_pdf, prepare_field_trip_data
+def load_pdf_generator():
+    """Imports the PDF generator (matplotlib) on first use, returns None if it is not available."""
+    try:
+        from .. import pdf_generator
+    except ImportError:
+        return None
+    return pdf_generator
 
-    matplotlib_module = True
-except ImportError:
-    matplotlib_module = False
 
 projects_bp = Blueprint("projects", __name__)
 
@@ -86,7 +91,7 @@ projects_file = "projets"
 fieldtrip_pdf = "formulaire_sortie-<id>.pdf"
 
 
-# asynchronous actions
+# asynchronous actions (executed by the notifications worker)
 @projects_bp.route("/action/<int:action_id>", methods=["GET"])
 @login_required
 def async_action(action_id):
@@ -94,82 +99,22 @@ def async_action(action_id):
         QueuedAction.uid == current_user.id, QueuedAction.id == action_id
     ).first()
 
-    if action:
-        if action.action_type == "send_notification" and action.status == "pending":
-            parameters = action.parameters
-
-            # new comment notification (Standard or Rejected)
-            if parameters["notification_type"] in ["comment", "rejected_comment"]:
-                project = Project.query.filter(Project.id == int(parameters["project_id"])).first()
-                if project:
-                    comment = ProjectComment.query.filter(
-                        ProjectComment.id == int(parameters["comment_id"])
-                    ).first()
-                    if comment:
-                        recipients = action.options["recipients"]
-                        error = send_notification(
-                            parameters["notification_type"], project, recipients, comment.message
-                        )
-                    else:
-                        error = "Comment not found."
-                else:
-                    error = "Project not found."
-                if error:
-                    logger.warning(
-                        f"Error trying to send new comment notification (project id={parameters['project_id']} comment id={parameters['comment_id']}: {error}"
-                    )
-
-            # new status notification
-            elif parameters["notification_type"] in [
-                "ready-1",
-                "validated-1",
-                "ready",
-                "validated",
-                "validated-10",
-                "rejected",
-            ]:
-                project = Project.query.filter(Project.id == int(parameters["project_id"])).first()
-                if project:
-                    error = send_notification(parameters["notification_type"], project)
-                else:
-                    error = "Project not found."
-                    logger.warning(
-                        f"Error trying to send notification (project id={parameters['project_id']} status={parameters['notification_type']}: {error}"
-                    )
-            else:
-                error = "Unknown notification."
-
-            # update action
-            if error:
-                action.status = "failed"
-            else:
-                QueuedAction.query.filter(QueuedAction.id == action.id).delete()
-
-            # update database
-            db.session.commit()
-
-            if error:
-                return jsonify({"html": "Failed!"})
-            else:
-                return jsonify({"html": "Done!"})
-
-        else:
-            logger.error(
-                f"Error Action id={action.id} type={action.action_type} status={action.status}."
-            )
-            return jsonify({"html": "No pending action or known action type."})
+    # queued actions are deleted once executed
+    if not action:
+        return jsonify({"html": "Done!"})
+    elif action.status == "dead":
+        return jsonify({"html": "Failed!"})
     else:
-        logger.error(f"Error: action id={action_id} not fownd.")
-        return jsonify({"html": "No action found."})
+        return jsonify({"html": "Pending"})
 
 
 @projects_bp.route("/projects", methods=["GET", "POST"])
 @login_required
 def list_projects():
     # get database status
-    dash = auto_dashboard()
-    lock = dash.lock
-    lock_message = dash.lock_message
+    lock_state = get_lock_state()
+    lock = lock_state.lock
+    lock_message = lock_state.lock_message
 
     # get school year
     school_year = auto_school_year()
@@ -208,13 +153,7 @@ def list_projects():
     # Build Project query
     query = query_projects(current_user, filter=session["filter"], years=session["sy"])
 
-    # Get the base count before applying any search query
-    base_count = query.count()
-
     # --- Pagination ---
-    # Get the current page (defaults to 1)
-    page = request.args.get("page", 1, type=int)
-
     # Check if the user just selected a new pagination length
     per_page_request = request.args.get("per_page")
 
@@ -230,92 +169,15 @@ def list_projects():
     # Retrieve the current preference (defaulting to 10)
     per_page = session.get("per_page", 10)
 
-    # Handle "all" case: use 1 if the query is empty to avoid crashes
-    actual_per_page = max(1, base_count) if per_page == "all" else per_page
-
-    # Set client or server search
-    use_client_search = base_count <= actual_per_page
+    # keyset pagination cursors, or page number of the search results
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int)
+    page = request.args.get("page", 1, type=int)
 
-    # Apply dynamic SQLAlchemy Search
     search_query = request.args.get("q", "").strip()
 
-    if search_query and not use_client_search:
-        # Outer join the relationship tables ONCE so MySQL
-        # searches flat columns instead of running correlated subqueries for every row
-        MemberPersonnel = aliased(Personnel, name="member_personnel")
-
-        CreatorUser = aliased(User, name="creator_user")
-        CreatorPersonnel = aliased(Personnel, name="creator_personnel")
-
-        ValidatorUser = aliased(User, name="validator_user")
-        ValidatorPersonnel = aliased(Personnel, name="validator_personnel")
-
-        # 2. Outer join each relationship path
-        query = (
-            query
-            # Members (Project -> ProjectMember -> Personnel)
-            .outerjoin(ProjectMember, Project.id == ProjectMember.project_id)
-            .outerjoin(MemberPersonnel, ProjectMember.pid == MemberPersonnel.id)
-            # Project Creator / User (Project -> User -> Personnel)
-            .outerjoin(CreatorUser, Project.uid == CreatorUser.id)
-            .outerjoin(CreatorPersonnel, CreatorUser.pid == CreatorPersonnel.id)
-            # Project Validator (Project -> User -> Personnel)
-            .outerjoin(ValidatorUser, Project.validated_by == ValidatorUser.id)
-            .outerjoin(ValidatorPersonnel, ValidatorUser.pid == ValidatorPersonnel.id)
-        )
-
-        search_filters = []
-
-        # Specify only the columns to search through
-        searchable_columns = [
-            Project.school_year,
-            Project.title,
-            Project.objectives,
-            Project.description,
-            Project.axis,
-            Project.priority,
-            Project.paths,
-            Project.skills,
-            Project.mode,
-            Project.divisions,
-            Project.indicators,
-            Project.students,
-            Project.fieldtrip_address,
-            Project.fieldtrip_ext_people,
-            Project.fieldtrip_impact,
-        ]
-
-        searchable_columns += [getattr(Project, f"link_t_{i}") for i in range(1, 5)]
-
-        searchable_columns += [
-            getattr(Project, f"budget_{t}_c_{i}")
-            for i in range(1, 3)
-            for t in ("hse", "exp", "trip", "int")
-        ]
-
-        for column in searchable_columns:
-            search_filters.append(column.ilike(f"%{search_query}%"))
-
-        # --- Search Project Members ---
-        search_filters.append(ProjectMember.department.ilike(f"%{search_query}%"))
-        search_filters.append(MemberPersonnel.name.ilike(f"%{search_query}%"))
-        search_filters.append(MemberPersonnel.firstname.ilike(f"%{search_query}%"))
-
-        # --- Search Project Creator (Project.user) ---
-        search_filters.append(CreatorPersonnel.name.ilike(f"%{search_query}%"))
-        search_filters.append(CreatorPersonnel.firstname.ilike(f"%{search_query}%"))
-
-        # --- Search Project Validator (Project.validator) ---
-        search_filters.append(ValidatorPersonnel.name.ilike(f"%{search_query}%"))
-        search_filters.append(ValidatorPersonnel.firstname.ilike(f"%{search_query}%"))
-
-        # Apply OR filter and use .distinct() so projects with multiple
-        # matching members don't get duplicated in the pagination count
-        if search_filters:
-            query = query.filter(or_(*search_filters)).distinct()
-
-    # Apply eager loading
-    query = query.options(
+    # eager loading of the listed projects
+    load_options = (
         # 1-to-1: joinedload
         joinedload(Project.user).joinedload(User.p),
         joinedload(Project.modifier).joinedload(User.p),
@@ -325,16 +187,37 @@ def list_projects():
         selectinload(Project.comments),
     )
 
-    # Paginate
-    pagination = query.paginate(page=page, per_page=actual_per_page, error_out=False)
-
-    if (page > pagination.pages and pagination.pages > 0) or page < 1:
-        flash("La page demandée n'existe pas.", "danger")
-        # Redirect to page 1, preserving the search query if the user was searching
-        return redirect(url_for(".list_projects", page=1, q=search_query or None))
+    pagination = None
+    if per_page == "all":
+        # all projects rendered (client search) while they are loaded, 100 at a time,
+        # not counted
+        use_client_search = True
+        projects = iter_keyset(query.options(*load_options))
+    elif search_query:
+        # server search (search index): results by relevance, pages by number
+        use_client_search = False
+        query = query_projects(
+            current_user,
+            filter=session["filter"],
+            years=session["sy"],
+            order="rank",
+            search=search_query,
+        )
+        pagination = OffsetPagination(query.options(*load_options), per_page, page=page)
+        projects = pagination.items
+    else:
+        pagination = KeysetPagination(
+            query.options(*load_options), per_page, after=after, before=before
+        )
+        # client search if all the projects fit on the first page
+        use_client_search = not pagination.has_prev and not pagination.has_next
+        projects = pagination.items
 
-    # Extract the items for the current page
-    projects = pagination.items
+    # no COUNT: the number of projects is known when they all fit on the page,
+    # else the first page shows "more than per_page" (see projects.html)
+    total = None
+    if pagination and not pagination.has_prev and not pagination.has_next:
+        total = len(pagination.items)
 
     # ------
 
@@ -347,10 +230,7 @@ def list_projects():
         m = len(user_new_messages)
     else:
         m = 0
-    if current_user.p.role in ["gestion", "direction"]:
-        p = query_projects(current_user, filter="Projets à valider").count()
-    else:
-        p = query_projects(current_user, filter="Mes projets à valider").count()
+    p = get_pending_validations(current_user)
 
     if m or p:
         message = "Vous avez "
@@ -366,15 +246,22 @@ def list_projects():
 
     # queued action
     queued_action = QueuedAction.query.filter(
-        QueuedAction.uid == current_user.id, QueuedAction.status == "pending"
+        QueuedAction.uid == current_user.id,
+        QueuedAction.status.in_(["pending", "processing"]),
     ).first()
     action_id = queued_action.id if queued_action else None
 
-    return render_template(
+    # rows are streamed: flashed messages are read before the response starts
+    render = stream_template if pagination is None else render_template
+    get_flashed_messages(with_categories=True)
+
+    return render(
         "projects.html",
         projects=projects,
         user_new_messages=set(user_new_messages),
         pagination=pagination,
+        total=total,
+        search_query=search_query,
         use_client_search=use_client_search,
         sy_start=school_year.sy_start,
         sy_end=school_year.sy_end,
@@ -400,7 +287,7 @@ def list_projects():
 @require_unlocked_db(level=1)
 def project_form(id=None, req=None):
     # get database status
-    lock = Dashboard.query.first().lock
+    lock = get_lock_state().lock
 
     # get school year
     school_year = auto_school_year()
@@ -497,7 +384,7 @@ def project_form(id=None, req=None):
     form.divisions.choices = get_divisions_choices(school_year.sy)
 
     # form UX: dictionary of divisions by section
-    choices["division_sections"] = get_division_sections(form)
+    choices["division_sections"] = get_division_sections(form, school_year.sy)
 
     # form: set status choices and descriptions
     if id:
@@ -522,9 +409,8 @@ def project_form(id=None, req=None):
 @login_required
 @require_unlocked_db(level=1)
 def project_form_post():
-    dash = Dashboard.query.first()
     # get database status
-    lock = dash.lock
+    lock = get_lock_state().lock
 
     # get school year
     school_year = auto_school_year()
@@ -785,12 +671,13 @@ def project_form_post():
         db.session.add(history_entry)
 
         # new project next school year
-        if not id and project.school_year not in get_school_years():
+        new_school_year = not id and project.school_year not in get_school_years()
+        if new_school_year:
             project_school_year = SchoolYear(
                 sy_start=school_year.sy_start.replace(year=school_year.sy_start.year + 1),
                 sy_end=school_year.sy_end.replace(year=school_year.sy_end.year + 1),
                 sy=sy_next,
-                divisions=school_year.divisions,
+                divisions=list(school_year.divisions),
             )
             db.session.add(project_school_year)
 
@@ -803,6 +690,9 @@ def project_form_post():
         # update database
         db.session.commit()
 
+        if new_school_year:
+            invalidate_school_years_cache()
+
         # flash and log information
         if id:
             flash(
@@ -832,7 +722,7 @@ def project_form_post():
     form = get_calendar_constraints(form, school_year.sy_start, school_year.sy_end)
 
     # form UX: dictionary of divisions by section
-    choices["division_sections"] = get_division_sections(form)
+    choices["division_sections"] = get_division_sections(form, school_year.sy)
 
     # form UX: project has budget ?
     has_budget = (
@@ -1018,6 +908,7 @@ def delete_project(id):
         db.session.flush()
 
         project_school_year = SchoolYear.query.filter_by(sy=project_sy).first()
+        school_year_deleted = False
 
         if project_school_year:
             # Delete school year if not the current school year and has no remaining projects
@@ -1026,9 +917,13 @@ def delete_project(id):
 
             if is_not_current and has_no_projects:
                 db.session.delete(project_school_year)
+                school_year_deleted = True
 
         db.session.commit()
 
+        if school_year_deleted:
+            invalidate_school_years_cache()
+
         logger.info(f"Project id={id} ({title}) deleted by {current_user.p.email}")
         flash(f"Le projet <strong>{title}</strong> <br>a été supprimé avec succès.", "info")
 
@@ -1061,7 +956,6 @@ def view_project(id):
             db.session.commit()
 
     # Get school year data
-    dash = Dashboard.query.first()
     school_year = auto_school_year()
 
     # Get e-mail notification recipients
@@ -1086,7 +980,10 @@ def view_project(id):
         form.message.description += "personne (aucun destinataire trouvé)."
 
     # Queued action
-    queued_action = QueuedAction.query.filter_by(uid=current_user.id, status="pending").first()
+    queued_action = QueuedAction.query.filter(
+        QueuedAction.uid == current_user.id,
+        QueuedAction.status.in_(["pending", "processing"]),
+    ).first()
 
     return render_template(
         "project.html",
@@ -1100,7 +997,7 @@ def view_project(id):
         validate_form=ActionForm(),
         devalidate_form=ActionForm(),
         delete_form=ActionForm(),
-        lock=dash.lock if dash else False,
+        lock=get_lock_state().lock,
         action_id=queued_action.id if queued_action else None,
     )
 
@@ -1255,7 +1152,8 @@ def print_fieldtrip_pdf(id):
         flash("Vous n'avez pas les autorisations nécessaires pour accéder à cette page.", "danger")
         return redirect(url_for("projects.list_projects"))
 
-    if not matplotlib_module:
+    pdf_generator = load_pdf_generator()
+    if not pdf_generator:
         flash(
             "Ressources serveur insuffisantes pour générer la fiche de sortie scolaire.",
             "danger",
@@ -1274,10 +1172,10 @@ def print_fieldtrip_pdf(id):
         "admin",
     ] or not os.path.exists(pdf_filepath):
         # prepare data
-        data = prepare_field_trip_data(project)
+        data = pdf_generator.prepare_field_trip_data(project)
         # generate PDF document
         is_prod = current_app.config.get("FLASK_ENV") == "production"
-        generate_fieldtrip_pdf(data, pdf_filepath, is_prod, data_path)
+        pdf_generator.generate_fieldtrip_pdf(data, pdf_filepath, is_prod, data_path)
 
     return send_file(pdf_filepath, as_attachment=False)
 
@@ -1325,7 +1223,9 @@ def data():
             data_html=None,
         )
 
-    # generate data analysis
+    # generate data analysis (pandas and plotly are loaded on first use)
+    from ..data import data_analysis
+
     data_html = data_analysis(session["sy"])
 
     return render_template(
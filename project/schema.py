@@ -0,0 +1,104 @@
+# schema.py
+import logging
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn
+
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+# columns added to the tables of existing databases (db.create_all() creates only the
+# missing tables): {table: [column, ...]}, added with their indexes by upgrade_schema
+UPGRADE_COLUMNS = {
+    "users": ["pending_validations"],
+    "dashboard": ["pending_validations"],
+    "queued_actions": ["attempts", "available_at", "last_error", "dedup_key"],
+    "personnels": ["search_name", "search_firstname"],
+    "projects": ["search_text"],
+}
+
+
+def _add_column_ddl(table, column, dialect):
+    # column definition of the model, with its default value for the existing rows
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"
+    default = column.default
+    if default is not None and default.is_scalar:
+        ddl += f" DEFAULT {default.arg!r}"
+    return ddl
+
+
+def missing_columns(bind=None):
+    """Returns the "table.column" of UPGRADE_COLUMNS missing from the database."""
+    inspector = inspect(bind or db.engine)
+    missing = []
+    for table_name, columns in UPGRADE_COLUMNS.items():
+        if not inspector.has_table(table_name):
+            # created with all its columns by db.create_all()
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        missing += [f"{table_name}.{name}" for name in columns if name not in existing]
+    return missing
+
+
+def upgrade_schema():
+    """
+    Creates the missing tables, then adds the missing columns of UPGRADE_COLUMNS and their
+    indexes. Idempotent: returns the "table.column" added.
+    """
+    bind = db.engine
+    db.create_all()
+
+    added = missing_columns(bind)
+    with bind.begin() as conn:
+        for name in added:
+            table_name, column_name = name.split(".")
+            table = db.metadata.tables[table_name]
+            conn.execute(text(_add_column_ddl(table, table.c[column_name], bind.dialect)))
+            logger.info(f"Column {name} added.")
+
+        for table_name, columns in UPGRADE_COLUMNS.items():
+            table = db.metadata.tables[table_name]
+            existing = {index["name"] for index in inspect(conn).get_indexes(table_name)}
+            for index in table.indexes:
+                if index.name not in existing and any(c.name in columns for c in index.columns):
+                    index.create(conn)
+                    logger.info(f"Index {index.name} created.")
+
+    return added
+
+
+def init_schema(app):
+    """Warns if the database needs an upgrade and registers the "flask upgrade-db" command."""
+    with app.app_context():
+        try:
+            missing = missing_columns()
+            if missing:
+                logger.error(f"Missing columns ({', '.join(missing)}): run flask upgrade-db.")
+        except (OperationalError, ProgrammingError) as error:
+            logger.error(f"Database schema could not be checked: {error}")
+
+    @app.cli.command("upgrade-db")
+    def upgrade_db():
+        """Adds the tables, columns and indexes missing from the database, then fills them."""
+        from .counters import update_pending_validations
+        from .search import create_search_index, rebuild_search_index
+
+        added = upgrade_schema()
+
+        # to-do counters of the new columns
+        if any(name.endswith(".pending_validations") for name in added):
+            update_pending_validations(db.session)
+            db.session.commit()
+
+        # search columns and index of the projects
+        if any(name.split(".")[1].startswith("search_") for name in added):
+            create_search_index()
+            rebuild_search_index()
+
+        if added:
+            click.echo(f"Base de données mise à jour : {', '.join(added)}.")
+        else:
+            click.echo("Base de données à jour.")
@@ -0,0 +1,394 @@
+# search.py
+import logging
+import re
+import time
+import unicodedata
+
+import click
+from sqlalchemy import and_, event, inspect, text, update
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import joinedload, selectinload
+
+from .cache import discard_session_changes, on_session_changes
+from .models import Personnel, Project, ProjectMember, User, db
+
+logger = logging.getLogger(__name__)
+
+# search index table: one search document per project
+SEARCH_TABLE = "project_search"
+
+# Project columns of the search document
+SEARCH_COLUMNS = (
+    [
+        "school_year",
+        "title",
+        "objectives",
+        "description",
+        "axis",
+        "priority",
+        "paths",
+        "skills",
+        "mode",
+        "divisions",
+        "indicators",
+        "students",
+        "fieldtrip_address",
+        "fieldtrip_ext_people",
+        "fieldtrip_impact",
+    ]
+    + [f"link_t_{i}" for i in range(1, 5)]
+    + [f"budget_{t}_c_{i}" for i in range(1, 3) for t in ("hse", "exp", "trip", "int")]
+)
+
+# ligatures not decomposed by NFKD
+LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae"})
+
+
+def normalize_text(value):
+    """Lowercase text without accents ("Élève" -> "eleve"), for accent-insensitive search."""
+    value = unicodedata.normalize("NFKD", str(value).translate(LIGATURES))
+    return "".join(c for c in value if not unicodedata.combining(c)).casefold()
+
+
+def _flatten(value):
+    # JSON columns: lists of strings (paths, divisions...) or of dicts (students)
+    if isinstance(value, dict):
+        return " ".join(_flatten(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(_flatten(v) for v in value)
+    return "" if value is None else str(value)
+
+
+def build_search_document(project):
+    """Normalized text of a project: searchable columns, members, creator and validator."""
+    parts = [_flatten(getattr(project, column)) for column in SEARCH_COLUMNS]
+
+    for member in project.members:
+        parts.append(member.department or "")
+        if member.p:
+            parts += [member.p.search_firstname, member.p.search_name]
+
+    for user in (project.user, project.validator):
+        if user and user.p:
+            parts += [user.p.search_firstname, user.p.search_name]
+
+    return normalize_text(" ".join(part for part in parts if part))
+
+
+def search_terms(query):
+    """Normalized words of a search query."""
+    return re.findall(r"\w+", normalize_text(query))
+
+
+# --- Search index backends (SQLite FTS5, MySQL FULLTEXT) ---
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def _create_statements(dialect):
+    if dialect == "sqlite":
+        # project id stored as rowid; accents are removed by normalize_text and by the tokenizer
+        return [
+            (
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                "USING fts5(body, tokenize='unicode61 remove_diacritics 2')"
+            )
+        ]
+    elif dialect in ("mysql", "mariadb"):
+        return [
+            (
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                "project_id INTEGER PRIMARY KEY, body MEDIUMTEXT NOT NULL, "
+                "FULLTEXT INDEX ix_project_search_body (body)) "
+                "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+            )
+        ]
+    return []
+
+
+def _id_column(dialect):
+    return "rowid" if dialect == "sqlite" else "project_id"
+
+
+# {database url: True if the search index table exists, else time of the last check}
+_index_ready = {}
+
+# delay before checking again for a missing search index (created by flask search-index)
+INDEX_RETRY_DELAY = 60
+
+
+def search_index_ready(bind=None):
+    """True if the search index of the database exists (checked once per process when found)."""
+    bind = bind or db.engine
+    url = str(bind.url)
+    checked = _index_ready.get(url)
+    if checked is True:
+        return True
+    if not _create_statements(_dialect(bind)):
+        return False
+    if checked is not None and time.monotonic() - checked < INDEX_RETRY_DELAY:
+        return False
+
+    try:
+        with bind.connect() as conn:
+            conn.execute(text(f"SELECT 1 FROM {SEARCH_TABLE} LIMIT 1"))
+        _index_ready[url] = True
+    except (OperationalError, ProgrammingError):
+        _index_ready[url] = time.monotonic()
+    return _index_ready[url] is True
+
+
+# {database url: minimum length of the words of the MySQL full-text index}
+_min_token_size = {}
+
+
+def min_token_size(bind=None):
+    """innodb_ft_min_token_size of the MySQL server: shorter words are not indexed."""
+    bind = bind or db.engine
+    url = str(bind.url)
+    if url not in _min_token_size:
+        try:
+            with bind.connect() as conn:
+                _min_token_size[url] = int(
+                    conn.execute(text("SELECT @@innodb_ft_min_token_size")).scalar()
+                )
+        except (OperationalError, ProgrammingError, TypeError, ValueError):
+            # server default
+            _min_token_size[url] = 3
+    return _min_token_size[url]
+
+
+def create_search_index():
+    """Creates the search index table if needed, returns True if it was created."""
+    bind = db.engine
+    statements = _create_statements(_dialect(bind))
+    if not statements:
+        logger.warning(f"No search index for the {_dialect(bind)} database: ILIKE search used.")
+        return False
+
+    existed = search_index_ready(bind)
+    with bind.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    _index_ready[str(bind.url)] = True
+
+    return not existed
+
+
+def _load_projects(session, project_ids):
+    return (
+        session.query(Project)
+        .filter(Project.id.in_(project_ids))
+        .options(
+            joinedload(Project.user).joinedload(User.p),
+            joinedload(Project.validator).joinedload(User.p),
+            selectinload(Project.members).joinedload(ProjectMember.p),
+        )
+        .all()
+    )
+
+
+def index_projects(session, project_ids):
+    """
+    (Re)writes the search documents of the projects: Project.search_text column and
+    search index (deleted projects are removed).
+    """
+    project_ids = set(project_ids)
+    if not project_ids:
+        return
+
+    documents = [
+        {"id": project.id, "search_text": build_search_document(project)}
+        for project in _load_projects(session, project_ids)
+    ]
+    if documents:
+        # bulk UPDATE by primary key, does not mark the projects as modified
+        session.execute(update(Project), documents)
+
+    if not search_index_ready(session.get_bind()):
+        return
+
+    id_column = _id_column(_dialect(session.get_bind()))
+    for project_id in project_ids:
+        session.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE {id_column} = :id"), {"id": project_id}
+        )
+    if documents:
+        session.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} ({id_column}, body) VALUES (:id, :search_text)"),
+            documents,
+        )
+
+
+def rebuild_search_index(batch_size=500):
+    """
+    Backfills the search columns (Personnel names, Project.search_text) and rewrites the
+    search index, returns the number of projects.
+    """
+    for personnel in db.session.scalars(db.select(Personnel)):
+        _set_search_names(personnel)
+    db.session.flush()
+
+    if search_index_ready():
+        db.session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    project_ids = db.session.scalars(db.select(Project.id).order_by(Project.id)).all()
+    for i in range(0, len(project_ids), batch_size):
+        index_projects(db.session, project_ids[i : i + batch_size])
+
+    # the projects are already indexed
+    discard_session_changes(db.session, "search")
+    db.session.commit()
+
+    return len(project_ids)
+
+
+def search_filter(query):
+    """
+    SQL condition selecting the projects matching all the words of query (word prefixes),
+    with the search index, or None if the query has no words.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+
+    dialect = _dialect(db.engine)
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        ids = text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match")
+        return Project.id.in_(ids.bindparams(match=match).columns(id=db.Integer))
+
+    # words shorter than innodb_ft_min_token_size are not in the index and would be ignored
+    size = min_token_size()
+    short_terms = [term for term in terms if len(term) < size]
+    conditions = [Project.search_text.like(f"%{term}%") for term in short_terms]
+    if len(short_terms) < len(terms):
+        match = " ".join(f"+{term}*" for term in terms if len(term) >= size)
+        ids = text(
+            f"SELECT project_id FROM {SEARCH_TABLE} "
+            "WHERE MATCH(body) AGAINST (:match IN BOOLEAN MODE)"
+        )
+        conditions.append(Project.id.in_(ids.bindparams(match=match).columns(id=db.Integer)))
+
+    return and_(*conditions)
+
+
+def search_ranks(query):
+    """
+    Subquery (id, score) of the projects matching query in the search index, the most
+    relevant first when ordered by score, or None if the words of query are not indexed.
+    """
+    terms = search_terms(query)
+    dialect = _dialect(db.engine)
+    if dialect == "sqlite":
+        if not terms:
+            return None
+        match = " ".join(f'"{term}"*' for term in terms)
+        ranks = text(
+            f"SELECT rowid AS id, bm25({SEARCH_TABLE}) AS score FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :rank_match"
+        )
+    else:
+        # relevance of the indexed words only (see search_filter)
+        terms = [term for term in terms if len(term) >= min_token_size()]
+        if not terms:
+            return None
+        match = " ".join(f"+{term}*" for term in terms)
+        ranks = text(
+            "SELECT project_id AS id, -MATCH(body) AGAINST (:rank_match IN BOOLEAN MODE) AS score "
+            f"FROM {SEARCH_TABLE} WHERE MATCH(body) AGAINST (:rank_match IN BOOLEAN MODE)"
+        )
+
+    return (
+        ranks.bindparams(rank_match=match)
+        .columns(id=db.Integer, score=db.Float)
+        .subquery("search_ranks")
+    )
+
+
+def like_search_filter(query):
+    """
+    Search without index (databases other than SQLite and MySQL): every word of query
+    in Project.search_text, or None if the query has no words.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+
+    return and_(*[Project.search_text.like(f"%{term}%") for term in terms])
+
+
+# --- Index maintenance on project, member and personnel changes ---
+
+
+def _name_changed(personnel):
+    state = inspect(personnel)
+    return not state.pending and any(
+        state.attrs[name].history.has_changes() for name in ("name", "firstname")
+    )
+
+
+def _set_search_names(personnel):
+    personnel.search_name = normalize_text(personnel.name or "")
+    personnel.search_firstname = normalize_text(personnel.firstname or "")
+
+
+@event.listens_for(Personnel, "before_insert")
+@event.listens_for(Personnel, "before_update")
+def _update_search_names(mapper, connection, personnel):
+    _set_search_names(personnel)
+
+
+def _collect_search_changes(session, changes, new, dirty, deleted):
+    for obj in (*new, *dirty, *deleted):
+        if isinstance(obj, Project):
+            changes.setdefault("projects", set()).add(obj.id)
+        elif isinstance(obj, ProjectMember):
+            changes.setdefault("projects", set()).add(obj.project_id)
+        elif isinstance(obj, Personnel) and _name_changed(obj):
+            changes.setdefault("personnels", set()).add(obj.id)
+
+
+def _update_search_index(session, changes):
+    project_ids = changes.get("projects", set())
+    if changes.get("personnels"):
+        # projects created, validated or with a member among the updated personnels
+        pids = changes["personnels"]
+        project_ids |= set(
+            session.scalars(
+                db.select(Project.id).where(
+                    Project.members.any(ProjectMember.pid.in_(pids))
+                    | Project.user.has(User.pid.in_(pids))
+                    | Project.validator.has(User.pid.in_(pids))
+                )
+            )
+        )
+
+    index_projects(session, project_ids - {None})
+
+
+on_session_changes("search", _collect_search_changes, _update_search_index)
+
+
+def init_search_index(app):
+    """Warns if the search index must be (re)built and registers the flask search-index command."""
+    with app.app_context():
+        try:
+            # search columns not filled yet (new columns)
+            missing = db.session.scalar(
+                db.select(Project.id).where(Project.search_text.is_(None)).limit(1)
+            )
+            if missing or (_create_statements(_dialect(db.engine)) and not search_index_ready()):
+                logger.warning("Search index missing or incomplete: run flask search-index.")
+        except (OperationalError, ProgrammingError) as error:
+            logger.error(f"Search index could not be checked: {error}")
+        finally:
+            db.session.rollback()
+
+    @app.cli.command("search-index")
+    def search_index():
+        """Backfills the search columns and rebuilds the search index of the projects."""
+        create_search_index()
+        n = rebuild_search_index()
+        click.echo(f"Index de recherche reconstruit ({n} projets).")
@@ -5,6 +5,7 @@
 document.addEventListener('DOMContentLoaded', () => {
     initSchoolYearForm();
     initDownloadFormToggle();
+    initDownloadJobs();
 });
 
 function initSchoolYearForm() {
@@ -50,4 +51,70 @@ function initDownloadFormToggle() {
 
     radioButtons.forEach(radio => radio.addEventListener('change', toggleFields));
     toggleFields(); // Initial state
-}
\ No newline at end of file
+}
+// --- Export jobs: the file is written by the worker, the job is polled until done ---
+
+function initDownloadJobs() {
+    const form = document.getElementById('download-form');
+    const jobDiv = document.getElementById('export-job');
+    if (!form || !jobDiv) return;
+
+    const statusEl = document.getElementById('export-status');
+    const progressEl = document.getElementById('export-progress');
+    const submitButton = form.querySelector('[type="submit"]');
+
+    const showStatus = (message, progress = null) => {
+        jobDiv.classList.remove('is-hidden');
+        statusEl.textContent = message;
+        if (progress === null) {
+            progressEl.removeAttribute('value');
+        } else {
+            progressEl.value = progress;
+        }
+    };
+
+    const pollJob = async (jobId) => {
+        try {
+            const response = await fetch(`${form.action}/${jobId}`);
+            if (!response.ok) throw new Error(`Response status: ${response.status}`);
+            const job = await response.json();
+
+            if (job.status === 'done') {
+                showStatus(`Fichier prêt : ${job.filename}`, 100);
+                submitButton.disabled = false;
+                window.location = `${form.action}/${jobId}/file`;
+            } else if (job.status === 'failed') {
+                showStatus("Erreur lors de la création du fichier.", 0);
+                submitButton.disabled = false;
+            } else {
+                const message = job.status === 'running' && job.total
+                    ? `Export en cours : ${job.rows} / ${job.total} projets`
+                    : "Export en attente...";
+                showStatus(message, job.status === 'running' ? job.progress : null);
+                setTimeout(() => pollJob(jobId), 2000);
+            }
+        } catch (error) {
+            console.error('Error fetching export job:', error.message);
+            submitButton.disabled = false;
+        }
+    };
+
+    form.addEventListener('submit', async (event) => {
+        event.preventDefault();
+        submitButton.disabled = true;
+        try {
+            const response = await fetch(form.action, { method: 'POST', body: new FormData(form) });
+            if (!response.ok) throw new Error(`Response status: ${response.status}`);
+            if (response.status === 204) {
+                showStatus("Aucun projet pour cette période.", 0);
+                submitButton.disabled = false;
+                return;
+            }
+            const job = await response.json();
+            pollJob(job.id);
+        } catch (error) {
+            console.error('Error requesting export:', error.message);
+            submitButton.disabled = false;
+        }
+    });
+}
@@ -642,7 +642,7 @@ async function fetchBudgetData(projectId) {
     }
 }
 
-async function asyncQueuedAction(actionId) {
+async function asyncQueuedAction(actionId, attempt = 0) {
     const notification_overlay = document.querySelector(".notification-overlay ul");
     const urlRootEl = document.getElementById('url-root');
     if (!notification_overlay || !urlRootEl) return;
@@ -653,6 +653,15 @@ async function asyncQueuedAction(actionId) {
         if (!response.ok) throw new Error(`Response status: ${response.status}`);
 
         const data = await response.json();
+
+        // the notification is sent by the notifications worker: poll until it is done
+        if (data.html === "Pending") {
+            if (attempt < 20) {
+                setTimeout(() => asyncQueuedAction(actionId, attempt + 1), 3000);
+            }
+            return;
+        }
+
         const newNotification = document.createElement('div');
         
         if (data.html === "Done!") {
@@ -1,5 +1,8 @@
+import hashlib
 import os
 import re
+import threading
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 import bleach
@@ -19,23 +22,54 @@ from .utils import (
 
 DOMAIN = os.getenv("DOMAIN")
 
-
-def md_to_html(raw_markdown):
+MD_CLASSES = {
+    "h1": ["title", "is-5", "mb-2"],
+    "h2": ["subtitle", "is-6"],
+    "ul": ["mt-2"],
+    "table": ["table", "is-striped", "is-hoverable"],
+}
+
+MD_ALLOWED_TAGS = [
+    "p",
+    "br",
+    "div",
+    "strong",
+    "em",
+    "h1",
+    "h2",
+    "ul",
+    "ol",
+    "li",
+    "code",
+    "pre",
+    "blockquote",
+    "hr",
+    "a",
+    "i",
+    "span",
+    "img",
+    "sup",
+    "sub",
+    "table",
+    "tbody",
+    "thead",
+    "tr",
+    "th",
+    "td",
+]
+MD_ALLOWED_ATTRS = {
+    "*": ["class", "id", "aria-hidden"],
+    "a": ["href", "title", "rel", "target"],
+    "img": ["src", "alt", "title", "width", "height"],
+}
+
+
+def _render_markdown(raw_markdown):
     """Converts raw markdown to sanitized HTML with Bulma classes."""
-    if not raw_markdown:
-        return ""
-
     html = markdown.markdown(raw_markdown, extensions=["extra", "nl2br"])
     soup = BeautifulSoup(html, "html.parser")
 
-    mapping = {
-        "h1": ["title", "is-5", "mb-2"],
-        "h2": ["subtitle", "is-6"],
-        "ul": ["mt-2"],
-        "table": ["table", "is-striped", "is-hoverable"],
-    }
-
-    for tag, classes in mapping.items():
+    for tag, classes in MD_CLASSES.items():
         for element in soup.find_all(tag):
             element["class"] = element.get("class", []) + classes
 
@@ -49,41 +83,38 @@ def md_to_html(raw_markdown):
             icon["aria-hidden"] = "true"
             a.append(icon)
 
-    allowed_tags = [
-        "p",
-        "br",
-        "div",
-        "strong",
-        "em",
-        "h1",
-        "h2",
-        "ul",
-        "ol",
-        "li",
-        "code",
-        "pre",
-        "blockquote",
-        "hr",
-        "a",
-        "i",
-        "span",
-        "img",
-        "sup",
-        "sub",
-        "table",
-        "tbody",
-        "thead",
-        "tr",
-        "th",
-        "td",
-    ]
-    allowed_attrs = {
-        "*": ["class", "id", "aria-hidden"],
-        "a": ["href", "title", "rel", "target"],
-        "img": ["src", "alt", "title", "width", "height"],
-    }
-
-    return bleach.clean(str(soup), tags=allowed_tags, attributes=allowed_attrs)
+    return bleach.clean(str(soup), tags=MD_ALLOWED_TAGS, attributes=MD_ALLOWED_ATTRS)
+
+
+# rendered HTML cache: {sha256(filter config + markdown): html}, least recently used first
+MD_CACHE_SIZE = 2048
+_md_config_key = repr((DOMAIN, MD_CLASSES, MD_ALLOWED_TAGS, MD_ALLOWED_ATTRS)).encode()
+_md_cache = OrderedDict()
+_md_cache_lock = threading.Lock()
+
+
+def md_to_html(raw_markdown):
+    """
+    Converts raw markdown to sanitized HTML with Bulma classes.
+    Rendered HTML is cached by content hash, so unchanged texts are rendered only once per worker.
+    """
+    if not raw_markdown:
+        return ""
+
+    key = hashlib.sha256(_md_config_key + raw_markdown.encode()).digest()
+    with _md_cache_lock:
+        html = _md_cache.get(key)
+        if html is not None:
+            _md_cache.move_to_end(key)
+            return html
+
+    html = _render_markdown(raw_markdown)
+
+    with _md_cache_lock:
+        _md_cache[key] = html
+        if len(_md_cache) > MD_CACHE_SIZE:
+            _md_cache.popitem(last=False)
+    return html
 
 
 def register_template_filters(app):
@@ -2,19 +2,19 @@ import csv
 import io
 import logging
 import re
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import date, datetime, timedelta
+from functools import lru_cache
 from itertools import groupby
 from operator import attrgetter
+from types import MappingProxyType
 from zoneinfo import ZoneInfo
 
-import numpy as np
-import pandas as pd
 from babel.dates import format_date, format_datetime
-from flask import g, has_app_context
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.orm import joinedload
 
+from .cache import DashboardSnapshot, PersonnelSnapshot, SchoolYearSnapshot, VersionedCache
 from .models import (
     Dashboard,
     Personnel,
@@ -26,27 +26,77 @@ from .models import (
     db,
 )
 from .project import choices, levels
+from .search import like_search_filter, search_filter, search_index_ready, search_ranks
 
 logger = logging.getLogger(__name__)
 
 
+def _load_personnel():
+    return tuple(
+        PersonnelSnapshot.from_model(p)
+        for p in Personnel.query.options(joinedload(Personnel.user)).all()
+    )
+
+
+personnel_cache = VersionedCache("personnel", _load_personnel)
+
+
 def get_cached_personnel():
     """
-    Fetches all Personnel records and caches them in the application context (g).
-    Eliminates redundant DB queries for a table that rarely changes.
+    Returns read-only snapshots of all Personnel records (with their User account).
+    The list is cached for the whole worker process and reloaded only after
+    invalidate_personnel_cache() has been called by any worker.
     """
-    if has_app_context():
-        if "personnel_cache" not in g:
-            g.personnel_cache = Personnel.query.options(joinedload(Personnel.user)).all()
-        return g.personnel_cache
-    else:
-        # Fallback for CLI/background tasks
-        return Personnel.query.options(joinedload(Personnel.user)).all()
+    return personnel_cache.get()
+
+
+# {email: PersonnelSnapshot}, reloaded with the personnel cache (same version counter)
+personnel_email_cache = VersionedCache(
+    "personnel", lambda: MappingProxyType({p.email: p for p in get_cached_personnel()})
+)
+
+
+def get_personnel_by_email():
+    """Returns the {email: PersonnelSnapshot} index of the cached personnels."""
+    return personnel_email_cache.get()
+
+
+def _load_notification_routes():
+    """
+    Routing index of the gestion/direction notifications:
+    {(preference key, role, project bit): personnels subscribed}, project bit as
+    returned by get_project_division_bit (1: Primaire, 2: Secondaire, 3: both).
+    """
+    routes = {}
+    for p in get_cached_personnel():
+        if p.role not in ("gestion", "direction") or not p.user:
+            continue
+        for key, mask in p.user.preferences.items():
+            if not key.startswith("notify_") or not isinstance(mask, int):
+                continue
+            for project_bit in (1, 2, 3):
+                if mask & project_bit:
+                    routes.setdefault((key, p.role, project_bit), []).append(p)
+
+    return MappingProxyType({route: tuple(personnels) for route, personnels in routes.items()})
+
+
+# rebuilt with the personnel cache (same version counter), i.e. when personnels or preferences change
+notification_routes_cache = VersionedCache("personnel", _load_notification_routes)
+
+
+def get_notification_recipients(key, project_bit, roles=("gestion", "direction")):
+    """Personnels of the given roles subscribed to the notification key for the project bit."""
+    routes = notification_routes_cache.get()
+    return [p for role in roles for p in routes.get((key, role, project_bit), ())]
+
+
+def invalidate_personnel_cache():
+    personnel_cache.invalidate()
 
 
 def invalidate_school_years_cache():
-    if has_app_context() and "school_years_cache" in g:
-        del g.school_years_cache
+    school_years_cache.invalidate()
 
 
 def get_datetime():
@@ -157,6 +207,27 @@ def auto_dashboard():
     return dash
 
 
+# maximum delay (seconds) for a lock change to reach the other worker processes
+LOCK_STATE_TTL = 5
+
+dashboard_cache = VersionedCache(
+    "dashboard", lambda: DashboardSnapshot.from_model(auto_dashboard()), ttl=LOCK_STATE_TTL
+)
+
+
+def get_lock_state():
+    """
+    Returns a read-only snapshot of the Dashboard record (lock, lock_message...).
+    The snapshot is cached by each worker process and reloaded when the lock is changed
+    with invalidate_dashboard_cache(), at most LOCK_STATE_TTL seconds later.
+    """
+    return dashboard_cache.get()
+
+
+def invalidate_dashboard_cache():
+    dashboard_cache.invalidate()
+
+
 def get_school_year_choices(sy, sy_next):
     return [("current", f"Actuelle ({sy})"), ("next", f"Prochaine ({sy_next})")]
 
@@ -212,15 +283,15 @@ def get_divisions_choices(sy):
     return [(div, division_name(div)) for div in get_divisions(sy)]
 
 
-def get_division_sections(form):
-    return {
-        section: [
-            subfield.data
-            for subfield in form.divisions
-            if subfield.data.startswith(tuple(levels[section]))
-        ]
-        for section in ["Lycée", "Collège", "Élémentaire", "Maternelle"]
+def get_division_sections(form, sy=None):
+    division_sections = {
+        section: [] for section in ["Lycée", "Collège", "Élémentaire", "Maternelle"]
     }
+    for subfield in form.divisions:
+        section = get_division_section(subfield.data, sy)
+        if section:
+            division_sections[section].append(subfield.data)
+    return division_sections
 
 
 def get_status_choices(form, project_status=None):
@@ -265,35 +336,124 @@ def get_axis(priority):
     return None
 
 
-def get_school_years(years_str=None):
+class DivisionIndex:
     """
-    Parses a string like "XXXX - YYYY", a single school year or a range of school years
-    (projet d'établissement), or None for all shool years.
-    Returns a dict: { 'SY_string': SchoolYear_Object }
+    Divisions of a period (single school year or range of school years),
+    precomputed once: sorted list, lists by section and division -> section map.
     """
 
-    # 1. Fetch from cache or DB
-    if has_app_context():
-        if "school_years_cache" not in g:
-            g.school_years_cache = {sy_obj.sy: sy_obj for sy_obj in SchoolYear.query.all()}
-        all_sys = g.school_years_cache
-    else:
-        # Fallback for CLI/background tasks outside request context
-        all_sys = {sy_obj.sy: sy_obj for sy_obj in SchoolYear.query.all()}
+    # sections of the school, with the order of their levels
+    sections = ("Lycée", "Collège", "Élémentaire", "Maternelle", "Primaire", "Secondaire", "LFS")
 
-    # 2. Filter the pre-fetched dictionary in Python
-    if years_str is None:
-        return all_sys
-    else:
-        parts = years_str.split(" - ")
-        start_val = int(parts[0].strip())
-        end_val = int(parts[1].strip()) if len(parts) > 1 else start_val + 1
+    # base section of each level prefix, and rank of the prefix in the LFS order (read-only)
+    level_section = MappingProxyType(
+        {
+            level: section
+            for section in ["Lycée", "Collège", "Élémentaire", "Maternelle"]
+            for level in levels[section]
+        }
+    )
+    level_rank = MappingProxyType({level: i for i, level in enumerate(levels["LFS"])})
+
+    def __init__(self, school_years):
+        # get unique divisions
+        unique_divisions = {
+            division.strip() for school_year in school_years for division in school_year.divisions
+        }
+
+        # find the level prefix of each division
+        division_level = {}
+        for division in unique_divisions:
+            division_level[division] = next(
+                (level for level in levels["LFS"] if division.startswith(level)), None
+            )
+
+        def division_sort_key(division):
+            level = division_level[division]
+            if level is None:
+                return (len(self.level_rank), division)  # unknown level: sort at the end
+            return (self.level_rank[level], division[len(level) :])
+
+        self.divisions = tuple(sorted(unique_divisions, key=division_sort_key))
+
+        # division -> base section (Lycée, Collège, Élémentaire, Maternelle)
+        self.section_of = {
+            division: self.level_section[division_level[division]]
+            for division in self.divisions
+            if division_level[division]
+        }
+
+        # section -> ordered divisions (ordered by level as in the LFS list)
+        self.by_section = {
+            section: tuple(
+                division
+                for division in self.divisions
+                if division_level[division] in levels[section]
+            )
+            for section in self.sections
+        }
 
-        # Reconstruct the list of possible SY strings to query specifically
-        # Example: "2024 - 2026" -> ["2024 - 2025", "2025 - 2026"]
-        sy_to_fetch = [f"{y} - {y + 1}" for y in range(start_val, end_val)]
 
-        return {sy: obj for sy, obj in all_sys.items() if sy in sy_to_fetch}
+class SchoolYearRegistry:
+    """
+    Read-only snapshots of all SchoolYear records, shared by all requests of a worker.
+    Periods (filtered school years and their DivisionIndex) are computed on first use.
+    """
+
+    def __init__(self, school_years):
+        self.all = MappingProxyType({school_year.sy: school_year for school_year in school_years})
+        register_division_names(
+            {division for school_year in self.all.values() for division in school_year.divisions}
+        )
+        self._periods = {}
+        self._divisions = {}
+
+    def period(self, years_str):
+        """Returns the {sy: SchoolYearSnapshot} mapping for years_str (see get_school_years)."""
+        if years_str is None:
+            return self.all
+
+        period = self._periods.get(years_str)
+        if period is None:
+            parts = years_str.split(" - ")
+            start_val = int(parts[0].strip())
+            end_val = int(parts[1].strip()) if len(parts) > 1 else start_val + 1
+
+            # Reconstruct the list of possible SY strings
+            # Example: "2024 - 2026" -> ["2024 - 2025", "2025 - 2026"]
+            sy_to_fetch = {f"{y} - {y + 1}" for y in range(start_val, end_val)}
+
+            period = MappingProxyType(
+                {sy: obj for sy, obj in self.all.items() if sy in sy_to_fetch}
+            )
+            self._periods[years_str] = period
+        return period
+
+    def divisions(self, years_str):
+        """Returns the DivisionIndex of the period years_str."""
+        index = self._divisions.get(years_str)
+        if index is None:
+            index = DivisionIndex(self.period(years_str).values())
+            self._divisions[years_str] = index
+        return index
+
+
+school_years_cache = VersionedCache(
+    "school_years",
+    lambda: SchoolYearRegistry(
+        [SchoolYearSnapshot.from_model(sy_obj) for sy_obj in SchoolYear.query.all()]
+    ),
+)
+
+
+def get_school_years(years_str=None):
+    """
+    Parses a string like "XXXX - YYYY", a single school year or a range of school years
+    (projet d'établissement), or None for all shool years.
+    Returns a dict: { 'SY_string': SchoolYearSnapshot }
+    School years are cached for the whole worker process, until invalidate_school_years_cache().
+    """
+    return dict(school_years_cache.get().period(years_str))
 
 
 def auto_school_year(sy_start=None, sy_end=None):
@@ -319,11 +479,14 @@ def auto_school_year(sy_start=None, sy_end=None):
                 is_current_year = sy_start <= today <= sy_end
 
                 if has_dates_changed and is_current_year:
-                    school_year.sy_start = sy_start
-                    school_year.sy_end = sy_end
-                    school_year.sy = f"{sy_start.year} - {sy_end.year}"
+                    sy = f"{sy_start.year} - {sy_end.year}"
+                    record = db.session.get(SchoolYear, school_year.id)
+                    record.sy_start = sy_start
+                    record.sy_end = sy_end
+                    record.sy = sy
                     db.session.commit()
                     invalidate_school_years_cache()
+                    return get_school_years()[sy]
 
             return school_year
 
@@ -339,7 +502,7 @@ def auto_school_year(sy_start=None, sy_end=None):
     previous_school_year = school_years_dict.get(sy_previous)
 
     if previous_school_year:
-        divisions = previous_school_year.divisions
+        divisions = list(previous_school_year.divisions)
     else:
         divisions = get_divisions("default")
 
@@ -373,28 +536,20 @@ def auto_school_year(sy_start=None, sy_end=None):
     db.session.commit()
     invalidate_school_years_cache()
 
-    return current_school_year
+    return get_school_years()[sy]
 
 
-def division_name(canonical_division: str, arg: str = "") -> str:
-    """Get the display name for a given canonical division.
+# display name formats of division_name(): "" (short), "F" (full), "S" (spaced) and "FS"
+DIVISION_NAME_FLAGS = ("", "F", "S", "FS")
 
-    Args:
-        canonical_division (str): A string representing the canonical division.
-        arg (str, optional): A string of flags that modify the output format.
-            - "F": display the full division name.
-            - "S": add a space before the division name (letter).
-
-    Returns:
-        str: The display name corresponding to the canonical division.
-            Returns an empty string if the input does not match any known division formats.
-    """
 
-    division = canonical_division
-    space = " " if "S" in arg else ""
+@lru_cache(maxsize=1024)
+def _format_division_name(division: str, flags: str) -> str:
+    """Computes the display name of a canonical division (see division_name)."""
+    space = " " if "S" in flags else ""
 
     if division.startswith("0"):
-        if "F" in arg:
+        if "F" in flags:
             return "Terminale" + (" " + division[-1].upper()) * (len(division) > 1)
         else:
             return (
@@ -403,7 +558,7 @@ def division_name(canonical_division: str, arg: str = "") -> str:
                 else "Te" + (space + division[-1].upper()) * (len(division) > 1)
             )
     elif division.startswith("1"):
-        if "F" in arg:
+        if "F" in flags:
             return "1re" + (space + division[-1].upper()) * (len(division) > 1)
         else:
             return (
@@ -412,7 +567,7 @@ def division_name(canonical_division: str, arg: str = "") -> str:
                 else "1e" + (space + division[-1].upper()) * (len(division) > 1)
             )
     elif division.startswith("2"):
-        if "F" in arg:
+        if "F" in flags:
             return "2de" + (space + division[-1].upper()) * (len(division) > 1)
         else:
             return (
@@ -423,22 +578,22 @@ def division_name(canonical_division: str, arg: str = "") -> str:
     elif division.startswith(("3", "4", "5", "6")):
         return division[0] + "e" + (space + division[-1].upper()) * (len(division) > 1)
     elif division.startswith(("cm", "ce")):
-        if "F" in arg:
+        if "F" in flags:
             return division[:3].upper() + (space + division[-1].upper()) * (len(division) > 3)
         else:
             return division[:3] + (space + division[-1].upper()) * (len(division) > 3)
     elif division.startswith("mgs"):
-        if "F" in arg:
+        if "F" in flags:
             return "MS/GS" + (space + division[-1].upper()) * (len(division) > 3)
         else:
             return "ms/gs" + (space + division[-1].upper()) * (len(division) > 3)
     elif division.startswith("pms"):
-        if "F" in arg:
+        if "F" in flags:
             return "PS/MS" + (space + division[-1].upper()) * (len(division) > 3)
         else:
             return "ps/ms" + (space + division[-1].upper()) * (len(division) > 3)
     elif division.startswith(("cp", "gs", "ms", "ps")):
-        if "F" in arg:
+        if "F" in flags:
             return division[:2].upper() + (space + division[-1].upper()) * (len(division) > 2)
         else:
             return division[:2] + (space + division[-1].upper()) * (len(division) > 2)
@@ -446,6 +601,50 @@ def division_name(canonical_division: str, arg: str = "") -> str:
         return ""
 
 
+def _division_flags(arg: str) -> str:
+    """Keeps the flags used by division_name(), in DIVISION_NAME_FLAGS order."""
+    return ("F" if "F" in arg else "") + ("S" if "S" in arg else "")
+
+
+def register_division_names(divisions):
+    """Adds the display names of divisions to the division names lookup table."""
+    _division_names_table.update(
+        {
+            (division, flags): _format_division_name(division, flags)
+            for division in divisions
+            for flags in DIVISION_NAME_FLAGS
+        }
+    )
+
+
+# {(canonical division, flags): display name}, completed with the divisions of the school years
+_division_names_table = {}
+register_division_names(
+    level + letter for level in levels["LFS"] for letter in ("", "a", "b", "c", "d")
+)
+
+
+def division_name(canonical_division: str, arg: str = "") -> str:
+    """Get the display name for a given canonical division.
+
+    Args:
+        canonical_division (str): A string representing the canonical division.
+        arg (str, optional): A string of flags that modify the output format.
+            - "F": display the full division name.
+            - "S": add a space before the division name (letter).
+
+    Returns:
+        str: The display name corresponding to the canonical division.
+            Returns an empty string if the input does not match any known division formats.
+    """
+
+    flags = _division_flags(arg)
+    name = _division_names_table.get((canonical_division, flags))
+    if name is None:
+        name = _format_division_name(canonical_division, flags)
+    return name
+
+
 def division_names(divisions: list, arg: str = "") -> str:
     """Convert a comma-separated string of canonical divisions into their display names.
 
@@ -464,8 +663,11 @@ def division_names(divisions: list, arg: str = "") -> str:
             will return None for that entry.
     """
     separator = ", " if "s" in arg else ","
-    arg = arg.replace("s", "")
-    return separator.join([division_name(div, arg) for div in divisions])
+    flags = _division_flags(arg)
+    table = _division_names_table
+    return separator.join(
+        [table.get((div, flags)) or _format_division_name(div, flags) for div in divisions]
+    )
 
 
 def get_divisions(sy=None, sections=None):
@@ -492,53 +694,21 @@ def get_divisions(sy=None, sections=None):
         divisions = [level + name for level in levels["LFS"] for name in ["A", "B"]]
         return divisions
 
-    def division_sort_key(s, custom_order):
-        # Find the prefix
-        for prefix in custom_order:
-            if s.startswith(prefix):
-                return (
-                    custom_order.index(prefix),
-                    s[len(prefix) :],
-                )  # Return index and the rest of the string
-        return (len(custom_order), s)  # If no prefix matches, sort at the end
-
-    # get the school year dictionary for sy
-    sy_dict = get_school_years(sy)
-
-    # extract divisions
-    divisions_list = [obj.divisions for obj in sy_dict.values() if obj.divisions]
-
-    # get unique divisions
-    division_list = list(
-        {division.strip() for divisions in divisions_list for division in divisions}
-    )
+    # get the precomputed divisions of the period sy
+    index = school_years_cache.get().divisions(sy)
 
     # filter for section
     if isinstance(sections, list):
-        divisions = {}
-        for _section in sections:
-            divisions[_section] = [
-                division
-                for division in division_list
-                if any(division.startswith(prefix) for prefix in levels[_section])
-            ]
+        return {_section: list(index.by_section[_section]) for _section in sections}
     elif isinstance(sections, str):
-        divisions = [
-            division
-            for division in division_list
-            if any(division.startswith(prefix) for prefix in levels[sections])
-        ]
+        return list(index.by_section[sections])
     else:
-        divisions = division_list
+        return list(index.divisions)
 
-    # order the list
-    if isinstance(sections, list):
-        for _section in sections:
-            divisions[_section].sort(key=lambda s: division_sort_key(s, levels[_section]))
-    else:
-        divisions.sort(key=lambda s: division_sort_key(s, levels["LFS"]))
 
-    return divisions
+def get_division_section(division, sy=None):
+    """Returns the section (Lycée, Collège, Élémentaire, Maternelle) of a division of the period sy."""
+    return school_years_cache.get().divisions(sy).section_of.get(division)
 
 
 def get_label(field, choice):
@@ -546,13 +716,14 @@ def get_label(field, choice):
     return choices.get(field, {}).get(choice, None)
 
 
-def query_projects(user=None, filter=None, years=None, data=None, order="desc"):
+def query_projects(user=None, filter=None, years=None, data=None, order="desc", search=None):
     """Query Project table
     filter (str): department name, "Mes projets", "Mes projets à valider", "LFS" or None, "Projets à valider", "Sans code budgétaire"
     years (str): school year or range of school years string (ex. Projet Étab.),
         fiscal year, None for all school years
     data (str): "data" (for data page), "budget" (for budget page), "budget_strict" for only approved projects with budget, None.
-    order (str): query order by project.id "asc" or "desc".
+    order (str): query order by project.id "asc" or "desc", or "rank" (search relevance, then "desc").
+    search (str): words searched in the projects (accent-insensitive), None.
 
     return: SQLAlchemy query object
     """
@@ -638,6 +809,19 @@ def query_projects(user=None, filter=None, years=None, data=None, order="desc"):
     elif data == "data":
         query = query.filter(Project.status.not_in(["draft", "ready-1", "rejected"]))
 
+    # Apply "search" filter: search index, or LIKE on Project.search_text if the database
+    # has no search index
+    if search:
+        if search_index_ready():
+            condition = search_filter(search)
+            ranks = search_ranks(search) if condition is not None and order == "rank" else None
+            if ranks is not None:
+                query = query.join(ranks, ranks.c.id == Project.id).order_by(ranks.c.score)
+        else:
+            condition = like_search_filter(search)
+        if condition is not None:
+            query = query.filter(condition)
+
     # default : order by newest first (desc)
     if order == "asc":
         return query.order_by(Project.id)
@@ -645,92 +829,194 @@ def query_projects(user=None, filter=None, years=None, data=None, order="desc"):
         return query.order_by(Project.id.desc())
 
 
+class KeysetPagination:
+    """
+    Page of a Project query, newest first, selected with a cursor instead of an OFFSET
+    (keyset pagination on Project.id): after (id of the last project of the previous page)
+    or before (id of the first project of the next page).
+    A page costs the same at any depth, and no COUNT is run: total is optional.
+    """
+
+    def __init__(self, query, per_page, after=None, before=None, total=None):
+        query = query.order_by(None)
+
+        if before is not None:
+            rows = query.filter(Project.id > before).order_by(Project.id).limit(per_page + 1).all()
+            self.items = rows[:per_page][::-1]
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+        else:
+            if after is not None:
+                query = query.filter(Project.id < after)
+            rows = query.order_by(Project.id.desc()).limit(per_page + 1).all()
+            self.items = rows[:per_page]
+            self.has_prev = after is not None
+            self.has_next = len(rows) > per_page
+
+        self.per_page = per_page
+        self.total = total
+        self.prev_cursor = self.items[0].id if self.items and self.has_prev else None
+        self.next_cursor = self.items[-1].id if self.items and self.has_next else None
+
+    @property
+    def prev_args(self):
+        """URL arguments of the previous page."""
+        return {"before": self.prev_cursor}
+
+    @property
+    def next_args(self):
+        """URL arguments of the next page."""
+        return {"after": self.next_cursor}
+
+
+class OffsetPagination:
+    """
+    Page of a query in its own order (search results by relevance), selected with an OFFSET:
+    page (1 for the first page). Fetches per_page + 1 rows to know if a next page exists,
+    no COUNT is run: total is optional.
+    """
+
+    def __init__(self, query, per_page, page=1, total=None):
+        page = max(page, 1)
+        rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+
+        self.items = rows[:per_page]
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.has_prev = page > 1
+        self.has_next = len(rows) > per_page
+
+    @property
+    def prev_args(self):
+        """URL arguments of the previous page."""
+        return {"page": self.page - 1}
+
+    @property
+    def next_args(self):
+        """URL arguments of the next page."""
+        return {"page": self.page + 1}
+
+
+def iter_keyset(query, chunk_size=100, order="desc"):
+    """
+    Yields the projects of query, newest first (or oldest first with order="asc"),
+    loaded chunk_size at a time (keyset).
+    """
+    query = query.order_by(None)
+    after = None
+    ascending = order == "asc"
+
+    while True:
+        if after is None:
+            chunk_query = query
+        elif ascending:
+            chunk_query = query.filter(Project.id > after)
+        else:
+            chunk_query = query.filter(Project.id < after)
+        order_by = Project.id.asc() if ascending else Project.id.desc()
+        chunk = chunk_query.order_by(order_by).limit(chunk_size).all()
+        yield from chunk
+
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1].id
+
+
+def creator_department():
+    """Department of the project creator, as a column of the projects queries."""
+    return (
+        select(Personnel.department)
+        .join(User, User.pid == Personnel.id)
+        .where(User.id == Project.uid)
+        .scalar_subquery()
+        .label("department")
+    )
+
+
+# Project columns loaded by get_projects_df for the data and budget pages
+PROJECTS_DF_COLUMNS = {
+    "budget": [
+        "id",
+        "title",
+        "school_year",
+        "start_date",
+        "end_date",
+        "nb_students",
+        "budget_id",
+        "modified_at",
+        "status",
+        "validated_at",
+        "is_recurring",
+    ]
+    + [f"budget_{b}_{i}" for b in ("hse", "exp", "trip", "int") for i in [1, 2]],
+}
+PROJECTS_DF_COLUMNS["data"] = PROJECTS_DF_COLUMNS["budget"] + [
+    "axis",
+    "priority",
+    "paths",
+    "skills",
+    "divisions",
+    "mode",
+    "requirement",
+    "location",
+]
+
+
 def get_projects_df(user=None, filter=None, years=None, data=None, order="desc"):
     """Convert Project table to DataFrame
     filter: department name
     years: school year or range of school years string (ex. Projet Étab.),
         fiscal year, None for all school years
     draft: include draft projects
-    data: Excel (save .xlsx file), data (for data page),
-          budget (for budget page), None
+    data: data (for data page), budget (for budget page), None
+          (Excel and CSV downloads: see export.py)
     labels: True (replace codes with corresponding labels)
 
     return: dataframe with projects data
     """
+    # pandas is loaded on first use only (data and budget pages)
+    import numpy as np
+    import pandas as pd
 
     # Query data with filter and years filters
     query = query_projects(user=user, filter=filter, years=years, data=data, order=order)
 
-    # Eager loading
-    if data == "Excel":
-        query = query.options(
-            joinedload(Project.user).joinedload(User.p),
-            joinedload(Project.modifier).joinedload(User.p),
-            joinedload(Project.validator).joinedload(User.p),
-            joinedload(Project.members).joinedload(ProjectMember.p),
-        )
-    elif data == "data":
-        query = query.options(
-            joinedload(Project.user).joinedload(User.p),
-            joinedload(Project.members).joinedload(ProjectMember.p),
-        )
-    else:
-        query = query.options(
-            joinedload(Project.user).joinedload(User.p),
-        )
+    # Only the columns used by the page are loaded (all of them if data is None)
+    names = PROJECTS_DF_COLUMNS.get(data) or [c.name for c in Project.__table__.columns]
+    rows = query.with_entities(
+        *[getattr(Project, name) for name in names], creator_department()
+    ).all()
 
-    projects = query.all()
-
-    if not projects:
+    if not rows:
         return pd.DataFrame()
 
-    # Build the base DataFrame
-    records = [{c.name: getattr(p, c.name) for c in p.__table__.columns} for p in projects]
-    df = pd.DataFrame.from_records(records)
-
-    # set index
-    if data == "Excel":
-        df.set_index("id", inplace=True)
-
-    # Column-wise ORM extraction
-    df["department"] = [p.user.p.department if p.user and p.user.p else None for p in projects]
-    df["has_budget"] = ["Oui" if p.has_budget else "Non" for p in projects]
+    # Build the base DataFrame from the columns of the rows
+    df = pd.DataFrame(dict(zip(names + ["department"], zip(*rows))))
 
     # Vectorized boolean mapping
+    budget_columns = [f"budget_{b}_{i}" for b in ("hse", "exp", "trip", "int") for i in [1, 2]]
+    df["has_budget"] = np.where((df[budget_columns] != 0).any(axis=1), "Oui", "Non")
     df["is_recurring"] = np.where(df["is_recurring"], "Oui", "Non")
 
-    # Vectorized transformations
+    # Members of the projects, in a single query
     if data == "data":
-        df["members"] = [[get_name(m.p) for m in p.members] for p in projects]
-        df["departments"] = [[m.department for m in p.members] for p in projects]
-
-    elif data == "Excel":
-        df["user"] = [get_name(p.user.p) if p.user and p.user.p else "" for p in projects]
-        df.drop(columns=["uid"], inplace=True, errors="ignore")
-
-        df["members"] = ["\n".join([get_name(m.p) for m in p.members]) for p in projects]
-        df["departments"] = ["\n".join([m.department for m in p.members]) for p in projects]
-        df["modified_by"] = [get_name(p.modifier.p) if p.modified_by else "" for p in projects]
-        df["validated_by"] = [get_name(p.validator.p) if p.validated_by else "" for p in projects]
-
-        # Vectorized list joining
-        for col in ["skills", "paths"]:
-            df[col] = df[col].apply(lambda x: "\n".join(x) if isinstance(x, list) else x)
-
-        df["divisions"] = df["divisions"].apply(
-            lambda divs: (
-                "\n".join([division_name(d, "FS") for d in divs])
-                if isinstance(divs, list)
-                else divs
+        members = defaultdict(list)
+        member_rows = db.session.execute(
+            select(
+                ProjectMember.project_id,
+                ProjectMember.department,
+                Personnel.firstname,
+                Personnel.name,
             )
+            .join(Personnel, ProjectMember.pid == Personnel.id)
+            .where(ProjectMember.project_id.in_(query.with_entities(Project.id).order_by(None)))
         )
+        for member in member_rows:
+            members[member.project_id].append(member)
 
-        # Vectorized dictionary lookups (much faster than .get() in a loop)
-        df["requirement"] = df["requirement"].map(choices["requirement"]).fillna(df["requirement"])
-        df["location"] = df["location"].map(choices["location"]).fillna(df["location"])
-
-        # Apply custom CSV function to the whole column
-        df["students"] = df["students"].apply(lambda x: students_to_csv(x) if x else "")
+        df["members"] = [[get_name(m) for m in members[i]] for i in df["id"]]
+        df["departments"] = [[m.department for m in members[i]] for i in df["id"]]
 
     # Vectorized math
     if data in ["data", "budget"]:
@@ -746,14 +1032,7 @@ def get_projects_df(user=None, filter=None, years=None, data=None, order="desc")
             df[budget] = df[f"{budget}_1"].fillna(0) + df[f"{budget}_2"].fillna(0)
 
     # Column filtering and ordering
-    if data == "Excel":
-        columns = list(df.columns)
-        for col, pos in [("user", 1), ("department", 2), ("status", 5), ("has_budget", 6)]:
-            if col in columns:
-                columns.remove(col)
-                columns.insert(pos, col)
-
-    elif data == "budget":
+    if data == "budget":
         columns = [
             "id",
             "title",
@@ -830,11 +1109,10 @@ def get_project_division_bit(project) -> int:
     """
     Returns 1 if the project touches Primary, 2 if Secondary, or 3 if both.
     """
-    divs = str(project.divisions or "").split(",")
+    divs = project.divisions or []
 
-    # Example logic using your existing levels dict:
-    has_primary = any(d.strip().startswith(levels["Primaire"]) for d in divs)
-    has_secondary = any(d.strip().startswith(levels["Secondaire"]) for d in divs)
+    has_primary = any(d.startswith(levels["Primaire"]) for d in divs)
+    has_secondary = any(d.startswith(levels["Secondaire"]) for d in divs)
 
     bit = 0
     if has_primary:
@@ -850,27 +1128,19 @@ def get_comment_recipients(project, user):
 
     commenters = [comment.user.p for comment in project.comments]
 
-    personnels = get_cached_personnel()
-    gestionnaires_query = [p for p in personnels if p.role == "gestion"]
-
-    project_bit = get_project_division_bit(project)
-
-    gestionnaires = [
-        p
-        for p in gestionnaires_query
-        if p.user
-        and isinstance(p.user.preferences, dict)
-        and (p.user.preferences.get("notify_new_msg_team", 0) & project_bit) > 0
-    ]
+    gestionnaires = get_notification_recipients(
+        "notify_new_msg_team", get_project_division_bit(project), roles=("gestion",)
+    )
 
-    # Personnel recipients, filtered out for any None values
-    recipients = {r for r in ([creator] + members + commenters + gestionnaires) if r}
+    # Personnel recipients (ORM records or cached snapshots), unique by id,
+    # filtered out for any None values
+    recipients = {r.id: r for r in ([creator] + members + commenters + gestionnaires) if r}
 
     # Don't include the current user
-    recipients.discard(user.p)
+    recipients.pop(user.p.id, None)
 
     # Filter inactive personnels
-    recipients = [r for r in recipients if r.role != "inactive"]
+    recipients = [r for r in recipients.values() if r.role != "inactive"]
 
     return recipients
 
@@ -0,0 +1,228 @@
+# worker.py
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, update
+
+from .models import QueuedAction, db
+from .notifications import DeferredSend, SendError, run_queued_action
+from .utils import get_datetime
+
+logger = logging.getLogger(__name__)
+
+# seconds a claimed action is reserved for a worker (then another worker may take it over)
+LEASE_DURATION = 300
+
+# attempts before an action is moved to the dead letters (status "dead")
+MAX_ATTEMPTS = 5
+
+# retry delay after the n-th attempt: RETRY_BASE_DELAY * 2 ** (n - 1), at most RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff with jitter: a random delay between half and all of the backoff,
+    so that the actions failed during the same outage are not all retried at once.
+    """
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return round(random.uniform(delay / 2, delay))
+
+
+def is_claimable(now):
+    """Pending actions due for (re)try, and actions whose worker lease expired."""
+    return or_(
+        and_(
+            QueuedAction.status == "pending",
+            or_(QueuedAction.available_at.is_(None), QueuedAction.available_at <= now),
+        ),
+        and_(QueuedAction.status == "processing", QueuedAction.available_at <= now),
+    )
+
+
+def claim_actions(limit):
+    """
+    Claims up to limit queued actions and returns their ids.
+    Each action is claimed with a conditional UPDATE, so that concurrent workers
+    never claim the same action, and is leased for LEASE_DURATION seconds.
+    """
+    now = get_datetime()
+    action_ids = db.session.scalars(
+        select(QueuedAction.id).where(is_claimable(now)).order_by(QueuedAction.id).limit(limit)
+    ).all()
+
+    claimed = []
+    for action_id in action_ids:
+        result = db.session.execute(
+            update(QueuedAction)
+            .where(QueuedAction.id == action_id, is_claimable(now))
+            .values(
+                status="processing",
+                available_at=now + timedelta(seconds=LEASE_DURATION),
+                attempts=QueuedAction.attempts + 1,
+                # the action is no longer pending: a new one with the same key may be queued
+                dedup_key=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append(action_id)
+    db.session.commit()
+
+    return claimed
+
+
+def get_base_url(app):
+    """External URL of the app, used for the links of the notifications."""
+    scheme = app.config.get("PREFERRED_URL_SCHEME", "http")
+    return app.config.get("APP_URL") or f"{scheme}://{os.getenv('DOMAIN', 'localhost')}"
+
+
+def process_action(app, action_id):
+    """Executes a claimed action: deleted if done, else scheduled for retry or dead."""
+    # notifications are rendered with url_for(_external=True): use a request context
+    with app.test_request_context(base_url=get_base_url(app)):
+        action = db.session.get(QueuedAction, action_id)
+        if not action:
+            return
+
+        try:
+            error = run_queued_action(action)
+        except Exception as e:
+            logger.exception(f"Error executing queued action id={action_id}")
+            db.session.rollback()
+            action = db.session.get(QueuedAction, action_id)
+            error = SendError(f"{type(e).__name__}: {e}")
+
+        if error is None:
+            db.session.delete(action)
+            logger.info(f"Queued action id={action_id} done.")
+        elif isinstance(error, DeferredSend):
+            # outbound mail limits reached: not a failed attempt
+            action.status = "pending"
+            action.attempts -= 1
+            action.available_at = get_datetime() + timedelta(seconds=error.retry_after)
+            action.last_error = error
+            logger.info(f"Queued action id={action_id} deferred: {error}")
+        elif isinstance(error, SendError) and action.attempts < MAX_ATTEMPTS:
+            delay = retry_delay(action.attempts)
+            action.status = "pending"
+            action.available_at = get_datetime() + timedelta(seconds=delay)
+            action.last_error = error
+            logger.warning(
+                f"Queued action id={action_id} attempt {action.attempts} failed: {error} (retry in {delay}s)"
+            )
+        else:
+            action.status = "dead"
+            action.available_at = None
+            action.last_error = error
+            logger.error(
+                f"Queued action id={action_id} dead after {action.attempts} attempts: {error}"
+            )
+
+        db.session.commit()
+
+
+def get_queue_stats():
+    """Numbers of queued actions by status, with the due and oldest pending actions."""
+    now = get_datetime()
+    counts = dict(
+        db.session.execute(
+            select(QueuedAction.status, func.count(QueuedAction.id)).group_by(QueuedAction.status)
+        ).all()
+    )
+    due = db.session.scalar(
+        select(func.count(QueuedAction.id)).where(
+            QueuedAction.status == "pending",
+            or_(QueuedAction.available_at.is_(None), QueuedAction.available_at <= now),
+        )
+    )
+    oldest = db.session.scalar(
+        select(func.min(QueuedAction.timestamp)).where(QueuedAction.status == "pending")
+    )
+
+    return {
+        "pending": counts.get("pending", 0),
+        "due": due,
+        "processing": counts.get("processing", 0),
+        "dead": counts.get("dead", 0),
+        "oldest": oldest,
+    }
+
+
+def get_dead_actions(limit=20):
+    """Last dead actions (dead letters)."""
+    return db.session.scalars(
+        select(QueuedAction)
+        .where(QueuedAction.status == "dead")
+        .order_by(QueuedAction.id.desc())
+        .limit(limit)
+    ).all()
+
+
+def replay_dead_actions():
+    """Puts the dead actions back in the queue for new attempts, returns their number."""
+    result = db.session.execute(
+        update(QueuedAction)
+        .where(QueuedAction.status == "dead")
+        .values(status="pending", attempts=0, available_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount:
+        logger.info(f"{result.rowcount} dead queued action(s) replayed.")
+
+    return result.rowcount
+
+
+def run_worker(app, concurrency=4, batch_size=20, poll_interval=5.0, once=False):
+    """
+    Drains the queued actions, executing up to concurrency actions at a time.
+    With once, returns when no action is due, else polls every poll_interval seconds.
+    """
+    logger.info(f"Notifications worker started (concurrency={concurrency}).")
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="worker") as executor:
+        while True:
+            with app.app_context():
+                action_ids = claim_actions(batch_size)
+
+            if action_ids:
+                list(executor.map(lambda action_id: process_action(app, action_id), action_ids))
+            elif once:
+                break
+            else:
+                time.sleep(poll_interval)
+
+    logger.info("Notifications worker stopped.")
+
+
+def register_worker_commands(app):
+    """Registers the "flask notifications-worker" and "flask notifications-replay" commands."""
+
+    @app.cli.command("notifications-worker")
+    @click.option("--concurrency", default=4, show_default=True, help="Parallel sends.")
+    @click.option("--batch-size", default=20, show_default=True, help="Actions claimed at once.")
+    @click.option("--poll-interval", default=5.0, show_default=True, help="Seconds between polls.")
+    @click.option("--once", is_flag=True, help="Exit when no queued action is due.")
+    def notifications_worker(concurrency, batch_size, poll_interval, once):
+        """Sends the queued notifications (QueuedAction)."""
+        run_worker(
+            current_app._get_current_object(),
+            concurrency=concurrency,
+            batch_size=batch_size,
+            poll_interval=poll_interval,
+            once=once,
+        )
+
+    @app.cli.command("notifications-replay")
+    def notifications_replay():
+        """Puts the dead queued actions back in the queue."""
+        click.echo(f"{replay_dead_actions()} action(s) remise(s) en file d'attente.")